@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Retrieval benchmark: recall@k, MRR, nDCG@k and latency percentiles per backend.
+
+Scores every labeled query against each retrieval backend and writes a
+machine-readable JSON report, so a chunking or weighting change can be
+diffed against the previous run instead of eyeballed.
+
+Backends:
+    semantic  — match_chunks RPC (Supabase)
+    hybrid    — hybrid_search_chunks RPC (Supabase)
+    local     — in-process hybrid index over all_chunks.json (no network)
+
+Labels live in docs/evaluation/retrieval_labels.json as
+    {"reviewed": true, "queries": [{"id": ..., "query": ..., "relevant": [chunk ids]}]}
+The file is not committed until it has been hand-reviewed. --bootstrap seeds
+it from the rag_chunks_retrieved field of coach_k_v2_rag_eval.json, but those
+are hybrid_search_chunks' own top-k, so hybrid scores a perfect 1.0 against
+them by construction. Correct each relevant set against the chunks, then set
+"reviewed": true; until then every run prints a warning.
+
+Usage:
+    python3 scripts/benchmark_retrieval.py --bootstrap
+    python3 scripts/benchmark_retrieval.py --backends local
+    python3 scripts/benchmark_retrieval.py --baseline docs/evaluation/retrieval_benchmark.json
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from datetime import datetime
+
+from dotenv import load_dotenv
+from supabase import create_client
+
+from embedding_cache import embed_texts
+from local_index import LocalIndex
+import provider_client
+from test_rag_retrieval import hybrid_search, semantic_search
+
+load_dotenv()
+
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_ANON_KEY")
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+EVAL_DIR = os.path.join(os.path.dirname(__file__), "..", "docs", "evaluation")
+LABELS_PATH = os.path.join(EVAL_DIR, "retrieval_labels.json")
+RAG_EVAL_PATH = os.path.join(EVAL_DIR, "coach_k_v2_rag_eval.json")
+OUTPUT_PATH = os.path.join(EVAL_DIR, "retrieval_benchmark.json")
+BACKENDS = ["semantic", "hybrid", "local"]
+K_VALUES = [1, 3, 5, 10]
+SEMANTIC_THRESHOLD = 0.70
+
+
+# ── Labels ──────────────────────────────────────────────
+
+def bootstrap_labels(rag_eval_path=RAG_EVAL_PATH, labels_path=LABELS_PATH):
+    """Seed the label set from the chunks the RAG eval actually retrieved."""
+    with open(rag_eval_path, "r") as f:
+        rag_eval = json.load(f)
+    queries = [
+        {"id": r["id"], "query": r["prompt"], "relevant": r["rag_chunks_retrieved"]}
+        for r in rag_eval["results"]
+        if r.get("rag_chunks_retrieved")
+    ]
+    with open(labels_path, "w") as f:
+        json.dump({
+            "source": os.path.basename(rag_eval_path),
+            "note": "Bootstrapped from rag_chunks_retrieved — review and correct the relevant sets by hand.",
+            "reviewed": False,
+            "queries": queries,
+        }, f, indent=2)
+        f.write("\n")
+    print(f"Wrote {len(queries)} labeled queries to {labels_path}")
+    return queries
+
+
+def load_labels(labels_path=LABELS_PATH):
+    if not os.path.exists(labels_path):
+        print(f"ERROR: No label set at {labels_path} — run with --bootstrap, then review it by hand")
+        sys.exit(1)
+    with open(labels_path, "r") as f:
+        labels = json.load(f)
+    if not labels.get("reviewed"):
+        print(f"WARNING: {labels_path} is unreviewed --bootstrap output (hybrid's own top-k) — "
+              "hybrid scores are inflated until the relevant sets are corrected by hand")
+    return labels["queries"]
+
+
+# ── Metrics ─────────────────────────────────────────────
+
+def recall_at_k(retrieved, relevant, k):
+    if not relevant:
+        return 0.0
+    return len(set(retrieved[:k]) & set(relevant)) / len(relevant)
+
+
+def reciprocal_rank(retrieved, relevant):
+    relevant = set(relevant)
+    for rank, cid in enumerate(retrieved, start=1):
+        if cid in relevant:
+            return 1.0 / rank
+    return 0.0
+
+
+def ndcg_at_k(retrieved, relevant, k):
+    """Binary-relevance nDCG@k."""
+    relevant = set(relevant)
+    dcg = sum(1.0 / math.log2(rank + 1) for rank, cid in enumerate(retrieved[:k], start=1) if cid in relevant)
+    ideal = sum(1.0 / math.log2(rank + 1) for rank in range(1, min(len(relevant), k) + 1))
+    return dcg / ideal if ideal else 0.0
+
+
+def percentile(values, pct):
+    """Linear-interpolated percentile (pct in 0–100)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    pos = (len(ordered) - 1) * pct / 100
+    lo, hi = math.floor(pos), math.ceil(pos)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (pos - lo)
+
+
+def score_rankings(rankings, labels, k_values=K_VALUES):
+    """Aggregate recall@k, MRR and nDCG@k over queries. rankings: {query id: [chunk ids]}."""
+    n = len(labels)
+    metrics = {f"recall@{k}": 0.0 for k in k_values}
+    metrics.update({f"ndcg@{k}": 0.0 for k in k_values})
+    metrics["mrr"] = 0.0
+    for label in labels:
+        retrieved = rankings.get(label["id"], [])
+        for k in k_values:
+            metrics[f"recall@{k}"] += recall_at_k(retrieved, label["relevant"], k) / n
+            metrics[f"ndcg@{k}"] += ndcg_at_k(retrieved, label["relevant"], k) / n
+        metrics["mrr"] += reciprocal_rank(retrieved, label["relevant"]) / n
+    return {name: round(value, 4) for name, value in metrics.items()}
+
+
+def latency_summary(latencies_ms):
+    return {
+        "p50_ms": round(percentile(latencies_ms, 50), 2),
+        "p95_ms": round(percentile(latencies_ms, 95), 2),
+        "p99_ms": round(percentile(latencies_ms, 99), 2),
+        "mean_ms": round(sum(latencies_ms) / len(latencies_ms), 2) if latencies_ms else 0.0,
+    }
+
+
+# ── Benchmark ───────────────────────────────────────────
+
+def make_retriever(backend, supabase_client, local_index, count):
+    """Function (query, embedding) → ranked chunk ids for a backend."""
+    if backend == "semantic":
+        return lambda q, e: [r["id"] for r in semantic_search(supabase_client, e, threshold=SEMANTIC_THRESHOLD, count=count) or []]
+    if backend == "hybrid":
+        return lambda q, e: [r["id"] for r in hybrid_search(supabase_client, q, e, count=count) or []]
+    if backend == "local":
+        return lambda q, e: [r["id"] for r in local_index.hybrid_search(q, e, match_count=count)]
+    raise ValueError(f"Unknown backend: {backend}")
+
+
+def run_backend(backend, retrieve, labels, embeddings):
+    """Time each query against one backend and score the rankings."""
+    rankings, latencies_ms = {}, []
+    for label, embedding in zip(labels, embeddings):
+        start = time.perf_counter()
+        rankings[label["id"]] = retrieve(label["query"], embedding)
+        latencies_ms.append((time.perf_counter() - start) * 1000)
+    return {
+        "metrics": score_rankings(rankings, labels),
+        "latency": latency_summary(latencies_ms),
+        "rankings": rankings,
+    }
+
+
+def print_report(report, baseline=None):
+    """Table of metrics per backend, with deltas against a baseline report if given."""
+    columns = ["recall@1", "recall@5", "recall@10", "mrr", "ndcg@5", "ndcg@10"]
+    print(f"\n{'Backend':<10}" + "".join(f"{c:>11}" for c in columns) + f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    print("-" * (10 + 11 * len(columns) + 30))
+    for backend, result in report["backends"].items():
+        m, lat = result["metrics"], result["latency"]
+        print(f"{backend:<10}" + "".join(f"{m[c]:>11.3f}" for c in columns)
+              + f"{lat['p50_ms']:>10.1f}{lat['p95_ms']:>10.1f}{lat['p99_ms']:>10.1f}")
+        base = (baseline or {}).get("backends", {}).get(backend)
+        if base:
+            print(f"{'  Δ':<10}" + "".join(f"{m[c] - base['metrics'].get(c, 0):>+11.3f}" for c in columns)
+                  + "".join(f"{lat[p] - base['latency'].get(p, 0):>+10.1f}" for p in ("p50_ms", "p95_ms", "p99_ms")))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark retrieval quality and latency")
+    parser.add_argument("--bootstrap", action="store_true", help="(Re)create the label set from coach_k_v2_rag_eval.json and exit")
+    parser.add_argument("--labels", default=LABELS_PATH, help="Labeled query set (JSON)")
+    parser.add_argument("--backends", default=",".join(BACKENDS), help=f"Comma-separated backends (default: {','.join(BACKENDS)})")
+    parser.add_argument("--output", default=OUTPUT_PATH, help="Where to write the JSON report")
+    parser.add_argument("--baseline", help="Previous report to diff against")
+    args = parser.parse_args()
+
+    if args.bootstrap:
+        bootstrap_labels(labels_path=args.labels)
+        return
+
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    unknown = [b for b in backends if b not in BACKENDS]
+    if unknown:
+        print(f"ERROR: Unknown backends: {', '.join(unknown)} (choose from {', '.join(BACKENDS)})")
+        sys.exit(1)
+
+    labels = load_labels(args.labels)
+    count = max(K_VALUES)
+    openai_client = provider_client.openai_client(OPENAI_API_KEY)
+    needs_supabase = any(b in ("semantic", "hybrid") for b in backends)
+    supabase_client = create_client(SUPABASE_URL, SUPABASE_KEY) if needs_supabase else None
+    local_index = LocalIndex.from_chunks_file(openai_client) if "local" in backends else None
+
+    embeddings, api_tokens = embed_texts(openai_client, [l["query"] for l in labels], model=EMBEDDING_MODEL)
+    print(f"Benchmarking {len(labels)} queries on {', '.join(backends)} ({api_tokens} embedding API tokens)")
+
+    report = {
+        "timestamp": datetime.now().isoformat(),
+        "labels": os.path.basename(args.labels),
+        "query_count": len(labels),
+        "k_values": K_VALUES,
+        "backends": {},
+    }
+    for backend in backends:
+        print(f"  Running {backend}...")
+        retrieve = make_retriever(backend, supabase_client, local_index, count)
+        report["backends"][backend] = run_backend(backend, retrieve, labels, embeddings)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    baseline = None
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print_report(report, baseline)
+    print(f"\nReport saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
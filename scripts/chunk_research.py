@@ -11,23 +11,64 @@ Chunking strategy:
   4. If still too large, split at paragraph boundaries
   5. Add metadata (source_doc, section, topic_tags) to each chunk
 
+With --strategy semantic, steps 3-4 are replaced: each ## section is split
+into sentences (list items, table rows and ### headers count as one unit),
+the sentences are embedded in batches through the embedding cache, and a
+chunk is cut where a sentence is unusually dissimilar to the few before it
+(bottom SEMANTIC_BREAK_PERCENTILE of the document) or where the next sentence
+would exceed the token limit. No "(part i/n)" splits, no cross-section merges.
+
+Chunking is incremental: each document's chunks are cached in .cache/chunks/
+together with the source file's mtime, size and sha256 and the chunking
+parameters. Only documents whose source or parameters changed are re-chunked
+(ids are per document, so unchanged documents keep theirs), and
+all_chunks.json is only rewritten when the merged output actually changes.
+
+With --jobs N, documents are chunked in a process pool. Each document's chunks
+are appended to all_chunks.jsonl as soon as it finishes (completion order),
+followed by an end-of-stream marker once every document is done, so
+`embed_and_upload.py --follow` can embed and upload while chunking is still
+running. Each run starts a new file (with its own run id) that atomically
+replaces the previous one, so a follower never mistakes the last run's
+finished file for this one. all_chunks.json is still merged in RESEARCH_FILES order, and ids only
+depend on the document, so the output does not depend on N.
+
 Usage:
     python scripts/chunk_research.py
     python scripts/chunk_research.py --max-tokens 600
     python scripts/chunk_research.py --dry-run
+    python scripts/chunk_research.py --force       # ignore the cache
+    python scripts/chunk_research.py --jobs 4
+    python scripts/chunk_research.py --strategy semantic   # needs OPENAI_API_KEY (cached)
 """
 
+import hashlib
 import json
 import re
 import sys
 import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 
+import numpy as np
+
+from embedding_cache import DEFAULT_EMBEDDING_MODEL, embed_texts
+from jsonl_stream import open_stream
+from token_counter import count_tokens, count_tokens_batch, tokenizer_name
+
 # Configuration
 MAX_TOKENS = 800       # Target max tokens per chunk
 MIN_TOKENS = 50        # Skip chunks smaller than this (metadata remnants)
 OVERLAP_TOKENS = 50    # Overlap between split chunks for context continuity
 WORDS_PER_TOKEN = 0.75 # Conservative: 1 token ≈ 0.75 words (for estimation)
+MERGE_THRESHOLD = 300  # Merge chunks under this size with their neighbor
+CHUNKER_VERSION = 1    # Bump when the chunking logic changes, to invalidate cached chunks
+
+# Semantic strategy
+SEMANTIC_WINDOW = 3               # Compare each sentence with the mean of the previous N in its section
+SEMANTIC_BREAK_PERCENTILE = 20    # Cut at similarities in the lowest N% of the document
+SEMANTIC_MIN_TOKENS = 150         # Don't cut on similarity before a chunk reaches this size
+SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9*\"'(\[])")
 
 # Files to process — the "best" version of each research output
 # Order matters for consistent chunk IDs
@@ -89,11 +130,12 @@ DOC_TOPICS = {
 
 COMPLETED_DIR = Path("docs/research/completed")
 OUTPUT_DIR = Path("docs/chunks")
+CACHE_DIR = Path(".cache/chunks")
 
 
 def estimate_tokens(text: str) -> int:
-    """Estimate token count from text. Conservative: 1 word ≈ 1.3 tokens."""
-    return int(len(text.split()) * 1.3)
+    """Token count from the shared counter (local tokenizer if present, else 1 word ≈ 1.3 tokens)."""
+    return count_tokens(text)
 
 
 def extract_content(filepath: Path) -> str:
@@ -157,30 +199,32 @@ def split_by_headers(content: str, level: str = "## ") -> list[dict]:
 def split_by_paragraphs(text: str, max_tokens: int, overlap_tokens: int) -> list[str]:
     """Split text into paragraph-boundary chunks that fit within max_tokens."""
     paragraphs = re.split(r"\n\n+", text)
+    para_token_counts = count_tokens_batch(paragraphs)
     chunks = []
     current_chunk = []
     current_tokens = 0
+    current_counts = []
 
-    for para in paragraphs:
-        para_tokens = estimate_tokens(para)
+    for para, para_tokens in zip(paragraphs, para_token_counts):
 
         if current_tokens + para_tokens > max_tokens and current_chunk:
             chunks.append("\n\n".join(current_chunk))
 
             # Overlap: keep last paragraph for context
             if overlap_tokens > 0 and current_chunk:
-                last = current_chunk[-1]
-                if estimate_tokens(last) <= overlap_tokens:
-                    current_chunk = [last]
-                    current_tokens = estimate_tokens(last)
+                last, last_tokens = current_chunk[-1], current_counts[-1]
+                if last_tokens <= overlap_tokens:
+                    current_chunk, current_counts = [last], [last_tokens]
+                    current_tokens = last_tokens
                 else:
-                    current_chunk = []
+                    current_chunk, current_counts = [], []
                     current_tokens = 0
             else:
-                current_chunk = []
+                current_chunk, current_counts = [], []
                 current_tokens = 0
 
         current_chunk.append(para)
+        current_counts.append(para_tokens)
         current_tokens += para_tokens
 
     if current_chunk:
@@ -315,7 +359,6 @@ def chunk_document(filepath: Path, max_tokens: int) -> list[dict]:
                         chunk_index += 1
 
     # Merge pass: combine consecutive small chunks from the same document
-    MERGE_THRESHOLD = 300  # Merge chunks under this size with their neighbor
     merged = merge_small_chunks(raw_chunks, max_tokens, MERGE_THRESHOLD)
 
     # Re-index after merging
@@ -326,27 +369,258 @@ def chunk_document(filepath: Path, max_tokens: int) -> list[dict]:
     return merged
 
 
+def split_sentences(text: str) -> list[tuple[str, str]]:
+    """Split markdown into (separator, unit) pairs; "".join(sep + unit) rebuilds the text.
+
+    Prose paragraphs split into sentences; list items, table rows and headers
+    are one unit per line; blocks are separated by blank lines.
+    """
+    units = []
+    for block in re.split(r"\n\s*\n", text):
+        block = block.strip()
+        if not block:
+            continue
+        sep = "\n\n"
+        for line in block.split("\n"):
+            stripped = line.strip()
+            structural = re.match(r"(#|\||[-*+] |\d+[.)] |>)", stripped)
+            pieces = [stripped] if structural else SENTENCE_END_RE.split(stripped)
+            for i, piece in enumerate(pieces):
+                if piece:
+                    units.append((sep if i == 0 else " ", piece))
+            sep = "\n"
+    if units:
+        units[0] = ("", units[0][1])
+    return units
+
+
+def get_openai_client():
+    """OpenAI client for sentence embeddings (only needed by the semantic strategy)."""
+    from dotenv import load_dotenv
+    from provider_client import openai_client
+
+    load_dotenv()
+    return openai_client()
+
+
+def chunk_document_semantic(filepath: Path, max_tokens: int, openai_client=None) -> list[dict]:
+    """Chunk a research document at embedding-similarity drops between sentences."""
+    filename = filepath.name
+    doc_key = filename.split("_202")[0]
+
+    content = extract_content(filepath)
+    if not content:
+        print(f"  WARNING: No content extracted from {filename}")
+        return []
+
+    sections = [s for s in split_by_headers(content, "## ") if estimate_tokens(s["content"]) >= MIN_TOKENS]
+    section_units = [split_sentences(s["content"]) for s in sections]
+    texts = [unit for units in section_units for _, unit in units]
+    if not texts:
+        return []
+
+    # One batched embedding pass over every sentence in the document (cache hits are free)
+    embeddings, _ = embed_texts(openai_client or get_openai_client(), texts, DEFAULT_EMBEDDING_MODEL)
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    unit_tokens = count_tokens_batch(texts)
+
+    # Similarity of each sentence to the mean of the previous SEMANTIC_WINDOW in its section
+    similarities = []
+    offset = 0
+    for units in section_units:
+        sims = [1.0]
+        for i in range(1, len(units)):
+            window = vectors[offset + max(0, i - SEMANTIC_WINDOW):offset + i].mean(axis=0)
+            sims.append(float(window @ vectors[offset + i] / max(np.linalg.norm(window), 1e-12)))
+        similarities.append(sims)
+        offset += len(units)
+    all_sims = [s for sims in similarities for s in sims[1:]]
+    threshold = float(np.percentile(all_sims, SEMANTIC_BREAK_PERCENTILE)) if all_sims else -1.0
+
+    chunks = []
+    offset = 0
+    for section, units, sims in zip(sections, section_units, similarities):
+        tokens = unit_tokens[offset:offset + len(units)]
+        offset += len(units)
+
+        groups = []  # [(units, tokens)]
+        current, current_tokens = [], 0
+        for unit, sim, unit_tok in zip(units, sims, tokens):
+            # +1 per unit: counts of the joined text can exceed the sum of per-sentence counts
+            too_big = current and current_tokens + unit_tok + len(current) + 1 > max_tokens
+            topic_shift = current_tokens >= SEMANTIC_MIN_TOKENS and sim < threshold
+            if too_big or topic_shift:
+                groups.append((current, current_tokens))
+                current, current_tokens = [], 0
+            current.append(unit)
+            current_tokens += unit_tok
+        if current:
+            # A short tail joins the previous piece of the section when it fits
+            if groups and current_tokens < SEMANTIC_MIN_TOKENS and \
+                    groups[-1][1] + current_tokens + len(groups[-1][0]) + len(current) <= max_tokens:
+                groups[-1] = (groups[-1][0] + current, groups[-1][1] + current_tokens)
+            else:
+                groups.append((current, current_tokens))
+
+        subheader = ""  # ### header in effect where the current piece starts
+        for group, _ in groups:
+            if group[0][1].startswith("### "):
+                subheader = group[0][1].lstrip("#").strip()
+            header = f"{section['header']} > {subheader}" if subheader else section["header"]
+            for _, unit in group:
+                if unit.startswith("### "):
+                    subheader = unit.lstrip("#").strip()
+
+            text = "".join(sep + unit for sep, unit in group).strip()
+            tokens_in_chunk = estimate_tokens(text)
+            if tokens_in_chunk < MIN_TOKENS:
+                continue
+            chunks.append({
+                "id": f"{doc_key}_{len(chunks):03d}",
+                "source_doc": filename,
+                "source_name": DOC_NAMES.get(doc_key, doc_key),
+                "section": header,
+                "content": text,
+                "word_count": len(text.split()),
+                "est_tokens": tokens_in_chunk,
+                "topic_tags": DOC_TOPICS.get(doc_key, []),
+                "chunk_index": len(chunks),
+            })
+
+    return chunks
+
+
+def chunk_params(doc_key: str, max_tokens: int, strategy: str = "headers") -> dict:
+    """Everything besides the source text that determines a document's chunks."""
+    params = {
+        "version": CHUNKER_VERSION,
+        "strategy": strategy,
+        "max_tokens": max_tokens,
+        "min_tokens": MIN_TOKENS,
+        "token_counter": tokenizer_name(),
+        "source_name": DOC_NAMES.get(doc_key, doc_key),
+        "topic_tags": DOC_TOPICS.get(doc_key, []),
+    }
+    if strategy == "semantic":
+        params.update({
+            "embedding_model": DEFAULT_EMBEDDING_MODEL,
+            "window": SEMANTIC_WINDOW,
+            "break_percentile": SEMANTIC_BREAK_PERCENTILE,
+            "semantic_min_tokens": SEMANTIC_MIN_TOKENS,
+        })
+    else:
+        params.update({"overlap_tokens": OVERLAP_TOKENS, "merge_threshold": MERGE_THRESHOLD})
+    return params
+
+
+def chunk_document_cached(filepath: Path, max_tokens: int, force: bool = False,
+                          strategy: str = "headers") -> tuple[list[dict], bool]:
+    """Chunk a document through the per-document cache. Returns (chunks, from_cache)."""
+    doc_key = filepath.name.split("_202")[0]
+    params = chunk_params(doc_key, max_tokens, strategy)
+    cache_path = CACHE_DIR / f"{filepath.name}.json"
+    stat = filepath.stat()
+
+    cached = None
+    if not force and cache_path.exists():
+        with open(cache_path, encoding="utf-8") as f:
+            cached = json.load(f)
+        if cached.get("params") != params:
+            cached = None
+
+    # Unchanged mtime + size: trust the cache without reading the source
+    if cached and cached["mtime_ns"] == stat.st_mtime_ns and cached["size"] == stat.st_size:
+        return cached["chunks"], True
+
+    digest = hashlib.sha256(filepath.read_bytes()).hexdigest()
+    if cached and cached["sha256"] == digest:
+        chunks = cached["chunks"]  # touched but not edited
+        from_cache = True
+    elif strategy == "semantic":
+        chunks = chunk_document_semantic(filepath, max_tokens)
+        from_cache = False
+    else:
+        chunks = chunk_document(filepath, max_tokens)
+        from_cache = False
+
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    with open(cache_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "sha256": digest,
+            "params": params,
+            "chunks": chunks,
+        }, f, ensure_ascii=False)
+    return chunks, from_cache
+
+
+def chunk_documents(filepaths: list[Path], max_tokens: int, force: bool = False, jobs: int = 1,
+                    strategy: str = "headers"):
+    """Yield (filepath, chunks, from_cache) for each document as it finishes.
+
+    Serial for jobs <= 1 (input order); otherwise a process pool, in completion order.
+    """
+    if jobs <= 1:
+        for filepath in filepaths:
+            yield filepath, *chunk_document_cached(filepath, max_tokens, force, strategy)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(chunk_document_cached, fp, max_tokens, force, strategy): fp for fp in filepaths}
+        for future in as_completed(futures):
+            yield futures[future], *future.result()
+
+
 def main():
     parser = argparse.ArgumentParser(description="Chunk research documents for RAG embedding")
     parser.add_argument("--max-tokens", type=int, default=MAX_TOKENS,
                         help=f"Maximum tokens per chunk (default: {MAX_TOKENS})")
     parser.add_argument("--dry-run", action="store_true",
                         help="Print stats without saving")
+    parser.add_argument("--force", action="store_true",
+                        help="Re-chunk every document, ignoring the chunk cache")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="Documents to chunk in parallel (default: 1)")
+    parser.add_argument("--strategy", choices=["headers", "semantic"], default="headers",
+                        help="headers: ##/###/paragraph splits (default); semantic: cut at sentence-embedding similarity drops")
     args = parser.parse_args()
 
     all_chunks = []
     doc_stats = []
+    rechunked = 0
 
-    print(f"Chunking research documents (max {args.max_tokens} tokens/chunk)")
+    print(f"Chunking research documents ({args.strategy}, max {args.max_tokens} tokens/chunk, {tokenizer_name()})")
     print(f"{'='*60}\n")
 
+    filepaths = []
     for filename in RESEARCH_FILES:
         filepath = COMPLETED_DIR / filename
         if not filepath.exists():
             print(f"  SKIP: {filename} not found")
             continue
-
-        chunks = chunk_document(filepath, args.max_tokens)
+        filepaths.append(filepath)
+
+    # Stream each finished document to the JSONL sidecar; merge in file order afterwards
+    stream = None if args.dry_run else open_stream(OUTPUT_DIR / "all_chunks.jsonl")
+    results = {}
+    try:
+        for filepath, chunks, from_cache in chunk_documents(filepaths, args.max_tokens, args.force, args.jobs, args.strategy):
+            results[filepath.name] = chunks, from_cache
+            rechunked += not from_cache
+            if stream:
+                for chunk in chunks:
+                    stream.write(chunk)
+                stream.flush()
+        if stream:
+            stream.finish(documents=len(results), chunks=stream.count)
+    finally:
+        if stream:
+            stream.close()
+
+    for filepath in filepaths:
+        filename = filepath.name
+        chunks, from_cache = results[filename]
         all_chunks.extend(chunks)
 
         doc_key = filename.split("_202")[0]
@@ -363,9 +637,11 @@ def main():
             "avg_tokens": avg_tokens,
         })
 
-        print(f"  {doc_key}: {len(chunks)} chunks, {total_words:,} words, ~{total_tokens:,} tokens (avg {avg_tokens}/chunk)")
+        print(f"  {doc_key}: {len(chunks)} chunks, {total_words:,} words, ~{total_tokens:,} tokens (avg {avg_tokens}/chunk)"
+              f"{' (cached)' if from_cache else ''}")
 
     print(f"\n{'='*60}")
+    print(f"Re-chunked {rechunked} of {len(doc_stats)} documents")
     print(f"Total: {len(all_chunks)} chunks")
     print(f"Total words: {sum(c['word_count'] for c in all_chunks):,}")
     print(f"Total est. tokens: {sum(c['est_tokens'] for c in all_chunks):,}")
@@ -400,8 +676,12 @@ def main():
     OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
     chunks_file = OUTPUT_DIR / "all_chunks.json"
-    with open(chunks_file, "w") as f:
-        json.dump(all_chunks, f, indent=2, ensure_ascii=False)
+    output = json.dumps(all_chunks, indent=2, ensure_ascii=False)
+    if chunks_file.exists() and chunks_file.read_text(encoding="utf-8") == output:
+        print(f"\nChunks unchanged: {chunks_file}")
+        return
+    with open(chunks_file, "w", encoding="utf-8") as f:
+        f.write(output)
     print(f"\nChunks saved to: {chunks_file}")
 
     # Save stats
@@ -409,7 +689,9 @@ def main():
     with open(stats_file, "w") as f:
         f.write("# Chunk Statistics\n\n")
         f.write(f"**Generated**: {__import__('datetime').datetime.now().isoformat()}\n")
+        f.write(f"**Strategy**: {args.strategy}\n")
         f.write(f"**Max tokens/chunk**: {args.max_tokens}\n")
+        f.write(f"**Token counter**: {tokenizer_name()}\n")
         f.write(f"**Total chunks**: {len(all_chunks)}\n")
         f.write(f"**Total words**: {sum(c['word_count'] for c in all_chunks):,}\n")
         f.write(f"**Total est. tokens**: {sum(c['est_tokens'] for c in all_chunks):,}\n")
@@ -1,126 +1,121 @@
 #!/usr/bin/env python3
-"""Combine all raw JSONL training files into shuffled train/eval split."""
+"""Combine all raw JSONL training files into a hash-split train/eval set.
 
-import json
+Streams raw/ once: each valid example is assigned to train or eval from its
+content hash and, if it is not already in combined/, appended to all.jsonl
+and its split file. Adding a raw file therefore only appends its examples
+and never moves existing ones between train and eval. Use --full to rewrite
+the combined files from scratch (e.g. after deleting raw examples).
+
+Usage:
+    python3 scripts/combine_training_data.py
+    python3 scripts/combine_training_data.py --full
+"""
+
+import argparse
 import os
-import random
 import glob
+from array import array
+
+from jsonl_stream import SplitWriter, example_hash, is_eval, iter_jsonl
+from token_counter import count_tokens_batch, tokenizer_name
 
 RAW_DIR = os.path.join(os.path.dirname(__file__), '..', 'docs', 'training-data', 'raw')
 COMBINED_DIR = os.path.join(os.path.dirname(__file__), '..', 'docs', 'training-data', 'combined')
-SEED = 42
 EVAL_RATIO = 0.10
 
-def load_all_examples():
-    """Load and validate all JSONL files from raw directory."""
-    examples = []
-    file_stats = {}
+def iter_examples(file_stats):
+    """Stream valid examples from all JSONL files in the raw directory as (source, example).
 
+    Fills file_stats with the per-file count as each file finishes.
+    """
     for filepath in sorted(glob.glob(os.path.join(RAW_DIR, '*.jsonl'))):
         basename = os.path.basename(filepath)
         count = 0
-        with open(filepath) as f:
-            for line_num, line in enumerate(f, 1):
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    obj = json.loads(line)
-                    if 'messages' not in obj:
-                        print(f"  WARNING: {basename}:{line_num} - missing 'messages' key")
-                        continue
-                    msgs = obj['messages']
-                    if len(msgs) < 2:
-                        print(f"  WARNING: {basename}:{line_num} - fewer than 2 messages")
-                        continue
-                    # Tag with source for tracking
-                    obj['_source'] = basename
-                    examples.append(obj)
-                    count += 1
-                except json.JSONDecodeError as e:
-                    print(f"  ERROR: {basename}:{line_num} - invalid JSON: {e}")
+        for line_num, obj, error in iter_jsonl(filepath):
+            if error:
+                print(f"  ERROR: {basename}:{line_num} - invalid JSON: {error}")
+                continue
+            if 'messages' not in obj:
+                print(f"  WARNING: {basename}:{line_num} - missing 'messages' key")
+                continue
+            msgs = obj['messages']
+            if len(msgs) < 2:
+                print(f"  WARNING: {basename}:{line_num} - fewer than 2 messages")
+                continue
+            count += 1
+            yield basename, obj
 
         file_stats[basename] = count
         print(f"  {basename}: {count} examples")
 
-    return examples, file_stats
-
 
-def estimate_tokens(text):
-    """Rough token estimate: ~4 chars per token for English."""
-    return len(text) // 4
+def example_tokens(example):
+    """Token count of all message content (local tokenizer if present, else 1 word ≈ 1.3 tokens)."""
+    return sum(count_tokens_batch(msg.get('content', '') for msg in example['messages']))
 
 
-def compute_stats(examples):
-    """Compute token statistics for the dataset."""
-    token_counts = []
-    for ex in examples:
-        total_text = ""
-        for msg in ex['messages']:
-            total_text += msg.get('content', '')
-        token_counts.append(estimate_tokens(total_text))
+def compute_stats(token_counts):
+    """Compute token statistics from an iterable of per-example token counts (single pass)."""
+    count = total = 0
+    lo = hi = None
+    for tokens in token_counts:
+        count += 1
+        total += tokens
+        lo = tokens if lo is None else min(lo, tokens)
+        hi = tokens if hi is None else max(hi, tokens)
 
     return {
-        'count': len(token_counts),
-        'total_tokens': sum(token_counts),
-        'avg_tokens': sum(token_counts) // len(token_counts) if token_counts else 0,
-        'min_tokens': min(token_counts) if token_counts else 0,
-        'max_tokens': max(token_counts) if token_counts else 0,
+        'count': count,
+        'total_tokens': total,
+        'avg_tokens': total // count if count else 0,
+        'min_tokens': lo or 0,
+        'max_tokens': hi or 0,
     }
 
 
-def main():
+def main(full=False):
     print("=" * 60)
     print("Combining JSONL training data")
     print("=" * 60)
 
-    # Load all examples
+    # Single pass: validate, split by content hash and append anything new to combined/,
+    # keeping only each example's hash, token count and source file for the stats
     print(f"\nLoading from: {os.path.abspath(RAW_DIR)}")
-    examples, file_stats = load_all_examples()
-    print(f"\nTotal loaded: {len(examples)} examples from {len(file_stats)} files")
-
-    # Shuffle deterministically
-    random.seed(SEED)
-    random.shuffle(examples)
-
-    # Split
-    eval_count = max(1, int(len(examples) * EVAL_RATIO))
-    eval_examples = examples[:eval_count]
-    train_examples = examples[eval_count:]
-
-    print(f"\nSplit: {len(train_examples)} train / {len(eval_examples)} eval ({EVAL_RATIO*100:.0f}%)")
-
-    # Remove _source tag before writing
-    def clean(ex):
-        ex_copy = {k: v for k, v in ex.items() if k != '_source'}
-        return ex_copy
-
-    # Write train.jsonl
+    file_stats = {}
+    hashes, token_counts, source_ixs = array('Q'), array('L'), array('H')
+    sources = []
     os.makedirs(COMBINED_DIR, exist_ok=True)
-    train_path = os.path.join(COMBINED_DIR, 'train.jsonl')
-    with open(train_path, 'w') as f:
-        for ex in train_examples:
-            f.write(json.dumps(clean(ex), ensure_ascii=False) + '\n')
-
-    # Write eval.jsonl
-    eval_path = os.path.join(COMBINED_DIR, 'eval.jsonl')
-    with open(eval_path, 'w') as f:
-        for ex in eval_examples:
-            f.write(json.dumps(clean(ex), ensure_ascii=False) + '\n')
-
-    # Also write all.jsonl (for Nebius fine-tuning)
-    all_path = os.path.join(COMBINED_DIR, 'all.jsonl')
-    with open(all_path, 'w') as f:
-        for ex in examples:
-            f.write(json.dumps(clean(ex), ensure_ascii=False) + '\n')
+    with SplitWriter(COMBINED_DIR, EVAL_RATIO, full=full, source="combine") as split:
+        for source, ex in iter_examples(file_stats):
+            if not sources or sources[-1] != source:
+                sources.append(source)
+            h = example_hash(ex)
+            split.add(ex, h)
+            hashes.append(h)
+            token_counts.append(example_tokens(ex))
+            source_ixs.append(len(sources) - 1)
+    train_path, eval_path, all_path = split.paths['train'], split.paths['eval'], split.paths['all']
+    in_eval = [is_eval(h, EVAL_RATIO) for h in hashes]
+    eval_count = sum(in_eval)
+    train_count = len(hashes) - eval_count
+
+    print(f"\nTotal loaded: {len(hashes)} examples from {len(file_stats)} files")
+    print(f"\nSplit: {train_count} train / {eval_count} eval ({EVAL_RATIO*100:.0f}%)")
+    if split.full:
+        print(f"Rewrote combined files ({split.written['train']} train / {split.written['eval']} eval)")
+    else:
+        print(f"Appended {split.written['train']} train / {split.written['eval']} eval new examples")
+    if split.removed:
+        print(f"WARNING: {split.removed} combined examples are no longer in raw/ — rerun with --full to drop them")
 
     # Stats
-    train_stats = compute_stats(train_examples)
-    eval_stats = compute_stats(eval_examples)
-    all_stats = compute_stats(examples)
+    train_stats = compute_stats(t for t, e in zip(token_counts, in_eval) if not e)
+    eval_stats = compute_stats(t for t, e in zip(token_counts, in_eval) if e)
+    all_stats = compute_stats(token_counts)
 
     print(f"\n{'=' * 60}")
-    print(f"DATASET STATISTICS")
+    print(f"DATASET STATISTICS ({tokenizer_name()})")
     print(f"{'=' * 60}")
     print(f"{'':20s} {'Train':>10s} {'Eval':>10s} {'Total':>10s}")
     print(f"{'-' * 50}")
@@ -157,14 +152,17 @@ def main():
 
     # Verify eval has representation from different sources
     eval_sources = {}
-    for ex in eval_examples:
-        src = ex.get('_source', 'unknown')
-        eval_sources[src] = eval_sources.get(src, 0) + 1
+    for source_ix, e in zip(source_ixs, in_eval):
+        if e:
+            src = sources[source_ix]
+            eval_sources[src] = eval_sources.get(src, 0) + 1
 
     print(f"\nEval set source distribution:")
     for src, cnt in sorted(eval_sources.items()):
         print(f"  {src}: {cnt}")
 
-
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description="Combine raw JSONL training files into train/eval splits")
+    parser.add_argument("--full", action="store_true", help="Rewrite combined/ from scratch instead of appending new examples")
+    args = parser.parse_args()
+    main(full=args.full)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Token-budgeted context assembly for the RAG prompts.
+
+Replaces "concatenate the top 5 chunks whole" with a builder that, given a
+token budget:
+  - splits each retrieved chunk into paragraphs and ranks them by overlap
+    with the query terms, keeping the most relevant ones
+  - drops paragraphs that repeat (or nearly repeat) text already taken from
+    the same source document
+  - stops adding text once the budget is reached
+
+Output keeps the original "### Source i" layout, with each chunk's kept
+paragraphs in their original order.
+
+Usage:
+    context, stats = build_budgeted_context(chunks, query, token_budget=1500)
+    stats["tokens_saved"]  # vs. the full top-k context
+"""
+
+import re
+
+from local_index import tokenize
+from token_counter import count_tokens
+
+DEFAULT_TOKEN_BUDGET = 1500
+NEAR_DUPLICATE_JACCARD = 0.8
+EMPTY_CONTEXT = "No relevant knowledge found in the database."
+
+
+def estimate_tokens(text):
+    """Same counter chunk_research.py uses for est_tokens (local tokenizer if present, else words × 1.3)."""
+    return count_tokens(text)
+
+
+def source_key(chunk):
+    """Source document of a chunk. RPC rows have no source_doc, so fall back to the id prefix."""
+    if chunk.get("source_doc"):
+        return chunk["source_doc"]
+    return chunk.get("id", "").rsplit("_", 1)[0] or chunk.get("source_name", "")
+
+
+def split_paragraphs(content):
+    return [p.strip() for p in re.split(r"\n\s*\n", content) if p.strip()]
+
+
+def chunk_header(i, chunk):
+    return f"### Source {i}: {chunk.get('source_name', 'Unknown')}\n**Section**: {chunk.get('section', '')}\n\n"
+
+
+def render_context(sections):
+    """sections: [(header, [paragraphs])] → context string in the build_context layout."""
+    if not sections:
+        return EMPTY_CONTEXT
+    return "\n\n---\n\n".join(header + "\n\n".join(paragraphs) for header, paragraphs in sections)
+
+
+def full_context(chunks):
+    """The untrimmed top-k context, as build_context has always produced it."""
+    return render_context([(chunk_header(i + 1, c), [c.get("content", "")]) for i, c in enumerate(chunks or [])])
+
+
+def _is_duplicate(terms, seen_term_sets):
+    for seen in seen_term_sets:
+        union = terms | seen
+        if union and len(terms & seen) / len(union) >= NEAR_DUPLICATE_JACCARD:
+            return True
+    return False
+
+
+def build_budgeted_context(chunks, query, token_budget=DEFAULT_TOKEN_BUDGET):
+    """Assemble at most `token_budget` estimated tokens of query-relevant context.
+
+    Returns (context, stats) where stats has tokens_full, tokens_used,
+    tokens_saved, chunks_used and paragraphs_dropped.
+    """
+    full_tokens = estimate_tokens(full_context(chunks))
+    if not chunks:
+        return EMPTY_CONTEXT, {
+            "tokens_full": full_tokens, "tokens_used": full_tokens, "tokens_saved": 0,
+            "chunks_used": 0, "paragraphs_dropped": 0,
+        }
+
+    query_terms = set(tokenize(query))
+    seen_by_source = {}  # source → [term sets of paragraphs already kept]
+    sections = []
+    used = dropped = 0
+
+    for chunk in chunks:
+        header = chunk_header(len(sections) + 1, chunk)
+        header_tokens = estimate_tokens(header) + 2  # + the "---" separator and rounding slack
+        if used + header_tokens >= token_budget:
+            break
+
+        paragraphs = split_paragraphs(chunk.get("content", ""))
+        term_sets = [set(tokenize(p)) for p in paragraphs]
+        # Most query-relevant first; a chunk with no overlap at all still offers its lead paragraph
+        relevance = [len(terms & query_terms) for terms in term_sets]
+        order = sorted(range(len(paragraphs)), key=lambda ix: (-relevance[ix], ix))
+        if not any(relevance):
+            order = order[:1]
+
+        seen = seen_by_source.setdefault(source_key(chunk), [])
+        kept, kept_tokens = [], header_tokens
+        for ix in order:
+            if relevance[ix] == 0 and kept:
+                break
+            if _is_duplicate(term_sets[ix], seen):
+                continue
+            cost = estimate_tokens(paragraphs[ix]) + 1  # per-piece estimates round down
+            if used + kept_tokens + cost > token_budget:
+                continue
+            kept.append(ix)
+            kept_tokens += cost
+            seen.append(term_sets[ix])
+
+        dropped += len(paragraphs) - len(kept)
+        if kept:
+            sections.append((header, [paragraphs[ix] for ix in sorted(kept)]))
+            used += kept_tokens
+
+    context = render_context(sections)
+    used_tokens = estimate_tokens(context)
+    return context, {
+        "tokens_full": full_tokens,
+        "tokens_used": used_tokens,
+        "tokens_saved": max(0, full_tokens - used_tokens),
+        "chunks_used": len(sections),
+        "paragraphs_dropped": dropped,
+    }
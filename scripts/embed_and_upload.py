@@ -1,20 +1,43 @@
 #!/usr/bin/env python3
 """
-Embed all 239 research chunks via OpenAI text-embedding-3-small
+Embed research chunks via OpenAI text-embedding-3-small
 and upload them to Supabase knowledge_chunks table.
 
+Incremental by default: a manifest (chunk id → content hash → embedding model)
+records what is already in knowledge_chunks, so only new or changed chunks are
+embedded and upserted, and chunks no longer in all_chunks.json are deleted.
+Every run that changes knowledge_chunks bumps the manifest's corpus_version,
+which invalidates cached retrieval results (retrieval_cache.py).
+
+With --follow, chunks are read from the all_chunks.jsonl sidecar that
+chunk_research.py appends to as each document finishes, and are embedded and
+upserted in batches while chunking is still running. Deletions, the manifest
+and the corpus version wait for the sidecar's end-of-stream marker, since
+only then is the full chunk set known. A sidecar left finished by an earlier
+run is ignored; --follow waits for the next chunking run to replace it.
+
 Usage: python3 scripts/embed_and_upload.py
+       python3 scripts/embed_and_upload.py --full   # re-embed and re-upload everything
+       python3 scripts/chunk_research.py --jobs 4 & python3 scripts/embed_and_upload.py --follow
 """
 
+import argparse
+import hashlib
 import json
 import os
 import sys
-import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from dotenv import load_dotenv
-from openai import OpenAI
 from supabase import create_client
 
+from embedding_cache import embed_texts
+from jsonl_stream import follow_jsonl
+import provider_client
+from provider_client import provider_budget
+from rate_limit import error_status, estimate_request_tokens, with_backoff
+
 # Load environment
 load_dotenv()
 
@@ -23,8 +46,15 @@ SUPABASE_KEY = os.getenv("SUPABASE_ANON_KEY")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
 CHUNKS_PATH = os.path.join(os.path.dirname(__file__), "..", "docs", "chunks", "all_chunks.json")
+CHUNKS_STREAM_PATH = os.path.join(os.path.dirname(__file__), "..", "docs", "chunks", "all_chunks.jsonl")
+MANIFEST_PATH = os.path.join(os.path.dirname(__file__), "..", "docs", "chunks", "embed_manifest.json")
 EMBEDDING_MODEL = "text-embedding-3-small"
+CHECKPOINT_PATH = os.path.join(os.path.dirname(__file__), "..", ".cache", "upload_checkpoint.json")
 BATCH_SIZE = 100  # OpenAI supports up to 2048 inputs per request
+EMBEDDING_TPM = 1_000_000
+UPLOAD_WORKERS = 4
+MAX_UPLOAD_BYTES = 2 * 1024 * 1024  # Serialized payload cap per upsert request
+MAX_UPLOAD_ROWS = 500
 
 
 def load_chunks():
@@ -43,10 +73,90 @@ def prepare_embedding_text(chunk):
     return f"# {source}\n## {section}\n\n{content}"
 
 
+def chunk_row(chunk):
+    """knowledge_chunks row for a chunk, without its embedding."""
+    return {
+        "id": chunk["id"],
+        "source_doc": chunk["source_doc"],
+        "source_name": chunk.get("source_name"),
+        "section": chunk.get("section"),
+        "content": chunk["content"],
+        "topic_tags": chunk.get("topic_tags", []),
+        "chunk_index": chunk.get("chunk_index"),
+        "word_count": chunk.get("word_count"),
+        "est_tokens": chunk.get("est_tokens"),
+    }
+
+
+def content_hash(chunk):
+    """Hash of everything uploaded for a chunk, so metadata edits are picked up too."""
+    payload = json.dumps(chunk_row(chunk), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def load_manifest():
+    """Load the id → {content_hash, embedding_model} manifest of what is already uploaded."""
+    if not os.path.exists(MANIFEST_PATH):
+        return {}
+    with open(MANIFEST_PATH, "r") as f:
+        return json.load(f).get("chunks", {})
+
+
+def load_corpus_version():
+    """Counter bumped every time knowledge_chunks changes (0 before the first upload)."""
+    if not os.path.exists(MANIFEST_PATH):
+        return 0
+    with open(MANIFEST_PATH, "r") as f:
+        return json.load(f).get("corpus_version", 0)
+
+
+def save_manifest(entries, corpus_version):
+    with open(MANIFEST_PATH, "w") as f:
+        json.dump({"corpus_version": corpus_version, "chunks": dict(sorted(entries.items()))}, f, indent=2)
+        f.write("\n")
+
+
+def needs_upload(chunk, manifest, full=False):
+    """True when a chunk is new, its content changed, or it was embedded with another model."""
+    entry = manifest.get(chunk["id"])
+    return (
+        full
+        or entry is None
+        or entry.get("content_hash") != content_hash(chunk)
+        or entry.get("embedding_model") != EMBEDDING_MODEL
+    )
+
+
+def diff_against_manifest(chunks, manifest, full=False):
+    """Split chunks into (new/changed chunks, ids to delete, unchanged count)."""
+    changed = [chunk for chunk in chunks if needs_upload(chunk, manifest, full)]
+    current_ids = {c["id"] for c in chunks}
+    deleted_ids = sorted(cid for cid in manifest if cid not in current_ids)
+    return changed, deleted_ids, len(chunks) - len(changed)
+
+
+def delete_from_supabase(supabase_client, ids):
+    """Remove chunks that disappeared from all_chunks.json."""
+    for i in range(0, len(ids), 100):
+        batch = ids[i : i + 100]
+        with_backoff(
+            lambda: supabase_client.table("knowledge_chunks").delete().in_("id", batch).execute(),
+            label=f"Delete of {len(batch)} rows",
+        )
+    return len(ids)
+
+
 def batch_embed(openai_client, texts, batch_size=BATCH_SIZE):
-    """Embed texts in batches via OpenAI API."""
+    """Embed texts in batches via OpenAI API.
+
+    Goes through the on-disk embedding cache, so a resumed run only pays for
+    texts it has not embedded yet. Batches are paced by a token budget (and
+    OpenAI's rate-limit headers) and retried with backoff instead of sleeping
+    a fixed interval.
+    """
     all_embeddings = []
     total_tokens = 0
+    budget = provider_budget("openai", tpm=EMBEDDING_TPM)
 
     for i in range(0, len(texts), batch_size):
         batch = texts[i : i + batch_size]
@@ -55,50 +165,146 @@ def batch_embed(openai_client, texts, batch_size=BATCH_SIZE):
 
         print(f"  Embedding batch {batch_num}/{total_batches} ({len(batch)} chunks)...")
 
-        response = openai_client.embeddings.create(
-            model=EMBEDDING_MODEL,
-            input=batch,
+        slot = budget.acquire(estimate_request_tokens(batch))
+        batch_embeddings, batch_tokens = with_backoff(
+            lambda: embed_texts(openai_client, batch, model=EMBEDDING_MODEL),
+            label=f"Embedding batch {batch_num}",
         )
-
-        batch_embeddings = [item.embedding for item in response.data]
+        budget.settle(slot, batch_tokens)
         all_embeddings.extend(batch_embeddings)
-        total_tokens += response.usage.total_tokens
-
-        if batch_num < total_batches:
-            time.sleep(0.5)  # Rate limit courtesy
+        total_tokens += batch_tokens
 
     print(f"  Total tokens used: {total_tokens:,} (cost: ~${total_tokens * 0.02 / 1_000_000:.4f})")
     return all_embeddings
 
 
-def upload_to_supabase(supabase_client, chunks, embeddings):
-    """Insert chunks with embeddings into knowledge_chunks table."""
-    rows = []
-    for chunk, embedding in zip(chunks, embeddings):
-        rows.append({
-            "id": chunk["id"],
-            "source_doc": chunk["source_doc"],
-            "source_name": chunk.get("source_name"),
-            "section": chunk.get("section"),
-            "content": chunk["content"],
-            "topic_tags": chunk.get("topic_tags", []),
-            "chunk_index": chunk.get("chunk_index"),
-            "word_count": chunk.get("word_count"),
-            "est_tokens": chunk.get("est_tokens"),
-            "embedding": embedding,
-        })
-
-    # Upload in batches of 50 (Supabase REST API limit)
-    upload_batch_size = 50
+def load_checkpoint():
+    """id → content hash of rows confirmed upserted by an interrupted run."""
+    if not os.path.exists(CHECKPOINT_PATH):
+        return {}
+    with open(CHECKPOINT_PATH, "r") as f:
+        return json.load(f).get("chunks", {})
+
+
+def save_checkpoint(entries):
+    os.makedirs(os.path.dirname(CHECKPOINT_PATH), exist_ok=True)
+    tmp_path = CHECKPOINT_PATH + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"chunks": entries}, f)
+    os.replace(tmp_path, CHECKPOINT_PATH)
+
+
+def clear_checkpoint():
+    if os.path.exists(CHECKPOINT_PATH):
+        os.remove(CHECKPOINT_PATH)
+
+
+def plan_upload_batches(rows, max_bytes=MAX_UPLOAD_BYTES, max_rows=MAX_UPLOAD_ROWS):
+    """Group rows into batches capped by serialized payload size as well as row count.
+
+    A 1536-float embedding serializes to ~30 KB of JSON, so a fixed row count
+    either wastes round trips on small rows or overflows the request limit on large ones.
+    """
+    batches, current, current_bytes = [], [], 0
+    for row in rows:
+        row_bytes = len(json.dumps(row))
+        if current and (current_bytes + row_bytes > max_bytes or len(current) >= max_rows):
+            batches.append(current)
+            current, current_bytes = [], 0
+        current.append(row)
+        current_bytes += row_bytes
+    if current:
+        batches.append(current)
+    return batches
+
+
+def upsert_batch(supabase_client, batch):
+    """Upsert one batch with retries; splits it in half if the payload is rejected as too large."""
+    try:
+        with_backoff(
+            lambda: supabase_client.table("knowledge_chunks").upsert(batch).execute(),
+            label=f"Upload of {len(batch)} rows",
+        )
+    except Exception as e:
+        if error_status(e) != 413 or len(batch) == 1:
+            raise
+        mid = len(batch) // 2
+        upsert_batch(supabase_client, batch[:mid])
+        upsert_batch(supabase_client, batch[mid:])
+
+
+def upload_to_supabase(supabase_client, chunks, embeddings, workers=UPLOAD_WORKERS, checkpoint=None):
+    """Upsert chunks with embeddings into knowledge_chunks with concurrent, retrying batches.
+
+    Every confirmed batch is recorded in the checkpoint file, so a failed run
+    can be resumed without re-uploading what already landed. Raises if any
+    batch still fails after retries.
+    """
+    rows = [{**chunk_row(chunk), "embedding": embedding} for chunk, embedding in zip(chunks, embeddings)]
+    hashes = {chunk["id"]: content_hash(chunk) for chunk in chunks}
+    checkpoint = dict(checkpoint or {})
+    batches = plan_upload_batches(rows)
+    lock = threading.Lock()
     uploaded = 0
+    failures = []
+
+    print(f"  {len(rows)} rows in {len(batches)} batches, {workers} in flight")
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(upsert_batch, supabase_client, batch): batch for batch in batches}
+        for future in as_completed(futures):
+            batch = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                failures.append(e)
+                print(f"  FAILED batch of {len(batch)} rows ({batch[0]['id']}...): {e}")
+                continue
+            with lock:
+                uploaded += len(batch)
+                checkpoint.update({row["id"]: hashes[row["id"]] for row in batch})
+                save_checkpoint(checkpoint)
+            print(f"  Uploaded {uploaded}/{len(rows)} rows...")
+
+    if failures:
+        raise RuntimeError(
+            f"{len(failures)} upload batches failed; {uploaded}/{len(rows)} rows checkpointed. "
+            f"Re-run to resume from {CHECKPOINT_PATH}"
+        )
+    return uploaded
 
-    for i in range(0, len(rows), upload_batch_size):
-        batch = rows[i : i + upload_batch_size]
-        result = supabase_client.table("knowledge_chunks").upsert(batch).execute()
-        uploaded += len(batch)
-        print(f"  Uploaded {uploaded}/{len(rows)} rows...")
 
-    return uploaded
+def follow_and_upload(openai_client, supabase_client, manifest, checkpoint, full=False, upload_workers=UPLOAD_WORKERS):
+    """Embed and upsert chunks from the JSONL sidecar as chunk_research.py writes them.
+
+    New/changed chunks are sent in BATCH_SIZE groups as soon as that many have
+    arrived; checkpoint is updated with every batch that lands. Returns
+    (every chunk in the sidecar, rows upserted) once the end marker is read.
+    """
+    chunks, batch = [], []
+    uploaded = 0
+
+    def send():
+        nonlocal uploaded
+        embeddings = batch_embed(openai_client, [prepare_embedding_text(c) for c in batch])
+        upload_to_supabase(supabase_client, batch, embeddings, workers=upload_workers, checkpoint=checkpoint)
+        checkpoint.update({c["id"]: content_hash(c) for c in batch})
+        uploaded += len(batch)
+        batch.clear()
+
+    print(f"Following {CHUNKS_STREAM_PATH} (waiting for chunk_research.py's end marker)...")
+    for line_num, chunk, error in follow_jsonl(CHUNKS_STREAM_PATH):
+        if error:
+            raise RuntimeError(f"{CHUNKS_STREAM_PATH}:{line_num}: {error}")
+        chunks.append(chunk)
+        if needs_upload(chunk, manifest, full) and checkpoint.get(chunk["id"]) != content_hash(chunk):
+            batch.append(chunk)
+            if len(batch) >= BATCH_SIZE:
+                send()
+    if batch:
+        send()
+    print(f"  Read {len(chunks)} chunks from the sidecar")
+    return chunks, uploaded
 
 
 def verify_upload(supabase_client, expected_count):
@@ -113,7 +319,7 @@ def verify_upload(supabase_client, expected_count):
     return actual == expected_count
 
 
-def main():
+def main(full=False, upload_workers=UPLOAD_WORKERS, follow=False):
     # Validate env
     missing = []
     if not SUPABASE_URL:
@@ -128,26 +334,72 @@ def main():
         sys.exit(1)
 
     # Initialize clients
-    openai_client = OpenAI(api_key=OPENAI_API_KEY)
+    openai_client = provider_client.openai_client(OPENAI_API_KEY)
     supabase_client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
-    # Load chunks
-    chunks = load_chunks()
-
-    # Prepare texts for embedding
-    print("\nPreparing texts with structural context...")
-    texts = [prepare_embedding_text(c) for c in chunks]
-    avg_len = sum(len(t) for t in texts) / len(texts)
-    print(f"  Average text length: {avg_len:.0f} chars")
-
-    # Embed all chunks
-    print(f"\nEmbedding {len(texts)} chunks via {EMBEDDING_MODEL}...")
-    embeddings = batch_embed(openai_client, texts)
-    print(f"  Generated {len(embeddings)} embeddings (dim={len(embeddings[0])})")
-
-    # Upload to Supabase
-    print(f"\nUploading to Supabase ({SUPABASE_URL})...")
-    uploaded = upload_to_supabase(supabase_client, chunks, embeddings)
+    manifest = load_manifest()
+    if full:
+        print("Full re-index requested — re-embedding every chunk")
+    checkpoint = load_checkpoint()
+
+    if follow:
+        # Embed/upload as chunk_research.py finishes documents; the full set is known at the end marker
+        try:
+            chunks, uploaded = follow_and_upload(openai_client, supabase_client, manifest, checkpoint,
+                                                 full=full, upload_workers=upload_workers)
+        except (RuntimeError, TimeoutError) as e:
+            print(f"\nERROR: {e}")
+            sys.exit(1)
+        changed, deleted_ids, unchanged = diff_against_manifest(chunks, manifest, full=full)
+        print(f"  {len(changed)} new/changed ({uploaded} uploaded this run), {unchanged} unchanged, "
+              f"{len(deleted_ids)} removed")
+        pending = []
+    else:
+        # Load chunks and compare against what is already uploaded
+        chunks = load_chunks()
+        changed, deleted_ids, unchanged = diff_against_manifest(chunks, manifest, full=full)
+        print(f"  {len(changed)} new/changed, {unchanged} unchanged, {len(deleted_ids)} removed")
+
+        # Skip rows an interrupted run already upserted
+        pending = [c for c in changed if checkpoint.get(c["id"]) != content_hash(c)]
+        if len(pending) < len(changed):
+            print(f"  Resuming from checkpoint: {len(changed) - len(pending)} rows already uploaded")
+
+    if pending:
+        # Prepare texts for embedding
+        print("\nPreparing texts with structural context...")
+        texts = [prepare_embedding_text(c) for c in pending]
+        avg_len = sum(len(t) for t in texts) / len(texts)
+        print(f"  Average text length: {avg_len:.0f} chars")
+
+        # Embed new/changed chunks
+        print(f"\nEmbedding {len(texts)} chunks via {EMBEDDING_MODEL}...")
+        embeddings = batch_embed(openai_client, texts)
+        print(f"  Generated {len(embeddings)} embeddings (dim={len(embeddings[0])})")
+
+        # Upload to Supabase
+        print(f"\nUploading to Supabase ({SUPABASE_URL})...")
+        try:
+            upload_to_supabase(supabase_client, pending, embeddings, workers=upload_workers, checkpoint=checkpoint)
+        except RuntimeError as e:
+            print(f"\nERROR: {e}")
+            sys.exit(1)
+
+    if deleted_ids:
+        print(f"\nDeleting {len(deleted_ids)} stale chunks: {', '.join(deleted_ids[:5])}{'...' if len(deleted_ids) > 5 else ''}")
+        delete_from_supabase(supabase_client, deleted_ids)
+
+    # Record what is now in knowledge_chunks; any change invalidates cached retrievals,
+    # including rows an interrupted run upserted before this one resumed
+    corpus_version = load_corpus_version()
+    if changed or deleted_ids:
+        corpus_version += 1
+        print(f"\nknowledge_chunks changed — corpus version {corpus_version}")
+    save_manifest({
+        c["id"]: {"content_hash": content_hash(c), "embedding_model": EMBEDDING_MODEL}
+        for c in chunks
+    }, corpus_version)
+    clear_checkpoint()
 
     # Verify
     verify_upload(supabase_client, len(chunks))
@@ -156,4 +408,10 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Embed research chunks and upload to Supabase")
+    parser.add_argument("--full", action="store_true", help="Ignore the manifest and re-embed/re-upload every chunk")
+    parser.add_argument("--upload-workers", type=int, default=UPLOAD_WORKERS, help=f"Concurrent upsert batches in flight (default: {UPLOAD_WORKERS})")
+    parser.add_argument("--follow", action="store_true", help="Embed/upload from the all_chunks.jsonl sidecar while chunk_research.py is still running")
+    args = parser.parse_args()
+
+    main(full=args.full, upload_workers=args.upload_workers, follow=args.follow)
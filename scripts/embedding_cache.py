@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Persistent on-disk embedding cache shared by the RAG scripts.
+
+Embeddings are keyed by (model, sha256(text)) and stored as float32 blobs in
+a single SQLite file, so re-running an evaluation over the same fixed prompts
+costs no embedding API calls. All cache misses for a call are sent to OpenAI
+in as few embeddings.create requests as the API allows (one, below 2048 inputs).
+
+Usage:
+    from embedding_cache import embed_texts
+    embeddings, api_tokens = embed_texts(openai_client, ["query one", "query two"])
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+from array import array
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(__file__), "..", ".cache", "embeddings.sqlite")
+DEFAULT_EMBEDDING_MODEL = "text-embedding-3-small"
+MAX_INPUTS_PER_REQUEST = 2048  # OpenAI embeddings.create limit
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """SQLite-backed (model, sha256(text)) → float32 vector store. Safe to share across threads."""
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv("EMBEDDING_CACHE_PATH", DEFAULT_CACHE_PATH)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL,"
+            " text_hash TEXT NOT NULL,"
+            " dim INTEGER NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " PRIMARY KEY (model, text_hash))"
+        )
+        self._conn.commit()
+
+    def get_many(self, model, texts):
+        """Return {text: embedding} for every text already cached under `model`."""
+        hashes = {text_hash(t): t for t in texts}
+        found = {}
+        keys = list(hashes)
+        with self._lock:
+            for i in range(0, len(keys), 500):  # stay under SQLite's bound-parameter limit
+                batch = keys[i : i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *batch],
+                ).fetchall()
+                for h, blob in rows:
+                    vec = array("f")
+                    vec.frombytes(blob)
+                    found[hashes[h]] = vec.tolist()
+        return found
+
+    def put_many(self, model, texts, embeddings):
+        rows = [
+            (model, text_hash(t), len(e), array("f", e).tobytes())
+            for t, e in zip(texts, embeddings)
+        ]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)", rows)
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache():
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = EmbeddingCache()
+        return _default_cache
+
+
+def embed_texts(openai_client, texts, model=DEFAULT_EMBEDDING_MODEL, cache=None):
+    """Embed texts through the cache. Returns (embeddings in input order, API tokens spent).
+
+    Pass cache=False to bypass the cache entirely.
+    """
+    if cache is None:
+        cache = get_default_cache()
+
+    found = cache.get_many(model, texts) if cache else {}
+    misses = list(dict.fromkeys(t for t in texts if t not in found))
+    api_tokens = 0
+
+    for i in range(0, len(misses), MAX_INPUTS_PER_REQUEST):
+        batch = misses[i : i + MAX_INPUTS_PER_REQUEST]
+        response = openai_client.embeddings.create(model=model, input=batch)
+        batch_embeddings = [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
+        api_tokens += response.usage.total_tokens
+        found.update(zip(batch, batch_embeddings))
+        if cache:
+            cache.put_many(model, batch, batch_embeddings)
+
+    return [found[t] for t in texts], api_tokens
@@ -5,22 +5,29 @@ Model: meta-llama/Llama-3.3-70B-Instruct-fast-LoRa:hyrox-coach-v1-drry
 
 Tests every coaching scenario a Hyrox athlete could bring to a coach.
 Organized into categories with factual accuracy checks where applicable.
+
+Usage:
+    python3 scripts/evaluate_coach_k_v1.py
+    python3 scripts/evaluate_coach_k_v1.py --stream   # prints responses live, records time-to-first-token
 """
 
+import argparse
 import os
 import json
 import time
 from datetime import datetime
-from openai import OpenAI
+
+from openai.types import CompletionUsage
+
+from provider_client import nebius_client, provider_budget
+from streaming import print_token, stream_chat
 
 # ── Config ──────────────────────────────────────────────
 MODEL = "meta-llama/Llama-3.3-70B-Instruct-fast-LoRa:hyrox-coach-v1-drry"
 SYSTEM_PROMPT = "You are Coach K, an elite Hyrox performance coach. You provide direct, science-backed coaching with a motivating but no-nonsense style. You are specific with numbers, sets, reps, and pacing targets. You never give generic advice."
 
-client = OpenAI(
-    base_url="https://api.tokenfactory.nebius.com/v1/",
-    api_key=os.environ.get("NEBIUS_API_KEY", ""),
-)
+client = nebius_client()
+budget = provider_budget("nebius")  # paced by Nebius's rate-limit headers
 
 # ── Test Scenarios ──────────────────────────────────────
 SCENARIOS = [
@@ -691,12 +698,16 @@ SCENARIOS = [
 ]
 
 
-def run_evaluation():
-    """Run all scenarios and collect responses."""
+def run_evaluation(stream=False):
+    """Run all scenarios and collect responses.
+
+    With stream=True each response is streamed to the terminal and the rows
+    get time-to-first-token / inter-token latency fields.
+    """
     results = []
     total = len(SCENARIOS)
 
-    print(f"Running {total} evaluation scenarios against Coach K v1...")
+    print(f"Running {total} evaluation scenarios against Coach K v1{' (streaming)' if stream else ''}...")
     print(f"Model: {MODEL}")
     print(f"Started: {datetime.now().isoformat()}")
     print("=" * 60)
@@ -705,20 +716,31 @@ def run_evaluation():
         print(f"\n[{i+1}/{total}] {scenario['category']}: {scenario['id']}")
         print(f"  Prompt: {scenario['prompt'][:80]}...")
 
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": scenario["prompt"]},
+        ]
+        budget.acquire()
         start_time = time.time()
         try:
-            response = client.chat.completions.create(
-                model=MODEL,
-                messages=[
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {"role": "user", "content": scenario["prompt"]},
-                ],
-                temperature=0.7,
-                max_tokens=1200,
-            )
+            stream_metrics = {}
+            if stream:
+                streamed = stream_chat(client, print_token, model=MODEL, messages=messages,
+                                       temperature=0.7, max_tokens=1200)
+                print()
+                content = streamed["content"]
+                usage = CompletionUsage(**streamed["usage"])
+                stream_metrics = streamed["metrics"]
+            else:
+                response = client.chat.completions.create(
+                    model=MODEL,
+                    messages=messages,
+                    temperature=0.7,
+                    max_tokens=1200,
+                )
+                content = response.choices[0].message.content or ""
+                usage = response.usage
             elapsed = time.time() - start_time
-            content = response.choices[0].message.content or ""
-            usage = response.usage
 
             result = {
                 "id": scenario["id"],
@@ -729,9 +751,12 @@ def run_evaluation():
                 "tokens_in": usage.prompt_tokens,
                 "tokens_out": usage.completion_tokens,
                 "latency_seconds": round(elapsed, 2),
+                **stream_metrics,
                 "error": None,
             }
-            print(f"  Response: {len(content)} chars, {usage.completion_tokens} tokens, {elapsed:.1f}s")
+            ttft = stream_metrics.get("time_to_first_token_seconds")
+            print(f"  Response: {len(content)} chars, {usage.completion_tokens} tokens, {elapsed:.1f}s"
+                  + (f" (first token {ttft:.2f}s)" if ttft is not None else ""))
 
         except Exception as e:
             result = {
@@ -748,8 +773,6 @@ def run_evaluation():
             print(f"  ERROR: {e}")
 
         results.append(result)
-        # Small delay to avoid rate limiting
-        time.sleep(0.5)
 
     # Save results
     output_path = "docs/evaluation/coach_k_v1_eval.json"
@@ -760,6 +783,7 @@ def run_evaluation():
             "system_prompt": SYSTEM_PROMPT,
             "timestamp": datetime.now().isoformat(),
             "total_scenarios": total,
+            "stream": stream,
             "results": results,
         }, f, indent=2)
 
@@ -775,6 +799,12 @@ def run_evaluation():
     print(f"Total input tokens: {total_tokens_in:,}")
     print(f"Total output tokens: {total_tokens_out:,}")
     print(f"Average latency: {avg_latency:.1f}s")
+    ttfts = [r["time_to_first_token_seconds"] for r in results if r.get("time_to_first_token_seconds") is not None]
+    itls = [r["inter_token_latency_seconds"] for r in results if r.get("inter_token_latency_seconds") is not None]
+    if ttfts:
+        print(f"Average time to first token: {sum(ttfts) / len(ttfts):.2f}s")
+    if itls:
+        print(f"Average inter-token latency: {sum(itls) / len(itls) * 1000:.1f}ms")
     print(f"Errors: {errors}/{total}")
     print(f"Estimated cost: ${(total_tokens_in * 0.25 + total_tokens_out * 0.75) / 1_000_000:.4f}")
 
@@ -782,4 +812,8 @@ def run_evaluation():
 
 
 if __name__ == "__main__":
-    run_evaluation()
+    parser = argparse.ArgumentParser(description="Evaluate Coach K v1")
+    parser.add_argument("--stream", action="store_true", help="Stream responses and record time-to-first-token / inter-token latency")
+    args = parser.parse_args()
+
+    run_evaluation(stream=args.stream)
@@ -9,24 +9,29 @@ for equipment, doubles, weights, and technique — the v1 failure areas.
 Usage:
     python3 scripts/evaluate_coach_k_v2.py
     python3 scripts/evaluate_coach_k_v2.py --model "meta-llama/Llama-3.3-70B-Instruct-fast-LoRa:hyrox-coach-v2-XXXX"
+    python3 scripts/evaluate_coach_k_v2.py --model "..." --concurrency 16 --rpm 300 --tpm 400000
+    python3 scripts/evaluate_coach_k_v2.py --model "..." --stream   # records time-to-first-token
 """
 
 import argparse
 import os
 import json
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from openai import OpenAI
+
+from provider_client import nebius_client, provider_budget
+from rate_limit import estimate_request_tokens
+from streaming import print_token, stream_chat
 
 # ── Config ──────────────────────────────────────────────
 V1_MODEL = "meta-llama/Llama-3.3-70B-Instruct-fast-LoRa:hyrox-coach-v1-drry"
 V2_MODEL = None  # Set after training completes or via --model flag
+MAX_TOKENS = 1200
+DEFAULT_RPM = 120  # Matches the old fixed 0.5s spacing when running serially
 SYSTEM_PROMPT = "You are Coach K, an elite Hyrox performance coach. You provide direct, science-backed coaching with a motivating but no-nonsense style. You are specific with numbers, sets, reps, and pacing targets. You never give generic advice."
 
-client = OpenAI(
-    base_url="https://api.tokenfactory.nebius.com/v1/",
-    api_key=os.environ.get("NEBIUS_API_KEY", ""),
-)
+client = nebius_client()
 
 # ── Original V1 Scenarios (47) ──────────────────────────
 
@@ -453,69 +458,115 @@ V2_NEW_SCENARIOS = [
 ALL_SCENARIOS = ORIGINAL_SCENARIOS + V2_NEW_SCENARIOS
 
 
-def run_evaluation(model, label="v2"):
-    """Run all scenarios and collect responses."""
-    results = []
+def run_scenario(model, scenario, budget, stream=False, on_token=None):
+    """Send one scenario to the model and return its result row.
+
+    With stream=True the completion is streamed (text deltas go to on_token)
+    and the row also gets time-to-first-token / inter-token latency fields.
+    """
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": scenario["prompt"]},
+    ]
+    slot = budget.acquire(estimate_request_tokens([SYSTEM_PROMPT, scenario["prompt"]], MAX_TOKENS))
+
+    start_time = time.time()
+    try:
+        stream_metrics = {}
+        if stream:
+            streamed = stream_chat(client, on_token, model=model, messages=messages,
+                                   temperature=0.7, max_tokens=MAX_TOKENS)
+            content = streamed["content"]
+            tokens_in, tokens_out = streamed["usage"]["prompt_tokens"], streamed["usage"]["completion_tokens"]
+            stream_metrics = streamed["metrics"]
+        else:
+            response = client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=0.7,
+                max_tokens=MAX_TOKENS,
+            )
+            content = response.choices[0].message.content or ""
+            tokens_in, tokens_out = response.usage.prompt_tokens, response.usage.completion_tokens
+        elapsed = time.time() - start_time
+        budget.settle(slot, tokens_in + tokens_out)
+
+        return {
+            "id": scenario["id"],
+            "category": scenario["category"],
+            "prompt": scenario["prompt"],
+            "checks": scenario.get("checks", []),
+            "response": content,
+            "tokens_in": tokens_in,
+            "tokens_out": tokens_out,
+            "latency_seconds": round(elapsed, 2),
+            **stream_metrics,
+            "error": None,
+            "is_v2_new": scenario["id"].startswith("v2_"),
+        }
+
+    except Exception as e:
+        elapsed = time.time() - start_time
+        return {
+            "id": scenario["id"],
+            "category": scenario["category"],
+            "prompt": scenario["prompt"],
+            "checks": scenario.get("checks", []),
+            "response": "",
+            "tokens_in": 0,
+            "tokens_out": 0,
+            "latency_seconds": round(elapsed, 2),
+            "error": str(e),
+            "is_v2_new": scenario["id"].startswith("v2_"),
+        }
+
+
+def print_result(i, total, scenario, result):
+    """Progress line for one finished scenario."""
+    print(f"\n[{i+1}/{total}] {scenario['category']}: {scenario['id']}")
+    print(f"  Prompt: {scenario['prompt'][:80]}...")
+    if result["error"]:
+        print(f"  ERROR: {result['error']}")
+    else:
+        ttft = result.get("time_to_first_token_seconds")
+        print(f"  Response: {len(result['response'])} chars, {result['tokens_out']} tokens, {result['latency_seconds']:.1f}s"
+              + (f" (first token {ttft:.2f}s)" if ttft is not None else ""))
+
+
+def run_evaluation(model, label="v2", concurrency=1, rpm=DEFAULT_RPM, tpm=None, stream=False):
+    """Run all scenarios and collect responses.
+
+    Scenarios run on a pool of `concurrency` workers paced by a shared
+    RPM/TPM budget that also follows the provider's rate-limit headers.
+    Results are always written in scenario order. With stream=True responses
+    are streamed (and printed live when running serially) to measure
+    time-to-first-token and inter-token latency.
+    """
     total = len(ALL_SCENARIOS)
+    results = [None] * total
+    budget = provider_budget("nebius", rpm=rpm, tpm=tpm)
 
     print(f"Running {total} evaluation scenarios against Coach K {label}...")
     print(f"Model: {model}")
     print(f"  Original scenarios: {len(ORIGINAL_SCENARIOS)}")
     print(f"  New V2 scenarios:   {len(V2_NEW_SCENARIOS)}")
+    print(f"  Concurrency: {concurrency} | RPM: {rpm or 'unlimited'} | TPM: {tpm or 'unlimited'}"
+          f"{' | streaming' if stream else ''}")
     print(f"Started: {datetime.now().isoformat()}")
     print("=" * 60)
 
-    for i, scenario in enumerate(ALL_SCENARIOS):
-        print(f"\n[{i+1}/{total}] {scenario['category']}: {scenario['id']}")
-        print(f"  Prompt: {scenario['prompt'][:80]}...")
-
-        start_time = time.time()
-        try:
-            response = client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {"role": "user", "content": scenario["prompt"]},
-                ],
-                temperature=0.7,
-                max_tokens=1200,
-            )
-            elapsed = time.time() - start_time
-            content = response.choices[0].message.content or ""
-            usage = response.usage
-
-            result = {
-                "id": scenario["id"],
-                "category": scenario["category"],
-                "prompt": scenario["prompt"],
-                "checks": scenario.get("checks", []),
-                "response": content,
-                "tokens_in": usage.prompt_tokens,
-                "tokens_out": usage.completion_tokens,
-                "latency_seconds": round(elapsed, 2),
-                "error": None,
-                "is_v2_new": scenario["id"].startswith("v2_"),
-            }
-            print(f"  Response: {len(content)} chars, {usage.completion_tokens} tokens, {elapsed:.1f}s")
-
-        except Exception as e:
-            elapsed = time.time() - start_time
-            result = {
-                "id": scenario["id"],
-                "category": scenario["category"],
-                "prompt": scenario["prompt"],
-                "checks": scenario.get("checks", []),
-                "response": "",
-                "tokens_in": 0,
-                "tokens_out": 0,
-                "latency_seconds": round(elapsed, 2),
-                "error": str(e),
-                "is_v2_new": scenario["id"].startswith("v2_"),
-            }
-            print(f"  ERROR: {e}")
-
-        results.append(result)
-        time.sleep(0.5)
+    on_token = print_token if stream and concurrency <= 1 else None  # interleaved output is unreadable
+    run_start = time.time()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        futures = {
+            pool.submit(run_scenario, model, scenario, budget, stream, on_token): i
+            for i, scenario in enumerate(ALL_SCENARIOS)
+        }
+        for future in as_completed(futures):
+            i = futures[future]
+            results[i] = future.result()
+            print_result(i, total, ALL_SCENARIOS[i], results[i])
+    wall_clock = time.time() - run_start
 
     # Save results
     output_path = f"docs/evaluation/coach_k_{label}_eval.json"
@@ -528,6 +579,7 @@ def run_evaluation(model, label="v2"):
             "total_scenarios": total,
             "original_scenarios": len(ORIGINAL_SCENARIOS),
             "new_v2_scenarios": len(V2_NEW_SCENARIOS),
+            "stream": stream,
             "results": results,
         }, f, indent=2)
 
@@ -537,6 +589,8 @@ def run_evaluation(model, label="v2"):
     total_tokens_in = sum(r["tokens_in"] for r in successful)
     total_tokens_out = sum(r["tokens_out"] for r in successful)
     avg_latency = sum(r["latency_seconds"] for r in successful) / len(successful) if successful else 0
+    ttfts = [r["time_to_first_token_seconds"] for r in successful if r.get("time_to_first_token_seconds") is not None]
+    itls = [r["inter_token_latency_seconds"] for r in successful if r.get("inter_token_latency_seconds") is not None]
 
     print(f"\n{'=' * 60}")
     print(f"EVALUATION COMPLETE — Coach K {label}")
@@ -545,6 +599,12 @@ def run_evaluation(model, label="v2"):
     print(f"Total input tokens: {total_tokens_in:,}")
     print(f"Total output tokens: {total_tokens_out:,}")
     print(f"Average latency: {avg_latency:.1f}s")
+    if ttfts:
+        print(f"Average time to first token: {sum(ttfts) / len(ttfts):.2f}s")
+    if itls:
+        print(f"Average inter-token latency: {sum(itls) / len(itls) * 1000:.1f}ms")
+    print(f"Wall-clock time: {wall_clock:.1f}s")
+    print(f"Rate limiting: {budget.summary()}")
     print(f"Estimated cost: ${(total_tokens_in * 0.13 + total_tokens_out * 0.40) / 1_000_000:.4f}")
     print(f"Results saved to: {output_path}")
 
@@ -569,6 +629,10 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Evaluate Coach K v2")
     parser.add_argument("--model", type=str, help="Model ID (e.g., meta-llama/Llama-3.3-70B-Instruct-fast-LoRa:hyrox-coach-v2-XXXX)")
     parser.add_argument("--label", type=str, default="v2", help="Label for output files (default: v2)")
+    parser.add_argument("--concurrency", type=int, default=1, help="Scenarios in flight at once (default: 1)")
+    parser.add_argument("--rpm", type=int, default=DEFAULT_RPM, help=f"Requests-per-minute budget, 0 = provider rate-limit headers only (default: {DEFAULT_RPM})")
+    parser.add_argument("--tpm", type=int, default=0, help="Tokens-per-minute budget, 0 = provider rate-limit headers only (default: 0)")
+    parser.add_argument("--stream", action="store_true", help="Stream responses and record time-to-first-token / inter-token latency")
     args = parser.parse_args()
 
     if not args.model:
@@ -576,4 +640,4 @@ if __name__ == "__main__":
         print("Example: python3 scripts/evaluate_coach_k_v2.py --model 'meta-llama/Llama-3.3-70B-Instruct-fast-LoRa:hyrox-coach-v2-XXXX'")
         exit(1)
 
-    run_evaluation(args.model, args.label)
+    run_evaluation(args.model, args.label, concurrency=args.concurrency, rpm=args.rpm, tpm=args.tpm, stream=args.stream)
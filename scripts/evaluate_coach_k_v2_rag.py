@@ -9,17 +9,34 @@ This enables direct comparison: v2 (model only) vs v2+RAG (model + retrieval).
 
 Usage:
     python3 scripts/evaluate_coach_k_v2_rag.py
+    python3 scripts/evaluate_coach_k_v2_rag.py --workers 8 --retrieval-workers 16
+    python3 scripts/evaluate_coach_k_v2_rag.py --local-retrieval   # no Supabase round trips
+    python3 scripts/evaluate_coach_k_v2_rag.py --no-retrieval-cache
+    python3 scripts/evaluate_coach_k_v2_rag.py --response-cache   # serve near-duplicate prompts from cache
+    python3 scripts/evaluate_coach_k_v2_rag.py --stream           # records time-to-first-token
 """
 
 import os
 import json
 import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai.types import CompletionUsage
 from supabase import create_client
 
+from context_builder import DEFAULT_TOKEN_BUDGET, build_budgeted_context, estimate_tokens
+from embedding_cache import embed_texts
+from local_index import LocalIndex
+import provider_client
+from provider_client import provider_budget
+from response_cache import DEFAULT_THRESHOLD, ResponseCache, context_key
+from retrieval_cache import HYBRID_SEARCH_PARAMS, RetrievalCache, retrieval_params
+from rate_limit import estimate_request_tokens
+from streaming import print_token, stream_chat
+
 load_dotenv()
 
 # ── Config ──────────────────────────────────────────────
@@ -28,8 +45,10 @@ SUPABASE_KEY = os.getenv("SUPABASE_ANON_KEY")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 NEBIUS_API_KEY = os.getenv("NEBIUS_API_KEY")
 NEBIUS_MODEL = os.getenv("NEBIUS_MODEL", "meta-llama/Llama-3.3-70B-Instruct-fast-LoRa:hyrox-coach-v2-HafB")
-NEBIUS_BASE_URL = "https://api.tokenfactory.nebius.com/v1/"
 EMBEDDING_MODEL = "text-embedding-3-small"
+MAX_TOKENS = 1200
+TEMPERATURE = 0.7
+DEFAULT_RPM = 120
 
 # RAG system prompt — v2 with safety boundaries and coaching process guardrails
 SYSTEM_PROMPT_TEMPLATE = """You are Coach K, an elite Hyrox performance coach. You provide direct, science-backed coaching with a motivating but no-nonsense style. You are specific with numbers, sets, reps, and pacing targets.
@@ -58,18 +77,15 @@ Use this to ground your response with specific data, protocols, and benchmarks.
 from evaluate_coach_k_v2 import ALL_SCENARIOS
 
 # ── Clients ─────────────────────────────────────────────
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
+openai_client = provider_client.openai_client(OPENAI_API_KEY)
 supabase_client = create_client(SUPABASE_URL, SUPABASE_KEY)
-nebius_client = OpenAI(api_key=NEBIUS_API_KEY, base_url=NEBIUS_BASE_URL)
+nebius_client = provider_client.nebius_client(NEBIUS_API_KEY)
 
 
 def embed_query(query):
-    """Embed query via OpenAI."""
-    response = openai_client.embeddings.create(
-        model=EMBEDDING_MODEL,
-        input=query,
-    )
-    return response.data[0].embedding
+    """Embed query via OpenAI (through the on-disk embedding cache)."""
+    embeddings, _ = embed_texts(openai_client, [query], model=EMBEDDING_MODEL)
+    return embeddings[0]
 
 
 def retrieve_chunks(query_text, embedding, count=5):
@@ -80,9 +96,7 @@ def retrieve_chunks(query_text, embedding, count=5):
             "query_text": query_text,
             "query_embedding": embedding,
             "match_count": count,
-            "full_text_weight": 1.0,
-            "semantic_weight": 1.0,
-            "rrf_k": 50,
+            **HYBRID_SEARCH_PARAMS,
         },
     ).execute()
     return result.data
@@ -106,91 +120,232 @@ def build_context(chunks):
     return "\n\n---\n\n".join(parts)
 
 
-def run_evaluation():
-    """Run all 59 scenarios through the RAG pipeline."""
-    results = []
-    total = len(ALL_SCENARIOS)
-
-    print(f"Running {total} evaluation scenarios — Coach K v2 + RAG")
-    print(f"Model: {NEBIUS_MODEL}")
-    print(f"RAG: hybrid search → top 5 chunks → grounded response")
-    print(f"Started: {datetime.now().isoformat()}")
-    print("=" * 60)
-
-    total_embedding_tokens = 0
-
-    for i, scenario in enumerate(ALL_SCENARIOS):
-        sid = scenario["id"]
-        category = scenario["category"]
-        prompt = scenario["prompt"]
-
-        print(f"\n[{i+1}/{total}] {category}: {sid}")
-        print(f"  Prompt: {prompt[:80]}...")
-
+def embed_queries(queries):
+    """Embed every query in one batched call, skipping cached prompts. Returns (embeddings, API tokens)."""
+    return embed_texts(openai_client, queries, model=EMBEDDING_MODEL)
+
+
+def make_result(scenario, stages, chunk_ids=None, content="", usage=None, error=None, context_stats=None,
+                cache_similarity=None, stream_metrics=None):
+    """Build one result row. latency_seconds is the sum of the per-stage latencies.
+
+    cache_similarity is set when the response came from the response cache;
+    stream_metrics (time to first token etc.) when the generation was streamed.
+    """
+    context_stats = context_stats or {}
+    return {
+        "id": scenario["id"],
+        "category": scenario["category"],
+        "prompt": scenario["prompt"],
+        "checks": scenario.get("checks", []),
+        "response": content,
+        "tokens_in": usage.prompt_tokens if usage else 0,
+        "tokens_out": usage.completion_tokens if usage else 0,
+        "latency_seconds": round(sum(stages.values()), 2),
+        "stage_latency_seconds": {k: round(v, 3) for k, v in stages.items()},
+        "error": error,
+        "is_v2_new": scenario["id"].startswith("v2_"),
+        "rag_chunks_retrieved": chunk_ids or [],
+        "rag_chunk_count": len(chunk_ids or []),
+        "context_tokens": context_stats.get("tokens_used", 0),
+        "context_tokens_saved": context_stats.get("tokens_saved", 0),
+        "response_cache_hit": cache_similarity is not None,
+        "response_cache_similarity": round(cache_similarity, 4) if cache_similarity is not None else None,
+        **(stream_metrics or {}),
+    }
+
+
+def retrieve_stage(scenario, embedding, stages, local_index=None, retrieval_cache=None):
+    """Stage 2: hybrid search for one scenario (Supabase RPC or local index). Returns the retrieved chunks."""
+    start_time = time.time()
+    try:
+        if local_index is not None:
+            return local_index.hybrid_search(scenario["prompt"], embedding, match_count=5)
+        chunks = retrieve_chunks(scenario["prompt"], embedding, count=5)
+        if retrieval_cache:
+            retrieval_cache.put(scenario["prompt"], EMBEDDING_MODEL, retrieval_params(5), chunks)
+        return chunks
+    finally:
+        stages["retrieve"] = time.time() - start_time
+
+
+def generate_stage(scenario, chunks, stages, budget, context_budget=DEFAULT_TOKEN_BUDGET,
+                   response_cache=None, embedding=None, stream=False, on_token=None):
+    """Stages 3–4: build the grounded system prompt and get Coach K's response.
+
+    context_budget caps the retrieved context (estimated tokens); 0 sends the
+    full top-5 chunks as before. With a response_cache, a near-identical
+    earlier prompt over the same chunk set is answered from the cache. With
+    stream=True the completion is streamed (deltas go to on_token).
+    """
+    prompt = scenario["prompt"]
+    chunk_ids = [c["id"] for c in chunks] if chunks else []
+
+    start_time = time.time()
+    if context_budget:
+        context, context_stats = build_budgeted_context(chunks, prompt, context_budget)
+    else:
+        context = build_context(chunks)
+        context_stats = {"tokens_used": estimate_tokens(context), "tokens_saved": 0}
+    system_prompt = SYSTEM_PROMPT_TEMPLATE.format(context=context)
+    stages["context"] = time.time() - start_time
+
+    if response_cache:
         start_time = time.time()
-        try:
-            # Step 1: Embed query
+        if embedding is None:  # retrieval cache hit; the prompt's embedding is normally still in the embedding cache
             embedding = embed_query(prompt)
-
-            # Step 2: Retrieve relevant chunks
-            chunks = retrieve_chunks(prompt, embedding, count=5)
-            chunk_ids = [c["id"] for c in chunks] if chunks else []
-            print(f"  Retrieved: {', '.join(chunk_ids[:3])}{'...' if len(chunk_ids) > 3 else ''}")
-
-            # Step 3: Build context and system prompt
-            context = build_context(chunks)
-            system_prompt = SYSTEM_PROMPT_TEMPLATE.format(context=context)
-
-            # Step 4: Get coaching response from fine-tuned model
+        key = context_key(NEBIUS_MODEL, chunk_ids, system_prompt=SYSTEM_PROMPT_TEMPLATE,
+                          context_budget=context_budget, temperature=TEMPERATURE, max_tokens=MAX_TOKENS)
+        hit = response_cache.lookup(embedding, key)
+        stages["generate"] = time.time() - start_time
+        if hit:
+            return make_result(scenario, stages, chunk_ids, hit["response"], context_stats=context_stats,
+                               cache_similarity=hit["similarity"])
+
+    slot = budget.acquire(estimate_request_tokens([system_prompt, prompt], MAX_TOKENS))
+    start_time = time.time()
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": prompt},
+    ]
+    try:
+        stream_metrics = None
+        if stream:
+            streamed = stream_chat(nebius_client, on_token, model=NEBIUS_MODEL, messages=messages,
+                                   temperature=TEMPERATURE, max_tokens=MAX_TOKENS)
+            content = streamed["content"]
+            usage = CompletionUsage(**streamed["usage"])
+            stream_metrics = streamed["metrics"]
+        else:
             response = nebius_client.chat.completions.create(
                 model=NEBIUS_MODEL,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": prompt},
-                ],
-                temperature=0.7,
-                max_tokens=1200,
+                messages=messages,
+                temperature=TEMPERATURE,
+                max_tokens=MAX_TOKENS,
             )
-            elapsed = time.time() - start_time
             content = response.choices[0].message.content or ""
             usage = response.usage
+        stages["generate"] = time.time() - start_time
+        budget.settle(slot, usage.prompt_tokens + usage.completion_tokens)
+        if response_cache and content:
+            response_cache.put(prompt, embedding, key, content)
+        return make_result(scenario, stages, chunk_ids, content, usage, context_stats=context_stats,
+                           stream_metrics=stream_metrics)
+    except Exception as e:
+        stages["generate"] = time.time() - start_time
+        return make_result(scenario, stages, error=str(e), context_stats=context_stats)
+
+
+def print_result(i, total, result):
+    """Progress line for one finished scenario."""
+    print(f"\n[{i+1}/{total}] {result['category']}: {result['id']}")
+    print(f"  Prompt: {result['prompt'][:80]}...")
+    if result["error"]:
+        print(f"  ERROR: {result['error']}")
+        return
+    chunk_ids = result["rag_chunks_retrieved"]
+    stage_str = " | ".join(f"{k} {v:.2f}s" for k, v in result["stage_latency_seconds"].items())
+    print(f"  Retrieved: {', '.join(chunk_ids[:3])}{'...' if len(chunk_ids) > 3 else ''}")
+    print(f"  Context: {result['context_tokens']} tokens ({result['context_tokens_saved']} saved)")
+    cached = f", response cache hit @ {result['response_cache_similarity']:.3f}" if result["response_cache_hit"] else ""
+    ttft = result.get("time_to_first_token_seconds")
+    first = f", first token {ttft:.2f}s" if ttft is not None else ""
+    print(f"  Response: {len(result['response'])} chars, {result['tokens_out']} tokens ({stage_str}){cached}{first}")
+
+
+def run_evaluation(workers=1, retrieval_workers=8, rpm=DEFAULT_RPM, tpm=None, local_retrieval=False,
+                   context_budget=DEFAULT_TOKEN_BUDGET, use_retrieval_cache=True, response_cache_threshold=None,
+                   stream=False):
+    """Run all 59 scenarios through the RAG pipeline.
+
+    Staged pipeline: every prompt is embedded in one batched call, retrievals
+    run concurrently, and each scenario is handed to the generation pool as
+    soon as its chunks arrive. Results are written in scenario order.
+    Prompts with cached Supabase retrieval results skip stages 1–2; with
+    response_cache_threshold set, near-duplicate prompts skip generation.
+    With stream=True generations are streamed (printed live with one
+    generation worker) and time-to-first-token is recorded per scenario.
+    """
+    total = len(ALL_SCENARIOS)
+    results = [None] * total
+    budget = provider_budget("nebius", rpm=rpm, tpm=tpm)
+
+    print(f"Running {total} evaluation scenarios — Coach K v2 + RAG")
+    print(f"Model: {NEBIUS_MODEL}")
+    print(f"RAG: hybrid search ({'local index' if local_retrieval else 'Supabase'}) → top 5 chunks → "
+          f"{f'{context_budget}-token context' if context_budget else 'full context'} → grounded response")
+    print(f"Workers: {retrieval_workers} retrieval, {workers} generation | RPM: {rpm or 'unlimited'} | TPM: {tpm or 'unlimited'}"
+          f"{' | streaming' if stream else ''}")
+    print(f"Started: {datetime.now().isoformat()}")
+    print("=" * 60)
 
-            result = {
-                "id": sid,
-                "category": category,
-                "prompt": prompt,
-                "checks": scenario.get("checks", []),
-                "response": content,
-                "tokens_in": usage.prompt_tokens,
-                "tokens_out": usage.completion_tokens,
-                "latency_seconds": round(elapsed, 2),
-                "error": None,
-                "is_v2_new": sid.startswith("v2_"),
-                "rag_chunks_retrieved": chunk_ids,
-                "rag_chunk_count": len(chunk_ids),
-            }
-            print(f"  Response: {len(content)} chars, {usage.completion_tokens} tokens, {elapsed:.1f}s")
-
-        except Exception as e:
-            elapsed = time.time() - start_time
-            result = {
-                "id": sid,
-                "category": category,
-                "prompt": prompt,
-                "checks": scenario.get("checks", []),
-                "response": "",
-                "tokens_in": 0,
-                "tokens_out": 0,
-                "latency_seconds": round(elapsed, 2),
-                "error": str(e),
-                "is_v2_new": sid.startswith("v2_"),
-                "rag_chunks_retrieved": [],
-                "rag_chunk_count": 0,
-            }
-            print(f"  ERROR: {e}")
-
-        results.append(result)
-        time.sleep(0.3)
+    run_start = time.time()
+    local_index = LocalIndex.from_chunks_file(openai_client) if local_retrieval else None
+
+    # Cached Supabase results need neither an embedding nor an RPC
+    retrieval_cache = RetrievalCache() if use_retrieval_cache and not local_retrieval else None
+    response_cache = ResponseCache(threshold=response_cache_threshold) if response_cache_threshold else None
+    cached_chunks = {}
+    if retrieval_cache:
+        for i, scenario in enumerate(ALL_SCENARIOS):
+            chunks = retrieval_cache.get(scenario["prompt"], EMBEDDING_MODEL, retrieval_params(5))
+            if chunks is not None:
+                cached_chunks[i] = chunks
+        print(f"\nRetrieval cache: {len(cached_chunks)}/{total} prompts hit (corpus v{retrieval_cache.corpus_version})")
+    to_embed = [i for i in range(total) if i not in cached_chunks]
+    on_token = print_token if stream and workers <= 1 else None  # interleaved output is unreadable
+
+    # Stage 1: embed every remaining prompt in one batched call
+    print(f"\nEmbedding {len(to_embed)} prompts in one batch (cached prompts are skipped)...")
+    embed_start = time.time()
+    embeddings = [None] * total
+    embed_error = None
+    total_embedding_tokens = 0
+    try:
+        if to_embed:
+            batch, total_embedding_tokens = embed_queries([ALL_SCENARIOS[i]["prompt"] for i in to_embed])
+            for i, embedding in zip(to_embed, batch):
+                embeddings[i] = embedding
+    except Exception as e:
+        embed_error = f"embedding failed: {e}"
+        print(f"  ERROR: {e}")
+    embedding_batch_seconds = time.time() - embed_start
+    embed_share = embedding_batch_seconds / max(1, len(to_embed))  # amortized per-scenario cost of the batch
+
+    # Stages 2–4: concurrent retrieval feeding the generation pool
+    with ThreadPoolExecutor(max_workers=max(1, retrieval_workers)) as retrieval_pool, \
+            ThreadPoolExecutor(max_workers=max(1, workers)) as generation_pool:
+        stage_times = [{"embed": 0.0 if i in cached_chunks else embed_share} for i in range(total)]
+        retrievals = {}
+        generations = {}
+        for i, (scenario, embedding) in enumerate(zip(ALL_SCENARIOS, embeddings)):
+            if i in cached_chunks:
+                stage_times[i]["retrieve"] = 0.0
+                generations[generation_pool.submit(generate_stage, scenario, cached_chunks[i], stage_times[i], budget,
+                                                   context_budget, response_cache, None, stream, on_token)] = i
+                continue
+            if embed_error:
+                results[i] = make_result(scenario, stage_times[i], error=embed_error)
+                continue
+            retrievals[retrieval_pool.submit(retrieve_stage, scenario, embedding, stage_times[i], local_index, retrieval_cache)] = i
+
+        for future in as_completed(retrievals):
+            i = retrievals[future]
+            try:
+                chunks = future.result()
+            except Exception as e:
+                results[i] = make_result(ALL_SCENARIOS[i], stage_times[i], error=str(e))
+                print_result(i, total, results[i])
+                continue
+            generations[generation_pool.submit(generate_stage, ALL_SCENARIOS[i], chunks, stage_times[i], budget,
+                                               context_budget, response_cache, embeddings[i], stream, on_token)] = i
+
+        for future in as_completed(generations):
+            i = generations[future]
+            results[i] = future.result()
+            print_result(i, total, results[i])
+
+    wall_clock = time.time() - run_start
 
     # Save results
     output_path = "docs/evaluation/coach_k_v2_rag_eval.json"
@@ -198,11 +353,20 @@ def run_evaluation():
     with open(output_path, "w") as f:
         json.dump({
             "model": NEBIUS_MODEL,
-            "pipeline": "v2+RAG (hybrid search, top 5 chunks)",
+            "pipeline": f"v2+RAG (hybrid search{', local index' if local_retrieval else ''}, top 5 chunks"
+                        f"{f', {context_budget}-token context budget' if context_budget else ''})",
+            "context_token_budget": context_budget,
             "system_prompt_template": SYSTEM_PROMPT_TEMPLATE,
             "embedding_model": EMBEDDING_MODEL,
             "timestamp": datetime.now().isoformat(),
             "total_scenarios": total,
+            "embedding_tokens": total_embedding_tokens,
+            "embedding_batch_seconds": round(embedding_batch_seconds, 3),
+            "retrieval_cache_hits": len(cached_chunks),
+            "response_cache_threshold": response_cache_threshold,
+            "response_cache_hits": sum(1 for r in results if r.get("response_cache_hit")),
+            "stream": stream,
+            "wall_clock_seconds": round(wall_clock, 2),
             "results": results,
         }, f, indent=2)
 
@@ -213,6 +377,13 @@ def run_evaluation():
     total_tokens_out = sum(r["tokens_out"] for r in successful)
     avg_latency = sum(r["latency_seconds"] for r in successful) / len(successful) if successful else 0
     avg_chunks = sum(r["rag_chunk_count"] for r in successful) / len(successful) if successful else 0
+    total_context_tokens = sum(r["context_tokens"] for r in successful)
+    total_context_saved = sum(r["context_tokens_saved"] for r in successful)
+    stage_names = ["embed", "retrieve", "context", "generate"]
+    avg_stages = {
+        name: sum(r["stage_latency_seconds"].get(name, 0) for r in successful) / len(successful) if successful else 0
+        for name in stage_names
+    }
 
     print(f"\n{'=' * 60}")
     print(f"EVALUATION COMPLETE — Coach K v2 + RAG")
@@ -221,7 +392,23 @@ def run_evaluation():
     print(f"Total input tokens: {total_tokens_in:,}")
     print(f"Total output tokens: {total_tokens_out:,}")
     print(f"Average latency: {avg_latency:.1f}s")
+    print(f"  Per stage: " + " | ".join(f"{k} {v:.2f}s" for k, v in avg_stages.items()))
+    ttfts = [r["time_to_first_token_seconds"] for r in successful if r.get("time_to_first_token_seconds") is not None]
+    itls = [r["inter_token_latency_seconds"] for r in successful if r.get("inter_token_latency_seconds") is not None]
+    if ttfts:
+        print(f"Average time to first token: {sum(ttfts) / len(ttfts):.2f}s (generation only)")
+    if itls:
+        print(f"Average inter-token latency: {sum(itls) / len(itls) * 1000:.1f}ms")
+    print(f"Wall-clock time: {wall_clock:.1f}s")
+    print(f"Rate limiting: {budget.summary()}")
     print(f"Average chunks retrieved: {avg_chunks:.1f}")
+    if retrieval_cache:
+        print(f"Retrieval cache: {len(cached_chunks)}/{total} prompts served from cache")
+        retrieval_cache.close()
+    if response_cache:
+        print(f"Response cache: {response_cache.summary()}")
+        response_cache.close()
+    print(f"Context tokens: {total_context_tokens:,} sent, {total_context_saved:,} saved by the budget")
     print(f"Estimated Nebius cost: ${(total_tokens_in * 0.13 + total_tokens_out * 0.40) / 1_000_000:.4f}")
     print(f"Results saved to: {output_path}")
 
@@ -229,4 +416,27 @@ def run_evaluation():
 
 
 if __name__ == "__main__":
-    run_evaluation()
+    parser = argparse.ArgumentParser(description="Evaluate Coach K v2 + RAG")
+    parser.add_argument("--workers", type=int, default=1, help="Concurrent generation requests (default: 1)")
+    parser.add_argument("--retrieval-workers", type=int, default=8, help="Concurrent hybrid search RPCs (default: 8)")
+    parser.add_argument("--rpm", type=int, default=DEFAULT_RPM, help=f"Generation requests-per-minute budget, 0 = provider rate-limit headers only (default: {DEFAULT_RPM})")
+    parser.add_argument("--tpm", type=int, default=0, help="Generation tokens-per-minute budget, 0 = provider rate-limit headers only (default: 0)")
+    parser.add_argument("--local-retrieval", action="store_true", help="Retrieve from the in-process index over all_chunks.json instead of Supabase")
+    parser.add_argument("--context-budget", type=int, default=DEFAULT_TOKEN_BUDGET, help=f"Max estimated tokens of retrieved context, 0 = full top-5 chunks (default: {DEFAULT_TOKEN_BUDGET})")
+    parser.add_argument("--no-retrieval-cache", action="store_true", help="Always embed and search, ignoring cached retrieval results")
+    parser.add_argument("--response-cache", action="store_true", help="Serve near-duplicate prompts over the same chunks from the semantic response cache (off by default: it measures the cache, not the model)")
+    parser.add_argument("--similarity-threshold", type=float, default=DEFAULT_THRESHOLD, help=f"Query similarity needed for a response cache hit (default: {DEFAULT_THRESHOLD})")
+    parser.add_argument("--stream", action="store_true", help="Stream generations and record time-to-first-token / inter-token latency")
+    args = parser.parse_args()
+
+    run_evaluation(
+        workers=args.workers,
+        retrieval_workers=args.retrieval_workers,
+        rpm=args.rpm,
+        tpm=args.tpm,
+        local_retrieval=args.local_retrieval,
+        context_budget=args.context_budget,
+        use_retrieval_cache=not args.no_retrieval_cache,
+        response_cache_threshold=args.similarity_threshold if args.response_cache else None,
+        stream=args.stream,
+    )
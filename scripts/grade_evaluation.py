@@ -8,85 +8,24 @@ comprehensive comparison report.
 
 Usage:
     python3 scripts/grade_evaluation.py
+    python3 scripts/grade_evaluation.py --only-changed --workers 8
+    python3 scripts/grade_evaluation.py --batch-tokens 12000
 """
 
+import argparse
 import json
-import os
-import time
-import re
-import sys
 from collections import defaultdict
-from openai import OpenAI
+
+from grading import DEFAULT_WORKERS, GradeCache, grade_all
+from provider_client import nebius_client
 
 # ── Config ──────────────────────────────────────────────
-client = OpenAI(
-    base_url="https://api.tokenfactory.nebius.com/v1/",
-    api_key=os.environ.get("NEBIUS_API_KEY", ""),
-)
-GRADER_MODEL = "meta-llama/Llama-3.3-70B-Instruct"
+client = nebius_client()
 
 V1_PATH = "docs/evaluation/coach_k_v1_eval.json"
 V2_PATH = "docs/evaluation/coach_k_v2_eval.json"
 OUTPUT_PATH = "docs/evaluation/v2_comparison_report.md"
 
-GRADING_PROMPT = """You are an evaluation grader for an AI coaching assistant called "Coach K" that specializes in Hyrox fitness racing.
-
-Given a USER PROMPT, the MODEL RESPONSE, and a list of CHECKS, determine whether each check PASSES or FAILS based on the response content.
-
-Rules:
-- PASS: The response clearly addresses or contains the information described in the check. Be generous — if the response conveys the concept even with different wording, it passes.
-- FAIL: The response is missing the information, contradicts it, or gives wrong information for that check.
-- For factual checks (specific numbers, weights, rules), require accuracy. Close approximations are OK (e.g., "~150kg" for 152kg passes).
-- For qualitative checks (tone, approach, style), be generous if the spirit is met.
-- For "does NOT" checks, PASS means the response correctly avoids the thing.
-
-Respond with ONLY a JSON array of objects, one per check, in order:
-[{"check": "<check text>", "result": "PASS" or "FAIL", "reason": "<brief 5-10 word reason>"}]
-
-Do not include any other text before or after the JSON array."""
-
-
-def grade_response(prompt, response, checks, max_retries=2):
-    """Send response + checks to grader model, return pass/fail per check."""
-    user_msg = f"""USER PROMPT: {prompt}
-
-MODEL RESPONSE: {response}
-
-CHECKS TO EVALUATE:
-{chr(10).join(f'{i+1}. {c}' for i, c in enumerate(checks))}"""
-
-    for attempt in range(max_retries + 1):
-        try:
-            result = client.chat.completions.create(
-                model=GRADER_MODEL,
-                messages=[
-                    {"role": "system", "content": GRADING_PROMPT},
-                    {"role": "user", "content": user_msg},
-                ],
-                temperature=0.0,
-                max_tokens=1500,
-            )
-            content = result.choices[0].message.content.strip()
-            # Extract JSON array from response
-            match = re.search(r'\[.*\]', content, re.DOTALL)
-            if match:
-                grades = json.loads(match.group())
-                if len(grades) == len(checks):
-                    return grades
-                # If length mismatch, pad or truncate
-                if len(grades) < len(checks):
-                    for i in range(len(grades), len(checks)):
-                        grades.append({"check": checks[i], "result": "FAIL", "reason": "grader did not evaluate"})
-                return grades[:len(checks)]
-        except (json.JSONDecodeError, Exception) as e:
-            if attempt < max_retries:
-                time.sleep(2)
-                continue
-            # Return all FAIL on parse error
-            return [{"check": c, "result": "FAIL", "reason": f"grader error: {e}"} for c in checks]
-
-    return [{"check": c, "result": "FAIL", "reason": "grader timeout"} for c in checks]
-
 
 def load_eval(path):
     """Load evaluation JSON file."""
@@ -94,43 +33,6 @@ def load_eval(path):
         return json.load(f)
 
 
-def grade_all(eval_data, label):
-    """Grade all scenarios in an evaluation file."""
-    results = eval_data["results"]
-    total = len(results)
-    graded = []
-
-    print(f"\nGrading {total} scenarios for {label}...")
-    print("=" * 60)
-
-    for i, r in enumerate(results):
-        sid = r["id"]
-        category = r["category"]
-        checks = r.get("checks", [])
-        response = r.get("response", "")
-
-        if not checks or not response:
-            graded.append({**r, "grades": [], "passed": 0, "total_checks": 0})
-            continue
-
-        print(f"  [{i+1}/{total}] {sid} ({category}) — {len(checks)} checks", end="", flush=True)
-
-        grades = grade_response(r["prompt"], response, checks)
-        passed = sum(1 for g in grades if g["result"] == "PASS")
-
-        print(f" → {passed}/{len(checks)}")
-        time.sleep(0.3)  # rate limit courtesy
-
-        graded.append({
-            **r,
-            "grades": grades,
-            "passed": passed,
-            "total_checks": len(checks),
-        })
-
-    return graded
-
-
 def build_report(v1_graded, v2_graded, v1_data, v2_data):
     """Generate markdown comparison report."""
 
@@ -495,7 +397,7 @@ def build_report(v1_graded, v2_graded, v1_data, v2_data):
     return "\n".join(lines)
 
 
-def main():
+def main(workers=DEFAULT_WORKERS, only_changed=False, batch_tokens=0):
     print("Loading evaluation files...")
     v1_data = load_eval(V1_PATH)
     v2_data = load_eval(V2_PATH)
@@ -503,8 +405,9 @@ def main():
     print(f"  V2: {len(v2_data['results'])} scenarios")
 
     # Grade both
-    v1_graded = grade_all(v1_data, "V1")
-    v2_graded = grade_all(v2_data, "V2")
+    cache = GradeCache()
+    v1_graded = grade_all(client, v1_data, "V1", workers=workers, cache=cache, only_changed=only_changed, batch_tokens=batch_tokens)
+    v2_graded = grade_all(client, v2_data, "V2", workers=workers, cache=cache, only_changed=only_changed, batch_tokens=batch_tokens)
 
     # Build report
     print("\n\nGenerating comparison report...")
@@ -537,4 +440,10 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Grade Coach K v1 vs v2 evaluations")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help=f"Concurrent grader requests (default: {DEFAULT_WORKERS})")
+    parser.add_argument("--only-changed", action="store_true", help="Reuse cached grades; only send new or changed responses to the grader")
+    parser.add_argument("--batch-tokens", type=int, default=0, help="Pack scenarios into multi-scenario grader calls of up to N input tokens (default: 0 = one per call)")
+    args = parser.parse_args()
+
+    main(workers=args.workers, only_changed=args.only_changed, batch_tokens=args.batch_tokens)
@@ -7,138 +7,31 @@ sends each response + checks to base Llama for pass/fail scoring.
 
 Usage:
     python3 scripts/grade_rag_comparison.py
+    python3 scripts/grade_rag_comparison.py --only-changed --workers 8
+    python3 scripts/grade_rag_comparison.py --batch-tokens 12000
 """
 
+import argparse
 import json
-import os
-import time
-import re
 from collections import defaultdict
-from openai import OpenAI
+
+from grading import DEFAULT_WORKERS, GradeCache, grade_all
+from provider_client import nebius_client
 
 # ── Config ──────────────────────────────────────────────
-client = OpenAI(
-    base_url="https://api.tokenfactory.nebius.com/v1/",
-    api_key=os.environ.get("NEBIUS_API_KEY", ""),
-)
-GRADER_MODEL = "meta-llama/Llama-3.3-70B-Instruct"
+client = nebius_client()
 
 V2_PATH = "docs/evaluation/coach_k_v2_eval.json"
 V2_RAG_PATH = "docs/evaluation/coach_k_v2_rag_eval.json"
 OUTPUT_PATH = "docs/evaluation/v2_rag_comparison_report.md"
 GRADES_PATH = "docs/evaluation/v2_rag_grades_raw.json"
 
-GRADING_PROMPT = """You are an evaluation grader for an AI coaching assistant called "Coach K" that specializes in Hyrox fitness racing.
-
-Given a USER PROMPT, the MODEL RESPONSE, and a list of CHECKS, determine whether each check PASSES or FAILS based on the response content.
-
-Rules:
-- PASS: The response clearly addresses or contains the information described in the check. Be generous — if the response conveys the concept even with different wording, it passes.
-- FAIL: The response is missing the information, contradicts it, or gives wrong information for that check.
-- For factual checks (specific numbers, weights, rules), require accuracy. Close approximations are OK (e.g., "~150kg" for 152kg passes).
-- For qualitative checks (tone, approach, style), be generous if the spirit is met.
-- For "does NOT" checks, PASS means the response correctly avoids the thing.
-
-Respond with ONLY a JSON array of objects, one per check, in order:
-[{"check": "<check text>", "result": "PASS" or "FAIL", "reason": "<brief 5-10 word reason>"}]
-
-Do not include any other text before or after the JSON array."""
-
-
-def repair_json(text):
-    """Attempt to fix common JSON issues from LLM output."""
-    # Strip trailing commas before ] or }
-    text = re.sub(r',\s*([}\]])', r'\1', text)
-    # Fix single quotes to double quotes
-    text = re.sub(r"(?<![\\])'", '"', text)
-    # Remove control characters
-    text = re.sub(r'[\x00-\x1f]+', ' ', text)
-    return text
-
-
-def grade_response(prompt, response, checks, max_retries=2):
-    """Send response + checks to grader model, return pass/fail per check."""
-    user_msg = f"""USER PROMPT: {prompt}
-
-MODEL RESPONSE: {response}
-
-CHECKS TO EVALUATE:
-{chr(10).join(f'{i+1}. {c}' for i, c in enumerate(checks))}"""
-
-    for attempt in range(max_retries + 1):
-        try:
-            result = client.chat.completions.create(
-                model=GRADER_MODEL,
-                messages=[
-                    {"role": "system", "content": GRADING_PROMPT},
-                    {"role": "user", "content": user_msg},
-                ],
-                temperature=0.0,
-                max_tokens=2000,
-            )
-            content = result.choices[0].message.content.strip()
-            match = re.search(r'\[.*\]', content, re.DOTALL)
-            if match:
-                raw = match.group()
-                try:
-                    grades = json.loads(raw)
-                except json.JSONDecodeError:
-                    grades = json.loads(repair_json(raw))
-                if len(grades) == len(checks):
-                    return grades
-                if len(grades) < len(checks):
-                    for i in range(len(grades), len(checks)):
-                        grades.append({"check": checks[i], "result": "FAIL", "reason": "grader did not evaluate"})
-                return grades[:len(checks)]
-        except (json.JSONDecodeError, Exception) as e:
-            if attempt < max_retries:
-                time.sleep(2)
-                continue
-            return [{"check": c, "result": "FAIL", "reason": f"grader error: {e}"} for c in checks]
-
-    return [{"check": c, "result": "FAIL", "reason": "grader timeout"} for c in checks]
-
 
 def load_eval(path):
     with open(path) as f:
         return json.load(f)
 
 
-def grade_all(eval_data, label):
-    """Grade all scenarios."""
-    results = eval_data["results"]
-    total = len(results)
-    graded = []
-
-    print(f"\nGrading {total} scenarios for {label}...")
-    print("=" * 60)
-
-    for i, r in enumerate(results):
-        checks = r.get("checks", [])
-        response = r.get("response", "")
-
-        if not checks or not response:
-            graded.append({**r, "grades": [], "passed": 0, "total_checks": 0})
-            continue
-
-        print(f"  [{i+1}/{total}] {r['id']} ({r['category']}) — {len(checks)} checks", end="", flush=True)
-
-        grades = grade_response(r["prompt"], response, checks)
-        passed = sum(1 for g in grades if g["result"] == "PASS")
-
-        print(f" → {passed}/{len(checks)}")
-        time.sleep(0.3)
-
-        graded.append({
-            **r,
-            "grades": grades,
-            "passed": passed,
-            "total_checks": len(checks),
-        })
-
-    return graded
-
-
 def build_report(v2_graded, rag_graded, v2_data, rag_data):
     """Generate markdown comparison: v2 vs v2+RAG."""
     v2_by_id = {r["id"]: r for r in v2_graded}
@@ -334,16 +227,17 @@ def build_report(v2_graded, rag_graded, v2_data, rag_data):
     return "\n".join(lines)
 
 
-def main():
+def main(workers=DEFAULT_WORKERS, only_changed=False, batch_tokens=0):
     print("Loading evaluation files...")
     v2_data = load_eval(V2_PATH)
     rag_data = load_eval(V2_RAG_PATH)
     print(f"  v2 (model only): {len(v2_data['results'])} scenarios")
     print(f"  v2+RAG: {len(rag_data['results'])} scenarios")
 
-    # Grade both (v2 may already have grades, but re-grade for consistency)
-    v2_graded = grade_all(v2_data, "v2 (model only)")
-    rag_graded = grade_all(rag_data, "v2+RAG")
+    # Grade both (re-graded for consistency unless --only-changed reuses cached grades)
+    cache = GradeCache()
+    v2_graded = grade_all(client, v2_data, "v2 (model only)", workers=workers, cache=cache, only_changed=only_changed, batch_tokens=batch_tokens)
+    rag_graded = grade_all(client, rag_data, "v2+RAG", workers=workers, cache=cache, only_changed=only_changed, batch_tokens=batch_tokens)
 
     # Build report
     print("\n\nGenerating comparison report...")
@@ -376,4 +270,10 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Grade Coach K v2 vs v2+RAG evaluations")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help=f"Concurrent grader requests (default: {DEFAULT_WORKERS})")
+    parser.add_argument("--only-changed", action="store_true", help="Reuse cached grades; only send new or changed responses to the grader")
+    parser.add_argument("--batch-tokens", type=int, default=0, help="Pack scenarios into multi-scenario grader calls of up to N input tokens (default: 0 = one per call)")
+    args = parser.parse_args()
+
+    main(workers=args.workers, only_changed=args.only_changed, batch_tokens=args.batch_tokens)
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+Shared grading engine for the Coach K evaluation reports.
+
+Used by grade_evaluation.py and grade_rag_comparison.py. Each scenario's
+response + checks is sent to the base Llama grader for pass/fail scoring on
+a pool of workers, paced by the shared Nebius budget (an optional fixed RPM
+plus the provider's rate-limit headers).
+
+Grades are cached in docs/evaluation/grade_cache.json, keyed by
+sha256(grader model, grading prompts, prompt, response, checks), so editing
+GRADING_PROMPT or BATCH_GRADING_PROMPT invalidates earlier grades. With only_changed=True a
+cached grade is reused and only new or changed responses reach the grader;
+otherwise every scenario is re-graded and the cache refreshed.
+
+With batch_tokens > 0, several (prompt, response, checks) triples are packed
+into one grader call up to that many input tokens, and the grader answers
+with a JSON object keyed by scenario id. Any scenario whose grades are
+missing or malformed in the batch answer is re-graded on its own.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from provider_client import provider_budget
+from rate_limit import estimate_request_tokens, retry_delay
+
+GRADER_MODEL = "meta-llama/Llama-3.3-70B-Instruct"
+GRADE_CACHE_PATH = "docs/evaluation/grade_cache.json"
+DEFAULT_WORKERS = 4
+DEFAULT_RPM = 200  # Matches the old fixed 0.3s spacing when running serially
+MAX_BATCH_SCENARIOS = 10
+OUTPUT_TOKENS_PER_CHECK = 40
+
+GRADING_PROMPT = """You are an evaluation grader for an AI coaching assistant called "Coach K" that specializes in Hyrox fitness racing.
+
+Given a USER PROMPT, the MODEL RESPONSE, and a list of CHECKS, determine whether each check PASSES or FAILS based on the response content.
+
+Rules:
+- PASS: The response clearly addresses or contains the information described in the check. Be generous — if the response conveys the concept even with different wording, it passes.
+- FAIL: The response is missing the information, contradicts it, or gives wrong information for that check.
+- For factual checks (specific numbers, weights, rules), require accuracy. Close approximations are OK (e.g., "~150kg" for 152kg passes).
+- For qualitative checks (tone, approach, style), be generous if the spirit is met.
+- For "does NOT" checks, PASS means the response correctly avoids the thing.
+
+Respond with ONLY a JSON array of objects, one per check, in order:
+[{"check": "<check text>", "result": "PASS" or "FAIL", "reason": "<brief 5-10 word reason>"}]
+
+Do not include any other text before or after the JSON array."""
+
+
+BATCH_GRADING_PROMPT = GRADING_PROMPT.split("Respond with ONLY")[0] + """You will receive several scenarios, each introduced by a line "=== SCENARIO <id> ===". Grade each one independently.
+
+Respond with ONLY a JSON object keyed by scenario id. Each value is a JSON array of objects, one per check of that scenario, in order:
+{"<scenario id>": [{"check": "<check text>", "result": "PASS" or "FAIL", "reason": "<brief 5-10 word reason>"}], ...}
+
+Include every scenario id exactly once. Do not include any other text before or after the JSON object."""
+
+# Part of every grade cache key: changing either prompt re-grades instead of reusing stale grades
+GRADER_PROMPTS_HASH = hashlib.sha256((GRADING_PROMPT + BATCH_GRADING_PROMPT).encode("utf-8")).hexdigest()
+
+
+def repair_json(text):
+    """Attempt to fix common JSON issues from LLM output."""
+    # Strip trailing commas before ] or }
+    text = re.sub(r',\s*([}\]])', r'\1', text)
+    # Fix single quotes to double quotes
+    text = re.sub(r"(?<![\\])'", '"', text)
+    # Remove control characters
+    text = re.sub(r'[\x00-\x1f]+', ' ', text)
+    return text
+
+
+def format_grading_request(prompt, response, checks):
+    return f"""USER PROMPT: {prompt}
+
+MODEL RESPONSE: {response}
+
+CHECKS TO EVALUATE:
+{chr(10).join(f'{i+1}. {c}' for i, c in enumerate(checks))}"""
+
+
+def grade_response(client, prompt, response, checks, max_retries=2, max_tokens=2000, budget=None):
+    """Send response + checks to grader model, return pass/fail per check.
+
+    Every attempt, retries included, is paced by budget when one is given.
+    """
+    user_msg = format_grading_request(prompt, response, checks)
+
+    for attempt in range(max_retries + 1):
+        if budget is not None:
+            budget.acquire()
+        try:
+            result = client.chat.completions.create(
+                model=GRADER_MODEL,
+                messages=[
+                    {"role": "system", "content": GRADING_PROMPT},
+                    {"role": "user", "content": user_msg},
+                ],
+                temperature=0.0,
+                max_tokens=max_tokens,
+            )
+            content = result.choices[0].message.content.strip()
+            # Extract JSON array from response
+            match = re.search(r'\[.*\]', content, re.DOTALL)
+            if match:
+                raw = match.group()
+                try:
+                    grades = json.loads(raw)
+                except json.JSONDecodeError:
+                    grades = json.loads(repair_json(raw))
+                if len(grades) == len(checks):
+                    return grades
+                # If length mismatch, pad or truncate
+                if len(grades) < len(checks):
+                    for i in range(len(grades), len(checks)):
+                        grades.append({"check": checks[i], "result": "FAIL", "reason": "grader did not evaluate"})
+                return grades[:len(checks)]
+        except (json.JSONDecodeError, Exception) as e:
+            if attempt < max_retries:
+                time.sleep(retry_delay(e, attempt + 1, base_delay=2.0))
+                continue
+            # Return all FAIL on parse error
+            return [{"check": c, "result": "FAIL", "reason": f"grader error: {e}"} for c in checks]
+
+    return [{"check": c, "result": "FAIL", "reason": "grader timeout"} for c in checks]
+
+
+def valid_grades(grades, checks):
+    return (
+        isinstance(grades, list)
+        and len(grades) == len(checks)
+        and all(isinstance(g, dict) and g.get("result") in ("PASS", "FAIL") for g in grades)
+    )
+
+
+def grade_batch(client, items, budget=None):
+    """Grade several scenarios in one call. items: [(sid, prompt, response, checks)].
+
+    Returns {sid: grades} for the scenarios that came back well-formed; the
+    caller re-grades the rest individually.
+    """
+    user_msg = "\n\n".join(
+        f"=== SCENARIO {sid} ===\n{format_grading_request(prompt, response, checks)}"
+        for sid, prompt, response, checks in items
+    )
+    total_checks = sum(len(checks) for *_, checks in items)
+    if budget is not None:
+        budget.acquire()
+    try:
+        result = client.chat.completions.create(
+            model=GRADER_MODEL,
+            messages=[
+                {"role": "system", "content": BATCH_GRADING_PROMPT},
+                {"role": "user", "content": user_msg},
+            ],
+            temperature=0.0,
+            max_tokens=min(8000, 200 + OUTPUT_TOKENS_PER_CHECK * total_checks),
+        )
+        content = result.choices[0].message.content.strip()
+        match = re.search(r'\{.*\}', content, re.DOTALL)
+        if not match:
+            return {}
+        raw = match.group()
+        try:
+            parsed = json.loads(raw)
+        except json.JSONDecodeError:
+            parsed = json.loads(repair_json(raw))
+    except Exception:
+        return {}
+    if not isinstance(parsed, dict):
+        return {}
+
+    return {
+        sid: parsed[sid]
+        for sid, _, _, checks in items
+        if valid_grades(parsed.get(sid), checks)
+    }
+
+
+def plan_grading_batches(items, batch_tokens, max_scenarios=MAX_BATCH_SCENARIOS):
+    """Group (sid, prompt, response, checks) items into batches of at most batch_tokens input tokens.
+
+    Returns lists of positions into `items`, in order.
+    """
+    overhead = estimate_request_tokens([BATCH_GRADING_PROMPT])
+    batches, current, current_tokens = [], [], overhead
+    for pos, (_, prompt, response, checks) in enumerate(items):
+        cost = estimate_request_tokens([format_grading_request(prompt, response, checks)])
+        if current and (current_tokens + cost > batch_tokens or len(current) >= max_scenarios):
+            batches.append(current)
+            current, current_tokens = [], overhead
+        current.append(pos)
+        current_tokens += cost
+    if current:
+        batches.append(current)
+    return batches
+
+
+def grade_key(prompt, response, checks, grader_model=GRADER_MODEL):
+    """Cache key for one grading request (a grade may come from either the single or the batch prompt)."""
+    payload = json.dumps([grader_model, GRADER_PROMPTS_HASH, prompt, response, checks], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def is_grader_failure(grades):
+    """Grades produced by an error fallback should never be cached."""
+    return any(g.get("reason", "").startswith(("grader error", "grader timeout")) for g in grades)
+
+
+class GradeCache:
+    """JSON-file cache of grades, persisted next to the raw grade files. Thread-safe."""
+
+    def __init__(self, path=GRADE_CACHE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    def get(self, key):
+        with self._lock:
+            return self.entries.get(key)
+
+    def put(self, key, grades):
+        if is_grader_failure(grades):
+            return
+        with self._lock:
+            self.entries[key] = grades
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self._lock:
+            with open(self.path, "w") as f:
+                json.dump(self.entries, f, indent=1, sort_keys=True)
+
+
+def grade_all(client, eval_data, label, workers=DEFAULT_WORKERS, cache=None, only_changed=False, rpm=DEFAULT_RPM,
+              batch_tokens=0):
+    """Grade all scenarios in an evaluation file. Results keep scenario order.
+
+    batch_tokens > 0 packs scenarios into multi-scenario grader calls of up to
+    that many input tokens; 0 sends one request per scenario.
+    """
+    results = eval_data["results"]
+    total = len(results)
+    graded = [None] * total
+    budget = provider_budget("nebius", rpm=rpm)
+    reused = 0
+
+    mode = f"batches of ≤{batch_tokens} tokens" if batch_tokens else "one scenario per call"
+    print(f"\nGrading {total} scenarios for {label} ({workers} workers, {mode}{', only changed' if only_changed else ''})...")
+    print("=" * 60)
+
+    def finish(i, r, grades, source=""):
+        passed = sum(1 for g in grades if g["result"] == "PASS")
+        graded[i] = {**r, "grades": grades, "passed": passed, "total_checks": len(r["checks"])}
+        print(f"  [{i+1}/{total}] {r['id']} ({r['category']}) — {len(r['checks'])} checks → {passed}/{len(r['checks'])}{source}")
+
+    def grade_one(r):
+        return grade_response(client, r["prompt"], r["response"], r["checks"], budget=budget)
+
+    def as_item(i):
+        r = results[i]
+        return (r["id"], r["prompt"], r["response"], r["checks"])
+
+    def grade_many(pairs):
+        return grade_batch(client, [as_item(i) for i, _ in pairs], budget=budget)
+
+    def record(i, key, grades):
+        if cache is not None:
+            cache.put(key, grades)
+        finish(i, results[i], grades)
+
+    pending = []  # (index, cache key)
+    for i, r in enumerate(results):
+        checks = r.get("checks", [])
+        response = r.get("response", "")
+
+        if not checks or not response:
+            graded[i] = {**r, "grades": [], "passed": 0, "total_checks": 0}
+            continue
+
+        key = grade_key(r["prompt"], response, checks)
+        cached = cache.get(key) if (cache is not None and only_changed) else None
+        if cached is not None:
+            reused += 1
+            finish(i, r, cached, " (cached)")
+            continue
+        pending.append((i, key))
+
+    calls = split_out = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        singles = pending
+        if batch_tokens:
+            batches = plan_grading_batches([as_item(i) for i, _ in pending], batch_tokens)
+            batch_pairs = [[pending[pos] for pos in batch] for batch in batches]
+
+            # Anything a batch answer leaves missing or malformed is re-graded on its own
+            singles = []
+            futures = {pool.submit(grade_many, pairs): pairs for pairs in batch_pairs}
+            calls += len(futures)
+            for future in as_completed(futures):
+                pairs = futures[future]
+                parsed = future.result()
+                for i, key in pairs:
+                    if results[i]["id"] in parsed:
+                        record(i, key, parsed[results[i]["id"]])
+                    else:
+                        singles.append((i, key))
+            split_out = len(singles)
+
+        futures = {pool.submit(grade_one, results[i]): (i, key) for i, key in singles}
+        calls += len(futures)
+        for future in as_completed(futures):
+            i, key = futures[future]
+            record(i, key, future.result())
+
+    if cache is not None:
+        cache.save()
+    print(f"  {len(pending)} graded in {calls} grader calls ({split_out} re-graded individually), {reused} reused from cache")
+    return graded
@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+"""
+Streaming JSONL reading and writing for the training-data pipeline.
+
+combine_training_data.py, validate_training_data.py and
+analyze_training_data.py go through these helpers instead of loading every
+example into a list, so memory stays flat as docs/training-data grows:
+  - iter_jsonl() parses one line at a time (orjson when installed, json
+    otherwise) and reports bad lines instead of raising; with shard_ranges()
+    a file can be split into line-aligned byte ranges for worker processes
+  - JsonlWriter writes one example per line in the json.dumps(ensure_ascii=False)
+    format the combined files have always used, whichever parser is installed;
+    open_stream() starts a file another process can follow_jsonl() while it
+    is written, and finish() ends it with the marker the follower stops at
+  - SplitWriter assigns each example to train/eval from a 64-bit content
+    hash (example_hash), in the same pass that reads it, and appends only
+    examples not already in the combined files (a full rewrite holds the
+    examples until close() so it can write them in hash order)
+
+Usage:
+    for line_num, obj, error in iter_jsonl(path): ...
+    for line_num, obj, error in follow_jsonl(path): ...   # while an open_stream() writer is still writing it
+    with JsonlWriter(path) as out:
+        out.write(example)
+    with SplitWriter(combined_dir, eval_ratio=0.10, source="combine") as split:
+        split.add(example)
+"""
+
+import hashlib
+import json
+import os
+import time
+import uuid
+
+try:
+    import orjson
+except ImportError:  # optional: ~5x faster parsing, same results
+    orjson = None
+
+START_OF_STREAM = "_start_of_stream"  # key of the header record open_stream() writes (value: run id)
+END_OF_STREAM = "_end_of_stream"  # key of the marker record JsonlWriter.finish() writes
+FOLLOW_POLL_SECONDS = 0.5
+FOLLOW_IDLE_TIMEOUT = 600
+
+
+def loads(line):
+    if orjson is not None:
+        return orjson.loads(line)
+    return json.loads(line)
+
+
+def dumps(obj):
+    return json.dumps(obj, ensure_ascii=False)
+
+
+def iter_jsonl(path, start=0, end=None):
+    """Yield (line_num, obj, error) for each non-blank line; error is None or the parse error message.
+
+    start/end restrict reading to the lines in the byte range [start, end),
+    as produced by shard_ranges(); line numbers then count from start.
+    """
+    with open(path, "rb") as f:
+        f.seek(start)
+        pos = start
+        for line_num, line in enumerate(f, 1):
+            if end is not None and pos >= end:
+                break
+            pos += len(line)
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                obj = loads(line)
+            except ValueError as e:  # json and orjson decode errors are both ValueErrors
+                yield line_num, None, str(e)
+                continue
+            yield line_num, obj, None
+
+
+def open_stream(path):
+    """JsonlWriter for a file another process will follow_jsonl() while it is written.
+
+    The run's header record (run id + writer pid) is written to a temporary
+    file that then atomically replaces `path`, so a follower never sees a
+    previous run's file truncated under it: it sees either the old file or
+    the new one from its first line.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    writer = JsonlWriter(tmp_path)
+    writer.run_id = uuid.uuid4().hex
+    writer._file.write(dumps({START_OF_STREAM: writer.run_id, "pid": os.getpid()}) + "\n")
+    writer.flush()
+    os.replace(tmp_path, path)
+    writer.path = path
+    return writer
+
+
+def _writer_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # exists, owned by someone else
+        return True
+    return True
+
+
+def _stream_state(path):
+    """(inode, header record or None, whether the file already ends with its end marker)."""
+    with open(path, "rb") as f:
+        inode = os.fstat(f.fileno()).st_ino
+        first = f.readline()
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - 64 * 1024))
+        lines = f.read().rstrip(b"\n").rsplit(b"\n", 1)
+    try:
+        header = loads(first)
+        last = loads(lines[-1])
+    except ValueError:
+        return inode, None, False
+    if not isinstance(header, dict) or START_OF_STREAM not in header:
+        return inode, None, False
+    return inode, header, isinstance(last, dict) and bool(last.get(END_OF_STREAM))
+
+
+def follow_jsonl(path, poll_interval=FOLLOW_POLL_SECONDS, idle_timeout=FOLLOW_IDLE_TIMEOUT):
+    """iter_jsonl() for a file an open_stream() writer is still writing, ending at its finish() marker.
+
+    A file that is already finished when the follower starts, has no stream
+    header, or whose writer process is gone belongs to an earlier run: it is
+    skipped and the follower waits (up to idle_timeout) for a new run to
+    replace it. A run that replaces it is followed even if it finishes before
+    the next poll. Once
+    following, waits for each line to be complete. Raises RuntimeError when
+    the writer exits without an end marker or the file is replaced by another
+    run, and TimeoutError when nothing new arrives for idle_timeout seconds.
+    """
+    waiting_since = time.monotonic()
+    initial = None  # (inode, run id) of the file present when we started; None if there was none
+    if os.path.exists(path):
+        inode, header, finished = _stream_state(path)
+        if header is not None and not finished and _writer_alive(header["pid"]):
+            initial = ()  # a run in progress: follow it
+        else:
+            initial = (inode, header and header[START_OF_STREAM])  # an earlier run's file
+    while True:
+        if os.path.exists(path):
+            inode, header, finished = _stream_state(path)
+            # Any run that replaced the initial file started after us, even if it has already finished
+            if header is not None and (inode, header[START_OF_STREAM]) != initial:
+                break
+        if time.monotonic() - waiting_since > idle_timeout:
+            raise TimeoutError(f"No new run started writing {path} within {idle_timeout}s")
+        time.sleep(poll_interval)
+
+    run_id, pid = header[START_OF_STREAM], header["pid"]
+    last_data = time.monotonic()
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_ino != inode:
+            raise RuntimeError(f"{path} was replaced by another run before it could be read")
+        line_num = 1
+        f.readline()  # header
+        partial = b""
+        while True:
+            data = f.readline()
+            if not data:
+                if os.stat(path).st_ino != inode:
+                    raise RuntimeError(f"{path} was replaced by another run while being read")
+                if not _writer_alive(pid):
+                    data = f.readline()  # the writer may have finished just before exiting
+                    if not data:
+                        raise RuntimeError(f"The process writing {path} (pid {pid}) exited without an end marker")
+                elif time.monotonic() - last_data > idle_timeout:
+                    raise TimeoutError(f"No new lines in {path} for {idle_timeout}s and no end marker")
+                else:
+                    time.sleep(poll_interval)
+                    continue
+            last_data = time.monotonic()
+            partial += data
+            if not partial.endswith(b"\n"):
+                continue  # the writer has not finished this line yet
+            line, partial = partial.strip(), b""
+            line_num += 1
+            if not line:
+                continue
+            try:
+                obj = loads(line)
+            except ValueError as e:
+                yield line_num, None, str(e)
+                continue
+            if isinstance(obj, dict) and obj.get(END_OF_STREAM):
+                if obj.get("run") != run_id:
+                    raise RuntimeError(f"{path}: end marker from run {obj.get('run')}, expected {run_id}")
+                return
+            yield line_num, obj, None
+
+
+def shard_ranges(path, shards):
+    """Split a file into at most `shards` byte ranges [start, end), each starting at a line start."""
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, "rb") as f:
+        for i in range(1, max(1, shards)):
+            f.seek(max(size * i // shards - 1, bounds[-1]))
+            f.readline()  # move to the start of the next line
+            pos = f.tell()
+            if bounds[-1] < pos < size:
+                bounds.append(pos)
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def lines_before(path, offset, block_size=1 << 20):
+    """Number of lines that end before a byte offset (turns shard-relative line numbers into file ones)."""
+    count = 0
+    with open(path, "rb") as f:
+        while offset > 0:
+            block = f.read(min(block_size, offset))
+            if not block:
+                break
+            count += block.count(b"\n")
+            offset -= len(block)
+    return count
+
+
+class JsonlWriter:
+    """Writes one JSON object per line and counts them."""
+
+    def __init__(self, path, mode="w"):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.count = 0
+        self.run_id = None  # set by open_stream()
+        self._file = open(path, mode, encoding="utf-8")
+
+    def write(self, obj):
+        self._file.write(dumps(obj) + "\n")
+        self.count += 1
+
+    def flush(self):
+        self._file.flush()
+
+    def finish(self, **summary):
+        """Write the end-of-stream marker follow_jsonl() stops at (not counted as a record)."""
+        self._file.write(dumps({END_OF_STREAM: True, "run": self.run_id, **summary}) + "\n")
+        self.flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def example_hash(example):
+    """64-bit content hash of an example's messages (other keys, like _source tags, are ignored)."""
+    payload = json.dumps(example.get("messages"), ensure_ascii=False, sort_keys=True)
+    return int.from_bytes(hashlib.blake2b(payload.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def is_eval(example_hash_value, eval_ratio):
+    """Split assignment from the hash alone: stable no matter what else is in the dataset."""
+    return example_hash_value < eval_ratio * 2 ** 64
+
+
+class SplitWriter:
+    """Append-only all/train/eval writer for the combined dataset.
+
+    Each example goes to eval when its content hash falls in the lowest
+    eval_ratio of the hash space, so adding files to raw/ never moves an
+    existing example between train and eval. split_index.json records how
+    many copies of each hash are already in the output; on the next run only
+    examples beyond those are appended, so a rebuild writes O(new data).
+
+    A full rewrite happens when full=True, when there is no index yet, or
+    when eval_ratio or the writing tool (source — each tool filters raw/
+    differently) has changed. A full rewrite is written in hash order so
+    examples from different raw files are interleaved rather than grouped by
+    file. Examples that disappeared from raw/ stay in the output until the
+    next full rebuild; `removed` counts them.
+    """
+
+    INDEX_NAME = "split_index.json"
+
+    def __init__(self, out_dir, eval_ratio, full=False, source=None):
+        self.out_dir = out_dir
+        self.eval_ratio = eval_ratio
+        self.source = source
+        self.index_path = os.path.join(out_dir, self.INDEX_NAME)
+        self.existing = {}
+        if not full and os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                index = json.load(f)
+            if index.get("eval_ratio") == eval_ratio and index.get("source") == source:
+                self.existing = index.get("examples", {})
+                self.full = False
+            else:
+                self.full = True
+        else:
+            self.full = True
+        self.seen = {}
+        self.written = {"train": 0, "eval": 0}
+        self.totals = None
+        self.pending = []  # (hash, example) buffered on a full rewrite, written sorted on close
+        mode = "w" if self.full else "a"
+        self.paths = {name: os.path.join(out_dir, f"{name}.jsonl") for name in ("all", "train", "eval")}
+        self.writers = {name: JsonlWriter(path, mode) for name, path in self.paths.items()}
+
+    def add(self, example, hash_value=None):
+        """Route one example; returns "train" or "eval". Only new examples are written."""
+        hash_value = example_hash(example) if hash_value is None else hash_value
+        split = "eval" if is_eval(hash_value, self.eval_ratio) else "train"
+        key = f"{hash_value:016x}"
+        self.seen[key] = self.seen.get(key, 0) + 1
+        if self.seen[key] > self.existing.get(key, 0):
+            if self.full:
+                self.pending.append((hash_value, example))
+            else:
+                self._write(example, split)
+        return split
+
+    def _write(self, example, split):
+        self.writers["all"].write(example)
+        self.writers[split].write(example)
+        self.written[split] += 1
+
+    @property
+    def removed(self):
+        return sum(max(0, count - self.seen.get(key, 0)) for key, count in self.existing.items())
+
+    def close(self):
+        """Write any buffered examples, close the files and record the index; sets totals."""
+        self.pending.sort(key=lambda item: item[0])
+        for hash_value, example in self.pending:
+            self._write(example, "eval" if is_eval(hash_value, self.eval_ratio) else "train")
+        self.pending = []
+        for writer in self.writers.values():
+            writer.close()
+        examples = dict(self.existing)
+        for key, count in self.seen.items():
+            examples[key] = max(count, examples.get(key, 0))
+        # Examples now in each output file, including ones kept from earlier runs
+        self.totals = {"train": 0, "eval": 0}
+        for key, count in examples.items():
+            self.totals["eval" if is_eval(int(key, 16), self.eval_ratio) else "train"] += count
+        with open(self.index_path, "w") as f:
+            json.dump({"eval_ratio": self.eval_ratio, "source": self.source, "examples": examples}, f, sort_keys=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Local in-process retrieval backend over docs/chunks/all_chunks.json.
+
+Mirrors the Supabase RPCs without a network round trip:
+  - semantic_search() ≈ match_chunks: cosine similarity over a float32 matrix
+    of L2-normalized chunk embeddings, so top-k is a single matmul
+  - hybrid_search()   ≈ hybrid_search_chunks: BM25 over `content` fused with
+    the semantic ranking using the same RRF formula, candidate limits and
+    default rrf_k=50 as the SQL function
+
+Chunk embeddings come from the on-disk embedding cache (embed_and_upload.py
+fills it), so building the index after an upload costs no API calls.
+
+Note: the SQL full-text leg uses websearch_to_tsquery, which requires every
+query term to match. BM25 here scores any-term matches, so full-text ranks
+can differ for long natural-language questions.
+
+Usage:
+    index = LocalIndex.from_chunks_file(openai_client)
+    results = index.hybrid_search(query_text, query_embedding, match_count=5)
+    batch = index.hybrid_search_many(query_texts, query_embeddings)
+"""
+
+import json
+import math
+import re
+from collections import Counter, defaultdict
+
+import numpy as np
+
+from embed_and_upload import CHUNKS_PATH, EMBEDDING_MODEL, prepare_embedding_text
+from embedding_cache import embed_texts
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+STOPWORDS = {
+    "a", "about", "above", "after", "again", "all", "am", "an", "and", "any", "are", "as", "at",
+    "be", "because", "been", "before", "being", "between", "both", "but", "by", "can", "could",
+    "did", "do", "does", "doing", "during", "each", "for", "from", "had", "has", "have", "having",
+    "he", "her", "here", "him", "his", "how", "i", "if", "in", "into", "is", "it", "its", "just",
+    "me", "more", "most", "my", "no", "nor", "not", "of", "off", "on", "once", "only", "or", "other",
+    "our", "out", "over", "own", "same", "she", "should", "so", "some", "such", "than", "that",
+    "the", "their", "them", "then", "there", "these", "they", "this", "those", "through", "to",
+    "too", "under", "until", "up", "very", "was", "we", "were", "what", "when", "where", "which",
+    "while", "who", "whom", "why", "will", "with", "would", "you", "your",
+}
+
+
+def tokenize(text):
+    """Lowercase alphanumeric terms minus English stopwords (roughly to_tsvector('english'))."""
+    return [t for t in TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+
+
+def candidate_limit(match_count):
+    """Per-leg candidate count used by hybrid_search_chunks: least(match_count, 30) * 2."""
+    return min(match_count, 30) * 2
+
+
+def rrf_fuse(full_text_ids, semantic_ids, match_count=5, full_text_weight=1.0, semantic_weight=1.0, rrf_k=50):
+    """Reciprocal Rank Fusion exactly as hybrid_search_chunks computes it. Returns [(id, score)]."""
+    scores = defaultdict(float)
+    for rank, cid in enumerate(full_text_ids, start=1):
+        scores[cid] += full_text_weight / (rrf_k + rank)
+    for rank, cid in enumerate(semantic_ids, start=1):
+        scores[cid] += semantic_weight / (rrf_k + rank)
+    fused = sorted(scores.items(), key=lambda kv: kv[1], reverse=True)
+    return fused[: min(match_count, 30)]
+
+
+class BM25Index:
+    """Inverted index over chunk content with Okapi BM25 scoring."""
+
+    def __init__(self, texts):
+        self.postings = defaultdict(list)  # term → [(doc_ix, term_freq)]
+        self.doc_lengths = []
+        for doc_ix, text in enumerate(texts):
+            terms = Counter(tokenize(text))
+            self.doc_lengths.append(sum(terms.values()))
+            for term, tf in terms.items():
+                self.postings[term].append((doc_ix, tf))
+        self.num_docs = len(texts)
+        self.avg_length = (sum(self.doc_lengths) / self.num_docs) if self.num_docs else 0.0
+
+    def scores(self, query):
+        """{doc_ix: BM25 score} for every document matching at least one query term."""
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (self.num_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_ix, tf in postings:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[doc_ix] / self.avg_length)
+                scores[doc_ix] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return scores
+
+    def top_k(self, query, k):
+        scores = self.scores(query)
+        return sorted(scores, key=lambda ix: scores[ix], reverse=True)[:k]
+
+
+class LocalIndex:
+    """All chunks in memory: normalized embedding matrix plus a BM25 index."""
+
+    def __init__(self, chunks, embeddings):
+        self.chunks = chunks
+        self.ids = [c["id"] for c in chunks]
+        self.by_id = {c["id"]: c for c in chunks}
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        self.matrix = matrix / np.maximum(norms, 1e-12)
+        self.bm25 = BM25Index([c.get("content", "") for c in chunks])
+
+    @classmethod
+    def from_chunks_file(cls, openai_client, path=CHUNKS_PATH, model=EMBEDDING_MODEL):
+        """Build from all_chunks.json, embedding through the cache (misses cost one batched call)."""
+        with open(path, "r") as f:
+            chunks = json.load(f)
+        embeddings, _ = embed_texts(openai_client, [prepare_embedding_text(c) for c in chunks], model=model)
+        return cls(chunks, embeddings)
+
+    def _normalize_queries(self, embeddings):
+        queries = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        return queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+
+    def similarities(self, query_embeddings):
+        """Cosine similarity of every query against every chunk: (n_queries, n_chunks)."""
+        return self._normalize_queries(query_embeddings) @ self.matrix.T
+
+    def _row(self, chunk_id, **score):
+        chunk = self.by_id[chunk_id]
+        return {
+            "id": chunk_id,
+            "content": chunk.get("content"),
+            "source_name": chunk.get("source_name"),
+            "section": chunk.get("section"),
+            "topic_tags": chunk.get("topic_tags", []),
+            **score,
+        }
+
+    def semantic_ranking(self, sims, k):
+        """Chunk indexes of the top-k similarities, best first."""
+        k = min(k, len(sims))
+        top = np.argpartition(-sims, k - 1)[:k]
+        return top[np.argsort(-sims[top])]
+
+    def semantic_search_many(self, query_embeddings, threshold=0.70, count=5):
+        """match_chunks for a batch of queries with one matrix product."""
+        results = []
+        for sims in self.similarities(query_embeddings):
+            ranked = self.semantic_ranking(sims, count)
+            results.append([
+                self._row(self.ids[ix], similarity=float(sims[ix]))
+                for ix in ranked if sims[ix] > threshold
+            ])
+        return results
+
+    def semantic_search(self, query_embedding, threshold=0.70, count=5):
+        return self.semantic_search_many([query_embedding], threshold, count)[0]
+
+    def hybrid_search_many(self, query_texts, query_embeddings, match_count=5,
+                           full_text_weight=1.0, semantic_weight=1.0, rrf_k=50):
+        """hybrid_search_chunks for a batch of queries with one matrix product."""
+        limit = candidate_limit(match_count)
+        results = []
+        for text, sims in zip(query_texts, self.similarities(query_embeddings)):
+            semantic_ids = [self.ids[ix] for ix in self.semantic_ranking(sims, limit)]
+            full_text_ids = [self.ids[ix] for ix in self.bm25.top_k(text, limit)]
+            fused = rrf_fuse(full_text_ids, semantic_ids, match_count, full_text_weight, semantic_weight, rrf_k)
+            results.append([self._row(cid, score=score) for cid, score in fused])
+        return results
+
+    def hybrid_search(self, query_text, query_embedding, match_count=5,
+                      full_text_weight=1.0, semantic_weight=1.0, rrf_k=50):
+        return self.hybrid_search_many(
+            [query_text], [query_embedding], match_count, full_text_weight, semantic_weight, rrf_k
+        )[0]
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+MinHash/LSH near-duplicate detection for training examples.
+
+Each example's user + assistant text (the shared system prompt would make
+everything look alike) is reduced to word 5-gram shingles and summarized by
+a 128-value MinHash signature. Signatures are banded into an LSH table
+(32 bands × 4 rows), so only examples that collide in some band are compared;
+a candidate pair counts as a near-duplicate when its estimated Jaccard
+similarity reaches the threshold. Work grows with the number of collisions,
+not with every pair of examples.
+
+Used by validate_training_data.py (--duplicates, --dedupe).
+
+Usage:
+    index = NearDuplicateIndex(threshold=0.7)
+    sig = index.signature(example_text(example))
+    matches = index.query(sig)        # [(key, similarity)] among added examples
+    index.add(key, sig)
+    clusters = index.clusters()       # [[key, ...]] with 2+ members
+"""
+
+import re
+import zlib
+from collections import defaultdict
+
+import numpy as np
+
+SHINGLE_WORDS = 5
+NUM_PERM = 128
+LSH_BANDS = 32
+DEFAULT_THRESHOLD = 0.7
+MAX_HASH = np.uint64((1 << 32) - 1)
+WORD_RE = re.compile(r"[a-z0-9]+")
+
+# Fixed seed so signatures are comparable across runs. Each "permutation" is a
+# multiply-shift hash, (a * x + b) mod 2^64 >> 32 with odd a, which is
+# 2-universal and lets uint64 arithmetic wrap instead of needing a modulus.
+_rng = np.random.default_rng(1)
+PERM_A = _rng.integers(0, 1 << 64, size=NUM_PERM, dtype=np.uint64, endpoint=False) | np.uint64(1)
+PERM_B = _rng.integers(0, 1 << 64, size=NUM_PERM, dtype=np.uint64, endpoint=False)
+
+
+def example_text(example):
+    """User and assistant content of an example, in order."""
+    return "\n".join(
+        m.get("content", "") for m in example.get("messages", [])
+        if m.get("role") in ("user", "assistant")
+    )
+
+
+def shingles(text, size=SHINGLE_WORDS):
+    """32-bit hashes of the word n-grams of text (the whole text if it is shorter than one n-gram)."""
+    words = WORD_RE.findall(text.lower())
+    grams = {" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+    return {zlib.crc32(g.encode("utf-8")) for g in grams}
+
+
+def minhash(shingle_hashes):
+    """MinHash signature (NUM_PERM 32-bit values, stored as uint64) of a set of shingle hashes."""
+    if not shingle_hashes:
+        return np.full(NUM_PERM, MAX_HASH, dtype=np.uint64)
+    x = np.fromiter(shingle_hashes, dtype=np.uint64, count=len(shingle_hashes))
+    return ((np.outer(x, PERM_A) + PERM_B) >> np.uint64(32)).min(axis=0)
+
+
+def similarity(sig_a, sig_b):
+    """Estimated Jaccard similarity of two signatures."""
+    return float(np.count_nonzero(sig_a == sig_b)) / NUM_PERM
+
+
+class NearDuplicateIndex:
+    """LSH table of MinHash signatures keyed by caller-chosen ids (e.g. "file.jsonl:12")."""
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD, bands=LSH_BANDS):
+        if NUM_PERM % bands:
+            raise ValueError(f"bands must divide {NUM_PERM}")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = NUM_PERM // bands
+        self.signatures = {}
+        self.buckets = [defaultdict(list) for _ in range(bands)]
+
+    def signature(self, text):
+        return minhash(shingles(text))
+
+    def _band_keys(self, sig):
+        for band in range(self.bands):
+            yield band, sig[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def _candidates(self, sig):
+        found = set()
+        for band, band_key in self._band_keys(sig):
+            found.update(self.buckets[band].get(band_key, ()))
+        return found
+
+    def query(self, sig):
+        """Already-added keys whose estimated similarity to sig reaches the threshold, best first."""
+        matches = []
+        for key in self._candidates(sig):
+            sim = similarity(sig, self.signatures[key])
+            if sim >= self.threshold:
+                matches.append((key, sim))
+        return sorted(matches, key=lambda m: -m[1])
+
+    def add(self, key, sig):
+        self.signatures[key] = sig
+        for band, band_key in self._band_keys(sig):
+            self.buckets[band][band_key].append(key)
+
+    def pairs(self):
+        """Verified near-duplicate pairs (key_a, key_b, similarity), each pair once."""
+        checked = set()
+        for table in self.buckets:
+            for keys in table.values():
+                for i, a in enumerate(keys):
+                    for b in keys[i + 1:]:
+                        if (a, b) in checked:
+                            continue
+                        checked.add((a, b))
+                        sim = similarity(self.signatures[a], self.signatures[b])
+                        if sim >= self.threshold:
+                            yield a, b, sim
+
+    def clusters(self):
+        """Connected groups of near-duplicates (2+ members), largest first; members in insertion order."""
+        parent = {}
+
+        def find(key):
+            parent.setdefault(key, key)
+            while parent[key] != key:
+                parent[key] = parent[parent[key]]
+                key = parent[key]
+            return key
+
+        for a, b, _ in self.pairs():
+            parent[find(a)] = find(b)
+
+        order = {key: i for i, key in enumerate(self.signatures)}
+        groups = defaultdict(list)
+        for key in parent:
+            groups[find(key)].append(key)
+        clusters = [sorted(g, key=order.get) for g in groups.values() if len(g) > 1]
+        return sorted(clusters, key=lambda g: (-len(g), order[g[0]]))
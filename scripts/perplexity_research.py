@@ -21,13 +21,14 @@ import json
 import glob
 import argparse
 import time
-import requests
 from pathlib import Path
 from datetime import datetime
 
+from provider_client import PERPLEXITY_BASE_URL, post_json, provider_budget
+
 # Configuration
 API_KEY = os.environ.get("PERPLEXITY_API_KEY", "")
-BASE_URL = "https://api.perplexity.ai"
+BASE_URL = PERPLEXITY_BASE_URL
 DEFAULT_PRESET = "advanced-deep-research"  # Uses Claude Opus 4.6, 10 max steps
 MAX_RETRIES = 3
 RETRY_DELAY = 10  # seconds
@@ -167,11 +168,6 @@ def run_research(prompt: str, preset: str = DEFAULT_PRESET, max_output_tokens: i
             "Get your key at https://www.perplexity.ai/settings/api"
         )
 
-    headers = {
-        "Authorization": f"Bearer {API_KEY}",
-        "Content-Type": "application/json",
-    }
-
     payload = {
         "preset": preset,
         "input": prompt,
@@ -183,58 +179,27 @@ def run_research(prompt: str, preset: str = DEFAULT_PRESET, max_output_tokens: i
     print(f"Prompt length: {len(prompt)} chars ({len(prompt.split())} words)")
     print(f"{'='*60}\n")
 
-    for attempt in range(1, MAX_RETRIES + 1):
-        try:
-            start = time.time()
-            response = requests.post(
-                f"{BASE_URL}/v1/responses",
-                headers=headers,
-                json=payload,
-                timeout=600,
-            )
-            elapsed = time.time() - start
-
-            if response.status_code == 200:
-                result = response.json()
-                cost = result.get("usage", {}).get("cost", {})
-                print(f"Completed in {elapsed:.1f}s")
-                print(f"Model: {result.get('model', 'unknown')}")
-                print(f"Status: {result.get('status', 'unknown')}")
-                if cost:
-                    print(f"Cost: ${cost.get('total_cost', 0):.4f}")
-                return result
-
-            print(f"Attempt {attempt}/{MAX_RETRIES}: HTTP {response.status_code}")
-            print(f"Response: {response.text[:500]}")
-
-            if response.status_code in (429, 500, 502, 503, 504):
-                if attempt < MAX_RETRIES:
-                    wait = RETRY_DELAY * attempt
-                    print(f"Retrying in {wait}s...")
-                    time.sleep(wait)
-                    continue
-
-            response.raise_for_status()
-
-        except requests.exceptions.Timeout:
-            print(f"Attempt {attempt}/{MAX_RETRIES}: Request timed out after 600s")
-            if attempt < MAX_RETRIES:
-                wait = RETRY_DELAY * attempt
-                print(f"Retrying in {wait}s...")
-                time.sleep(wait)
-            else:
-                raise
-
-        except requests.exceptions.ConnectionError as e:
-            print(f"Attempt {attempt}/{MAX_RETRIES}: Connection error: {e}")
-            if attempt < MAX_RETRIES:
-                wait = RETRY_DELAY * attempt
-                print(f"Retrying in {wait}s...")
-                time.sleep(wait)
-            else:
-                raise
-
-    raise RuntimeError(f"Failed after {MAX_RETRIES} attempts")
+    start = time.time()
+    response = post_json(
+        f"{BASE_URL}/v1/responses",
+        payload,
+        api_key=API_KEY,
+        timeout=600,
+        max_attempts=MAX_RETRIES,
+        base_delay=RETRY_DELAY,
+        label="Research request",
+        budget=provider_budget("perplexity"),
+    )
+    elapsed = time.time() - start
+
+    result = response.json()
+    cost = result.get("usage", {}).get("cost", {})
+    print(f"Completed in {elapsed:.1f}s")
+    print(f"Model: {result.get('model', 'unknown')}")
+    print(f"Status: {result.get('status', 'unknown')}")
+    if cost:
+        print(f"Cost: ${cost.get('total_cost', 0):.4f}")
+    return result
 
 
 def save_output(task_name: str, result: dict, raw_prompt: str, preset: str = DEFAULT_PRESET):
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Shared API clients for the provider-facing scripts.
+
+One place for connection reuse, timeouts, retries and rate limits:
+  - openai_client() / nebius_client() return one OpenAI SDK client per
+    (key, options) per process, so every call in a run reuses the same
+    keep-alive connection pool instead of handshaking again
+  - http_session() is a pooled requests.Session for raw HTTP (Nebius
+    chat/completions in test_coach_k.py, Perplexity's /v1/responses), and
+    post_json() posts through it with a timeout and rate_limit.with_backoff()
+    (jittered exponential backoff on 429/5xx and dropped connections)
+  - async_openai_client() / async_nebius_client() / apost_json() are the
+    asyncio equivalents
+  - provider_budget() is the process-wide rate_limit.RateBudget of each
+    provider. Every response from these clients feeds its rate-limit headers
+    to that budget, so whichever script acquires from it is paced by the
+    provider's remaining quota and Retry-After
+
+Usage:
+    client = nebius_client()                      # NEBIUS_API_KEY from the environment
+    budget = provider_budget("nebius", rpm=120)   # fixed ceiling on top of the headers
+    budget.acquire(estimated_tokens)
+    response = post_json(f"{PERPLEXITY_BASE_URL}/v1/responses", payload, api_key=API_KEY,
+                         timeout=600, label="Research request", budget=provider_budget("perplexity"))
+"""
+
+import os
+import threading
+import time
+from functools import lru_cache
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from rate_limit import RateBudget, awith_backoff, with_backoff
+
+NEBIUS_BASE_URL = "https://api.tokenfactory.nebius.com/v1/"
+PERPLEXITY_BASE_URL = "https://api.perplexity.ai"
+DEFAULT_TIMEOUT = 120          # seconds; long research calls pass their own
+DEFAULT_SDK_RETRIES = 2        # OpenAI SDK retries (its own jittered backoff)
+DEFAULT_ATTEMPTS = 3           # post_json attempts
+POOL_SIZE = 32                 # keep-alive connections per host
+
+
+# ── Rate budgets ────────────────────────────────────────
+
+_budgets = {}
+_budgets_lock = threading.Lock()
+
+
+def provider_budget(provider, rpm=None, tpm=None):
+    """Process-wide RateBudget for "openai", "nebius" or "perplexity".
+
+    Each limit passed replaces that fixed limit (0 disables it); limits not
+    passed keep whatever an earlier caller set. With no fixed limits it is
+    paced by the provider's rate-limit headers alone.
+    """
+    with _budgets_lock:
+        budget = _budgets.get(provider)
+        if budget is None:
+            budget = _budgets[provider] = RateBudget()
+    budget.configure(rpm=rpm, tpm=tpm)
+    return budget
+
+
+# ── OpenAI-compatible SDK clients ───────────────────────
+
+@lru_cache(maxsize=None)
+def _sdk_client(async_client, provider, api_key, base_url, timeout, max_retries):
+    from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
+
+    budget = provider_budget(provider)
+    if async_client:
+        async def observe(response):
+            budget.observe(response.headers)
+
+        http_client = DefaultAsyncHttpxClient(event_hooks={"response": [observe]})
+        cls = AsyncOpenAI
+    else:
+        http_client = DefaultHttpxClient(event_hooks={"response": [lambda response: budget.observe(response.headers)]})
+        cls = OpenAI
+    return cls(api_key=api_key, base_url=base_url, timeout=timeout, max_retries=max_retries, http_client=http_client)
+
+
+def openai_client(api_key=None, timeout=DEFAULT_TIMEOUT, max_retries=DEFAULT_SDK_RETRIES):
+    """Shared OpenAI client (embeddings); api_key defaults to OPENAI_API_KEY."""
+    return _sdk_client(False, "openai", api_key or os.getenv("OPENAI_API_KEY"), None, timeout, max_retries)
+
+
+def nebius_client(api_key=None, timeout=DEFAULT_TIMEOUT, max_retries=DEFAULT_SDK_RETRIES):
+    """Shared client for Nebius Token Factory (Coach K, grader); api_key defaults to NEBIUS_API_KEY."""
+    return _sdk_client(False, "nebius", api_key or os.getenv("NEBIUS_API_KEY", ""), NEBIUS_BASE_URL, timeout,
+                       max_retries)
+
+
+def async_openai_client(api_key=None, timeout=DEFAULT_TIMEOUT, max_retries=DEFAULT_SDK_RETRIES):
+    return _sdk_client(True, "openai", api_key or os.getenv("OPENAI_API_KEY"), None, timeout, max_retries)
+
+
+def async_nebius_client(api_key=None, timeout=DEFAULT_TIMEOUT, max_retries=DEFAULT_SDK_RETRIES):
+    return _sdk_client(True, "nebius", api_key or os.getenv("NEBIUS_API_KEY", ""), NEBIUS_BASE_URL, timeout,
+                       max_retries)
+
+
+# ── Raw HTTP ────────────────────────────────────────────
+
+_session = None
+_session_lock = threading.Lock()
+_async_http = None
+
+
+def http_session():
+    """Process-wide requests.Session with a keep-alive pool of POOL_SIZE connections per host."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
+
+def auth_headers(api_key):
+    return {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+
+
+def post_json(url, payload, api_key, timeout=DEFAULT_TIMEOUT, stream=False, max_attempts=DEFAULT_ATTEMPTS,
+              base_delay=1.0, label=None, budget=None, tokens=0):
+    """POST a JSON payload through the pooled session, retrying transient failures.
+
+    With a budget, every attempt acquires from it (`tokens` estimated) and
+    every response's rate-limit headers are fed back to it.
+
+    Returns the successful requests.Response (still open when stream=True),
+    with `sent_at` set to the time.time() its request was sent, so callers can
+    time the provider without budget waits and retry backoff; raises the last
+    error once retries are exhausted or the failure is not retryable
+    (e.g. HTTP 400/401).
+    """
+    def attempt():
+        if budget is not None:
+            budget.acquire(tokens)
+        sent_at = time.time()
+        response = http_session().post(url, headers=auth_headers(api_key), json=payload, timeout=timeout,
+                                       stream=stream)
+        response.sent_at = sent_at
+        if budget is not None:
+            budget.observe(response.headers)
+        if response.status_code >= 400:
+            print(f"  HTTP {response.status_code}: {response.text[:500]}")
+            response.raise_for_status()
+        return response
+
+    return with_backoff(attempt, max_attempts=max_attempts, base_delay=base_delay, label=label)
+
+
+def async_http():
+    """Process-wide httpx.AsyncClient (create and use it inside one event loop)."""
+    global _async_http
+    if _async_http is None:
+        import httpx
+
+        _async_http = httpx.AsyncClient(limits=httpx.Limits(max_connections=POOL_SIZE,
+                                                            max_keepalive_connections=POOL_SIZE))
+    return _async_http
+
+
+async def apost_json(url, payload, api_key, timeout=DEFAULT_TIMEOUT, max_attempts=DEFAULT_ATTEMPTS, base_delay=1.0,
+                     label=None, budget=None, tokens=0):
+    """Async post_json(); returns the parsed JSON body."""
+    async def attempt():
+        if budget is not None:
+            await budget.aacquire(tokens)
+        response = await async_http().post(url, headers=auth_headers(api_key), json=payload, timeout=timeout)
+        if budget is not None:
+            budget.observe(response.headers)
+        if response.status_code >= 400:
+            print(f"  HTTP {response.status_code}: {response.text[:500]}")
+            response.raise_for_status()
+        return response.json()
+
+    return await awith_backoff(attempt, max_attempts=max_attempts, base_delay=base_delay, label=label)
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+Request/token budget shared by the batch scripts.
+
+Replaces fixed time.sleep() pacing with a sliding one-minute window: callers
+acquire a slot before each API call and only block when the requests-per-minute
+or tokens-per-minute limit would otherwise be exceeded. Thread-safe, so one
+budget can be shared by every worker in a pool (aacquire() for asyncio tasks).
+
+The budget also adapts to what the provider reports. observe() reads the
+rate-limit headers of each response:
+  - x-ratelimit-remaining-requests / x-ratelimit-reset-requests: the
+    remaining requests are spread evenly over the time to reset, so calls
+    slow down as the quota drains instead of running into a 429
+  - x-ratelimit-remaining-tokens / x-ratelimit-reset-tokens: a request
+    estimated above the remaining tokens waits for the reset
+  - Retry-After (or retry-after-ms): every caller pauses that long
+With no fixed rpm/tpm the headers alone set the pace. provider_client wires
+observe() into every SDK client and post_json() call.
+
+Also provides with_backoff(), a jittered exponential retry for calls that
+fail with 429/5xx or a dropped connection (waiting at least Retry-After when
+the error carries one), and awith_backoff() for coroutines.
+
+Usage:
+    budget = RateBudget(rpm=120, tpm=200_000)
+    slot = budget.acquire(tokens=estimated_tokens)
+    response = with_backoff(lambda: client.chat.completions.create(...))
+    budget.settle(slot, response.usage.total_tokens)
+    budget.observe(raw_response.headers)           # done for you by provider_client
+"""
+
+import asyncio
+import random
+import re
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+
+WINDOW_SECONDS = 60.0
+RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+TRANSIENT_ERROR_NAMES = {
+    "APIConnectionError", "APITimeoutError", "ConnectError", "ConnectTimeout", "ConnectionError", "Timeout",
+    "ReadError", "ReadTimeout", "RemoteProtocolError", "WriteTimeout", "PoolTimeout",
+}
+TEXT_STATUS_MODULES = {"postgrest", "supabase", "storage3"}
+
+
+DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+DURATION_SECONDS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_duration(value):
+    """Seconds in a rate-limit header value: "20", "1.5", "6m0s", "120ms" (None if unparseable)."""
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    parts = DURATION_PART.findall(value)
+    if not parts or "".join(n + u for n, u in parts) != value:
+        return None
+    return sum(float(n) * DURATION_SECONDS[u] for n, u in parts)
+
+
+def retry_after(headers):
+    """Seconds a Retry-After / retry-after-ms header asks us to wait, or None."""
+    if headers is None:
+        return None
+    ms = headers.get("retry-after-ms")
+    if ms is not None:
+        seconds = parse_duration(ms)
+        if seconds is not None:
+            return seconds / 1000
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    seconds = parse_duration(value)
+    if seconds is None:
+        try:  # HTTP-date form
+            seconds = max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+        except (TypeError, ValueError):
+            return None
+    return seconds
+
+
+def _header_int(headers, name):
+    value = headers.get(name)
+    try:
+        return int(float(value)) if value is not None else None
+    except ValueError:
+        return None
+
+
+def estimate_request_tokens(texts, max_tokens=0):
+    """Rough token cost of a request (~4 chars/token) plus its completion cap."""
+    return sum(len(t) for t in texts) // 4 + max_tokens
+
+
+class RateBudget:
+    """Sliding-window RPM/TPM limiter that also adapts to provider rate-limit headers.
+
+    A limit of None or 0 disables that fixed check; observe() still paces by headers.
+    """
+
+    def __init__(self, rpm=None, tpm=None):
+        self.rpm = rpm or None
+        self.tpm = tpm or None
+        self.throttled_seconds = 0.0
+        self._lock = threading.Lock()
+        self._events = deque()  # [timestamp, tokens] — lists so settle() can correct the reservation
+        self._paused_until = 0.0     # Retry-After / exhausted quota
+        self._interval = 0.0         # header-derived spacing between request starts
+        self._last_start = None
+        self._tokens_left = None     # (remaining tokens, monotonic time they reset)
+
+    def configure(self, rpm=None, tpm=None):
+        """Change the fixed limits that are passed: 0 disables one (headers only), None leaves it as is."""
+        with self._lock:
+            if rpm is not None:
+                self.rpm = rpm or None
+            if tpm is not None:
+                self.tpm = tpm or None
+
+    def _prune(self, now):
+        while self._events and now - self._events[0][0] >= WINDOW_SECONDS:
+            self._events.popleft()
+
+    def _wait_time(self, now, tokens):
+        """Seconds until a request costing `tokens` fits inside both limits and the provider's pace."""
+        if self._paused_until > now:
+            return self._paused_until - now
+        if self._last_start is not None and self._last_start + self._interval > now:
+            return self._last_start + self._interval - now
+        if self._tokens_left:
+            remaining, reset_at = self._tokens_left
+            if reset_at <= now:
+                self._tokens_left = None
+            elif tokens > remaining:
+                return reset_at - now
+
+        if self.rpm and len(self._events) >= self.rpm:
+            return self._events[0][0] + WINDOW_SECONDS - now
+
+        if self.tpm:
+            used = sum(e[1] for e in self._events)
+            if used + tokens > self.tpm:
+                for ts, spent in self._events:
+                    used -= spent
+                    if used + tokens <= self.tpm:
+                        return ts + WINDOW_SECONDS - now
+        return 0.0
+
+    def _try_acquire(self, tokens):
+        """(slot, 0) if the request may start now, else (None, seconds to wait)."""
+        with self._lock:
+            now = time.monotonic()
+            self._prune(now)
+            wait = self._wait_time(now, tokens)
+            if wait > 0:
+                self.throttled_seconds += wait
+                return None, wait
+            slot = [now, tokens]
+            self._events.append(slot)
+            self._last_start = now
+            if self._tokens_left:
+                self._tokens_left = (self._tokens_left[0] - tokens, self._tokens_left[1])
+            return slot, 0.0
+
+    def _cap(self, tokens):
+        # an oversize request must still be able to run alone
+        return min(tokens, self.tpm) if self.tpm else tokens
+
+    def acquire(self, tokens=0):
+        """Block until the request fits the budget, then reserve it. Returns a slot for settle()."""
+        tokens = self._cap(tokens)
+        while True:
+            slot, wait = self._try_acquire(tokens)
+            if slot is not None:
+                return slot
+            time.sleep(wait)
+
+    async def aacquire(self, tokens=0):
+        """acquire() for asyncio tasks: waits with asyncio.sleep instead of blocking the loop."""
+        tokens = self._cap(tokens)
+        while True:
+            slot, wait = self._try_acquire(tokens)
+            if slot is not None:
+                return slot
+            await asyncio.sleep(wait)
+
+    def settle(self, slot, actual_tokens):
+        """Replace a reservation's estimated token count with what the API actually billed."""
+        with self._lock:
+            slot[1] = actual_tokens
+
+    def observe(self, headers):
+        """Adapt to a response's rate-limit headers (any case-insensitive mapping, e.g. httpx/requests)."""
+        if headers is None:
+            return
+        pause = retry_after(headers)
+        remaining = _header_int(headers, "x-ratelimit-remaining-requests")
+        if remaining is None:
+            remaining = _header_int(headers, "x-ratelimit-remaining")
+        reset = parse_duration(headers.get("x-ratelimit-reset-requests") or headers.get("x-ratelimit-reset"))
+        tokens_left = _header_int(headers, "x-ratelimit-remaining-tokens")
+        tokens_reset = parse_duration(headers.get("x-ratelimit-reset-tokens"))
+
+        with self._lock:
+            now = time.monotonic()
+            if pause:
+                self._paused_until = max(self._paused_until, now + pause)
+            if remaining is not None and reset is not None:
+                if reset > 1e9:  # an epoch timestamp rather than a duration
+                    reset = max(reset - time.time(), 0.0)
+                # Spread what is left evenly over the time to reset; 0 left waits out the reset
+                self._interval = reset / (remaining + 1) if remaining else 0.0
+                if remaining <= 0:
+                    self._paused_until = max(self._paused_until, now + reset)
+            if tokens_left is not None and tokens_reset is not None:
+                self._tokens_left = (tokens_left, now + tokens_reset)
+
+    def summary(self):
+        return f"{self.throttled_seconds:.1f}s throttled (interval {self._interval * 1000:.0f}ms)"
+
+
+def error_status(exc):
+    """Best-effort HTTP status of an exception from openai, postgrest/supabase or requests."""
+    for candidate in (
+        getattr(exc, "status_code", None),
+        getattr(getattr(exc, "response", None), "status_code", None),
+        getattr(exc, "code", None),
+    ):
+        if isinstance(candidate, str) and candidate.isdigit():
+            candidate = int(candidate)
+        if isinstance(candidate, int) and 100 <= candidate <= 599:  # not a Postgres SQLSTATE like "57014"
+            return candidate
+    # postgrest/supabase errors parsed from a JSON body carry a PGRST/SQLSTATE code, so the HTTP
+    # status only shows up in their message; anything else with "500 rows" in its text is not a 500
+    if type(exc).__module__.split(".")[0] in TEXT_STATUS_MODULES:
+        match = re.search(r"\b(429|5\d\d)\b", str(exc))
+        return int(match.group(1)) if match else None
+    return None
+
+
+def is_retryable(exc):
+    """True for rate limits, server errors and dropped connections."""
+    if isinstance(exc, (ConnectionError, TimeoutError)) or type(exc).__name__ in TRANSIENT_ERROR_NAMES:
+        return True
+    return error_status(exc) in RETRYABLE_STATUS
+
+
+def backoff_delay(attempt, base_delay=1.0, max_delay=30.0):
+    """Full-jitter exponential delay before retry number `attempt` (1-based)."""
+    return random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+
+
+def retry_delay(exc, attempt, base_delay=1.0, max_delay=30.0):
+    """Backoff before retrying `exc`: at least the Retry-After its response asked for."""
+    delay = backoff_delay(attempt, base_delay, max_delay)
+    asked = retry_after(getattr(getattr(exc, "response", None), "headers", None))
+    return max(delay, asked) if asked is not None else delay
+
+
+def with_backoff(fn, max_attempts=5, base_delay=1.0, max_delay=30.0, retryable=is_retryable, label=None):
+    """Call fn(), retrying retryable failures with full-jitter exponential backoff."""
+    for attempt in range(1, max_attempts + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == max_attempts or not retryable(e):
+                raise
+            delay = retry_delay(e, attempt, base_delay, max_delay)
+            print(f"  {label or 'Request'} failed ({type(e).__name__}: {str(e)[:80]}) — retry {attempt}/{max_attempts - 1} in {delay:.1f}s")
+            time.sleep(delay)
+
+
+async def awith_backoff(fn, max_attempts=5, base_delay=1.0, max_delay=30.0, retryable=is_retryable, label=None):
+    """with_backoff() for a coroutine function: awaits fn() and sleeps with asyncio.sleep."""
+    for attempt in range(1, max_attempts + 1):
+        try:
+            return await fn()
+        except Exception as e:
+            if attempt == max_attempts or not retryable(e):
+                raise
+            delay = retry_delay(e, attempt, base_delay, max_delay)
+            print(f"  {label or 'Request'} failed ({type(e).__name__}: {str(e)[:80]}) — retry {attempt}/{max_attempts - 1} in {delay:.1f}s")
+            await asyncio.sleep(delay)
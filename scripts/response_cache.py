@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Semantic response cache for Coach K completions.
+
+Near-identical athlete questions ("how should I pace my 1km runs" / "how do
+I pace the 1km runs?") should not each cost a full 70B generation. Each
+cached response is stored with its query embedding and a context key: the
+hash of the model, generation settings and the set of retrieved chunk ids.
+A lookup only considers entries with the same context key, so a cached answer
+is never reused for different retrieved knowledge, and returns the nearest
+one whose cosine similarity reaches the threshold.
+
+Stored in SQLite (.cache/responses.sqlite, RESPONSE_CACHE_PATH overrides).
+Eviction: entries older than max_age are dropped, and beyond max_entries the
+least recently used are evicted. hits/misses/lookup time are tracked for
+the run summary.
+
+Usage:
+    cache = ResponseCache(threshold=0.95)
+    key = context_key(NEBIUS_MODEL, chunk_ids, temperature=0.7, max_tokens=1200)
+    hit = cache.lookup(query_embedding, key)      # {"response", "similarity", "query"} or None
+    if hit is None:
+        cache.put(query, query_embedding, key, response)
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from array import array
+
+import numpy as np
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(__file__), "..", ".cache", "responses.sqlite")
+DEFAULT_THRESHOLD = 0.95
+DEFAULT_MAX_ENTRIES = 5000
+DEFAULT_MAX_AGE_SECONDS = 30 * 24 * 3600
+
+
+def context_key(model, chunk_ids, **settings):
+    """Hash of everything besides the question that shapes a completion."""
+    payload = json.dumps([model, sorted(chunk_ids), settings], sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def unit_vector(embedding):
+    vec = np.asarray(embedding, dtype=np.float32)
+    return vec / max(float(np.linalg.norm(vec)), 1e-12)
+
+
+class ResponseCache:
+    """SQLite store of (query embedding, context key) → response, looked up by cosine similarity. Thread-safe."""
+
+    def __init__(self, path=None, threshold=DEFAULT_THRESHOLD, max_entries=DEFAULT_MAX_ENTRIES,
+                 max_age=DEFAULT_MAX_AGE_SECONDS):
+        self.path = path or os.getenv("RESPONSE_CACHE_PATH", DEFAULT_CACHE_PATH)
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.hits = self.misses = 0
+        self.lookup_seconds = 0.0
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " id INTEGER PRIMARY KEY,"
+            " context_key TEXT NOT NULL,"
+            " query TEXT NOT NULL,"
+            " embedding BLOB NOT NULL,"
+            " response TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_context ON responses (context_key)")
+        self._conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - max_age,))
+        self._conn.commit()
+
+    def lookup(self, query_embedding, key):
+        """Nearest cached response for the same context key at or above the threshold, else None."""
+        start = time.time()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, query, embedding, response FROM responses WHERE context_key = ? AND created_at >= ?",
+                (key, time.time() - self.max_age),
+            ).fetchall()
+            best = None
+            if rows:
+                matrix = np.stack([np.frombuffer(r[2], dtype=np.float32) for r in rows])
+                sims = matrix @ unit_vector(query_embedding)
+                i = int(np.argmax(sims))
+                if sims[i] >= self.threshold:
+                    row_id, query, _, response = rows[i]
+                    best = {"response": response, "similarity": float(sims[i]), "query": query}
+                    self._conn.execute("UPDATE responses SET last_used = ? WHERE id = ?", (time.time(), row_id))
+                    self._conn.commit()
+            if best:
+                self.hits += 1
+            else:
+                self.misses += 1
+            self.lookup_seconds += time.time() - start
+        return best
+
+    def put(self, query, query_embedding, key, response):
+        now = time.time()
+        blob = array("f", unit_vector(query_embedding).tolist()).tobytes()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO responses (context_key, query, embedding, response, created_at, last_used)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, query, blob, response, now, now),
+            )
+            # LRU eviction beyond max_entries
+            self._conn.execute(
+                "DELETE FROM responses WHERE id IN ("
+                " SELECT id FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+    def summary(self):
+        lookups = self.hits + self.misses
+        avg_ms = self.lookup_seconds / lookups * 1000 if lookups else 0
+        return f"{self.hits}/{lookups} hits (threshold {self.threshold}, avg lookup {avg_ms:.1f}ms)"
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
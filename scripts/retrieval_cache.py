@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Retrieval result cache for the RAG scripts.
+
+Hybrid-search results are keyed by (normalized query, embedding model, search
+params, corpus version), so a repeated question skips both the query
+embedding and the Supabase RPC:
+  - an in-memory LRU tier for repeats within one run
+  - an optional SQLite tier (.cache/retrieval.sqlite) shared across runs
+
+Entries expire after a TTL. The corpus version is the counter
+embed_and_upload.py bumps in embed_manifest.json whenever it changes
+knowledge_chunks, so an upload invalidates every cached result; the TTL
+bounds staleness when the table is changed from another machine.
+
+HYBRID_SEARCH_PARAMS and retrieval_params() are the one definition of the
+hybrid_search_chunks arguments the RAG scripts use, so their cache keys
+always agree.
+
+Usage:
+    cache = RetrievalCache()
+    params = retrieval_params(5)
+    chunks = cache.get(query, EMBEDDING_MODEL, params)
+    if chunks is None:
+        chunks = retrieve_chunks(...)
+        cache.put(query, EMBEDDING_MODEL, params, chunks)
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from embed_and_upload import load_corpus_version
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(__file__), "..", ".cache", "retrieval.sqlite")
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+DEFAULT_MEMORY_SIZE = 1024
+HYBRID_SEARCH_PARAMS = {"full_text_weight": 1.0, "semantic_weight": 1.0, "rrf_k": 50}
+
+
+def retrieval_params(count=5):
+    """Everything besides the query that determines hybrid search results (the retrieval cache key)."""
+    return {"rpc": "hybrid_search_chunks", "match_count": count, **HYBRID_SEARCH_PARAMS}
+
+
+def normalize_query(query):
+    """Case- and whitespace-insensitive form of a query."""
+    return " ".join(query.lower().split())
+
+
+class RetrievalCache:
+    """Two-tier (memory LRU + optional SQLite) cache of retrieval results. Safe to share across threads."""
+
+    def __init__(self, path=None, ttl=DEFAULT_TTL_SECONDS, memory_size=DEFAULT_MEMORY_SIZE, disk=True,
+                 corpus_version=None):
+        self.ttl = ttl
+        self.memory_size = memory_size
+        self.corpus_version = load_corpus_version() if corpus_version is None else corpus_version
+        self.hits = {"memory": 0, "disk": 0}
+        self.misses = 0
+        self._memory = OrderedDict()  # key → (stored_at, results)
+        self._lock = threading.Lock()
+        self._conn = None
+        if disk:
+            self.path = path or os.getenv("RETRIEVAL_CACHE_PATH", DEFAULT_CACHE_PATH)
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS retrievals ("
+                " key TEXT PRIMARY KEY,"
+                " corpus_version INTEGER NOT NULL,"
+                " stored_at REAL NOT NULL,"
+                " results TEXT NOT NULL)"
+            )
+            # Results from older corpora or past their TTL can never be served again
+            self._conn.execute(
+                "DELETE FROM retrievals WHERE corpus_version != ? OR stored_at < ?",
+                (self.corpus_version, time.time() - ttl),
+            )
+            self._conn.commit()
+
+    def key(self, query, model, params):
+        payload = json.dumps([normalize_query(query), model, params, self.corpus_version], sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, query, model, params):
+        """Cached results for a query, or None on a miss."""
+        key = self.key(query, model, params)
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry and now - entry[0] < self.ttl:
+                self._memory.move_to_end(key)
+                self.hits["memory"] += 1
+                return entry[1]
+            if self._conn is not None:
+                row = self._conn.execute(
+                    "SELECT stored_at, results FROM retrievals WHERE key = ?", (key,)
+                ).fetchone()
+                if row and now - row[0] < self.ttl:
+                    results = json.loads(row[1])
+                    self._remember(key, row[0], results)
+                    self.hits["disk"] += 1
+                    return results
+            self.misses += 1
+            return None
+
+    def put(self, query, model, params, results):
+        key = self.key(query, model, params)
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, results)
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO retrievals VALUES (?, ?, ?, ?)",
+                    (key, self.corpus_version, now, json.dumps(results)),
+                )
+                self._conn.commit()
+
+    def _remember(self, key, stored_at, results):
+        self._memory[key] = (stored_at, results)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def summary(self):
+        hits = self.hits["memory"] + self.hits["disk"]
+        return (f"{hits}/{hits + self.misses} hits ({self.hits['memory']} memory, {self.hits['disk']} disk), "
+                f"corpus v{self.corpus_version}")
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Streaming chat completions with perceived-latency metrics.
+
+Total latency hides what an athlete actually feels: how long until the first
+words appear and how smoothly the rest arrives. stream_chat() consumes an
+OpenAI-SDK stream and stream_sse() a raw requests stream (test_coach_k.py);
+both hand every text delta to an optional callback (e.g. print it as it
+arrives) and time it with a StreamTimer:
+  - time_to_first_token_seconds: request start → first content delta
+  - inter_token_latency_seconds: mean gap between content deltas (p95 too)
+  - total_latency_seconds: request start → end of stream
+
+Usage (token usage comes from the final stream chunk when the provider
+honors stream_options; otherwise completion tokens fall back to the number
+of content deltas):
+    result = stream_chat(client, on_token=print_token, model=..., messages=...)
+    result["content"], result["usage"], result["metrics"]
+"""
+
+import json
+import sys
+import time
+
+
+def print_token(text):
+    """on_token callback that writes deltas straight to the terminal."""
+    sys.stdout.write(text)
+    sys.stdout.flush()
+
+
+class StreamTimer:
+    """Arrival times of content deltas, measured from the request start."""
+
+    def __init__(self, start=None):
+        self.start = time.time() if start is None else start
+        self.first = None
+        self.last = None
+        self.gaps = []
+
+    def token(self):
+        now = time.time()
+        if self.first is None:
+            self.first = now
+        else:
+            self.gaps.append(now - self.last)
+        self.last = now
+
+    @property
+    def deltas(self):
+        return 0 if self.first is None else len(self.gaps) + 1
+
+    def metrics(self, end=None):
+        end = time.time() if end is None else end
+        gaps = sorted(self.gaps)
+        return {
+            "time_to_first_token_seconds": round(self.first - self.start, 3) if self.first else None,
+            "inter_token_latency_seconds": round(sum(gaps) / len(gaps), 4) if gaps else None,
+            "inter_token_latency_p95_seconds": round(gaps[min(len(gaps) - 1, int(len(gaps) * 0.95))], 4) if gaps else None,
+            "total_latency_seconds": round(end - self.start, 3),
+        }
+
+
+def _result(parts, usage, timer):
+    end = time.time()
+    if not usage:
+        usage = {"prompt_tokens": 0, "completion_tokens": timer.deltas}
+    usage.setdefault("total_tokens", usage.get("prompt_tokens", 0) + usage.get("completion_tokens", 0))
+    return {"content": "".join(parts), "usage": usage, "metrics": timer.metrics(end)}
+
+
+def stream_chat(client, on_token=None, **kwargs):
+    """chat.completions.create(stream=True) on an OpenAI-compatible client.
+
+    Returns {"content", "usage": {prompt_tokens, completion_tokens, total_tokens}, "metrics"}.
+    """
+    timer = StreamTimer()
+    stream = client.chat.completions.create(stream=True, stream_options={"include_usage": True}, **kwargs)
+    parts, usage = [], None
+    for chunk in stream:
+        if getattr(chunk, "usage", None):
+            usage = {
+                "prompt_tokens": chunk.usage.prompt_tokens,
+                "completion_tokens": chunk.usage.completion_tokens,
+                "total_tokens": chunk.usage.total_tokens,
+            }
+        if not chunk.choices:
+            continue
+        text = chunk.choices[0].delta.content
+        if text:
+            timer.token()
+            parts.append(text)
+            if on_token:
+                on_token(text)
+    return _result(parts, usage, timer)
+
+
+def stream_sse(response, start, on_token=None):
+    """Read an OpenAI-format server-sent-event stream from a requests response (stream=True)."""
+    timer = StreamTimer(start)
+    parts, usage = [], None
+    if response.encoding is None:
+        response.encoding = "utf-8"  # SSE is always UTF-8; without a charset iter_lines would yield bytes
+    for line in response.iter_lines(decode_unicode=True):
+        if not line or not line.startswith("data:"):
+            continue
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            break
+        event = json.loads(data)
+        if event.get("usage"):
+            usage = dict(event["usage"])
+        for choice in event.get("choices", []):
+            text = (choice.get("delta") or {}).get("content")
+            if text:
+                timer.token()
+                parts.append(text)
+                if on_token:
+                    on_token(text)
+    return _result(parts, usage, timer)
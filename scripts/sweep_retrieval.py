@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Grid search over hybrid_search_chunks parameters without re-running the RAG eval.
+
+For each labeled query, one wide candidate list is fetched up front and its
+semantic and BM25 rankings are computed locally. Every combination of
+full_text_weight × semantic_weight × rrf_k × match_count is then scored by
+re-fusing those cached rankings with the same RRF formula the SQL function
+uses — no further network calls. The report marks the Pareto front of
+retrieval quality against context tokens (sum of est_tokens of the chunks
+that would be sent to the model).
+
+Candidate sources:
+    local     — rank the whole corpus with the in-process index (default)
+    supabase  — take hybrid_search_chunks' top 30 at default weights as the
+                pool, then re-rank that pool locally
+
+Usage:
+    python3 scripts/sweep_retrieval.py
+    python3 scripts/sweep_retrieval.py --rrf-k 10,30,50,80 --match-count 3,5,8
+    python3 scripts/sweep_retrieval.py --source supabase --metric ndcg
+"""
+
+import argparse
+import itertools
+import json
+import os
+import time
+from datetime import datetime
+
+from dotenv import load_dotenv
+from supabase import create_client
+
+from benchmark_retrieval import EVAL_DIR, LABELS_PATH, load_labels, ndcg_at_k, recall_at_k, reciprocal_rank
+from embedding_cache import embed_texts
+from local_index import LocalIndex, candidate_limit, rrf_fuse
+import provider_client
+from test_rag_retrieval import hybrid_search
+
+load_dotenv()
+
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_ANON_KEY")
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+OUTPUT_PATH = os.path.join(EVAL_DIR, "retrieval_sweep.json")
+DEFAULT_GRID = {
+    "full_text_weight": [0.0, 0.5, 1.0, 1.5, 2.0],
+    "semantic_weight": [0.5, 1.0, 1.5, 2.0],
+    "rrf_k": [10, 30, 50, 60, 100],
+    "match_count": [3, 4, 5, 6, 8],
+}
+METRICS = ["recall", "mrr", "ndcg"]
+
+
+def parse_floats(value):
+    return [float(v) for v in value.split(",") if v.strip()]
+
+
+def parse_ints(value):
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def rank_pool(index, query, embedding, pool_ixs, depth):
+    """Semantic and BM25 rankings (chunk ids, best first) restricted to a candidate pool."""
+    sims = index.similarities([embedding])[0]
+    bm25 = index.bm25.scores(query)
+    semantic = sorted(pool_ixs, key=lambda ix: -sims[ix])[:depth]
+    full_text = sorted((ix for ix in pool_ixs if ix in bm25), key=lambda ix: -bm25[ix])[:depth]
+    return [index.ids[ix] for ix in full_text], [index.ids[ix] for ix in semantic]
+
+
+def fetch_candidates(index, labels, embeddings, depth, source, supabase_client=None):
+    """One candidate fetch per query → {query id: (full_text ids, semantic ids)}."""
+    all_ixs = list(range(len(index.ids)))
+    position = {cid: ix for ix, cid in enumerate(index.ids)}
+    cached = {}
+    for label, embedding in zip(labels, embeddings):
+        if source == "supabase":
+            rows = hybrid_search(supabase_client, label["query"], embedding, count=30) or []
+            pool = [position[r["id"]] for r in rows if r["id"] in position]
+        else:
+            pool = all_ixs
+        cached[label["id"]] = rank_pool(index, label["query"], embedding, pool, depth)
+    return cached
+
+
+def evaluate_combo(cached, labels, tokens_by_id, metric, full_text_weight, semantic_weight, rrf_k, match_count):
+    """Re-fuse the cached rankings under one parameter combination and score it."""
+    limit = candidate_limit(match_count)
+    quality = context_tokens = 0.0
+    for label in labels:
+        full_text_ids, semantic_ids = cached[label["id"]]
+        fused = rrf_fuse(full_text_ids[:limit], semantic_ids[:limit], match_count, full_text_weight, semantic_weight, rrf_k)
+        retrieved = [cid for cid, _ in fused]
+        if metric == "recall":
+            quality += recall_at_k(retrieved, label["relevant"], match_count)
+        elif metric == "mrr":
+            quality += reciprocal_rank(retrieved, label["relevant"])
+        else:
+            quality += ndcg_at_k(retrieved, label["relevant"], match_count)
+        context_tokens += sum(tokens_by_id.get(cid, 0) for cid in retrieved)
+    n = len(labels) or 1
+    return quality / n, context_tokens / n
+
+
+def pareto_front(rows):
+    """Rows not dominated on (higher quality, fewer context tokens)."""
+    front = []
+    for row in sorted(rows, key=lambda r: (r["avg_context_tokens"], -r["quality"])):
+        if not front or row["quality"] > front[-1]["quality"]:
+            front.append(row)
+    return front
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Grid search over hybrid search weights and rrf_k")
+    parser.add_argument("--labels", default=LABELS_PATH, help="Labeled query set (JSON)")
+    parser.add_argument("--source", choices=["local", "supabase"], default="local", help="Candidate source (default: local)")
+    parser.add_argument("--metric", choices=METRICS, default="recall", help="Quality metric at match_count (default: recall)")
+    parser.add_argument("--full-text-weight", type=parse_floats, default=DEFAULT_GRID["full_text_weight"])
+    parser.add_argument("--semantic-weight", type=parse_floats, default=DEFAULT_GRID["semantic_weight"])
+    parser.add_argument("--rrf-k", type=parse_ints, default=DEFAULT_GRID["rrf_k"])
+    parser.add_argument("--match-count", type=parse_ints, default=DEFAULT_GRID["match_count"])
+    parser.add_argument("--output", default=OUTPUT_PATH, help="Where to write the JSON report")
+    args = parser.parse_args()
+
+    labels = load_labels(args.labels)
+    openai_client = provider_client.openai_client(OPENAI_API_KEY)
+    supabase_client = create_client(SUPABASE_URL, SUPABASE_KEY) if args.source == "supabase" else None
+    index = LocalIndex.from_chunks_file(openai_client)
+    tokens_by_id = {c["id"]: c.get("est_tokens", 0) for c in index.chunks}
+
+    embeddings, _ = embed_texts(openai_client, [l["query"] for l in labels], model=EMBEDDING_MODEL)
+
+    # One wide fetch per query, deep enough for the largest match_count in the grid
+    depth = candidate_limit(max(args.match_count))
+    start = time.perf_counter()
+    cached = fetch_candidates(index, labels, embeddings, depth, args.source, supabase_client)
+    fetch_seconds = time.perf_counter() - start
+
+    grid = list(itertools.product(args.full_text_weight, args.semantic_weight, args.rrf_k, args.match_count))
+    print(f"Sweeping {len(grid)} combinations over {len(labels)} queries ({args.source} candidates, {fetch_seconds:.1f}s fetch)...")
+
+    start = time.perf_counter()
+    rows = []
+    for ftw, sw, k, mc in grid:
+        if ftw == 0 and sw == 0:
+            continue
+        quality, tokens = evaluate_combo(cached, labels, tokens_by_id, args.metric, ftw, sw, k, mc)
+        rows.append({
+            "full_text_weight": ftw,
+            "semantic_weight": sw,
+            "rrf_k": k,
+            "match_count": mc,
+            "quality": round(quality, 4),
+            "avg_context_tokens": round(tokens, 1),
+        })
+    sweep_seconds = time.perf_counter() - start
+
+    front = pareto_front(rows)
+    front_keys = {(r["full_text_weight"], r["semantic_weight"], r["rrf_k"], r["match_count"]) for r in front}
+    for row in rows:
+        row["pareto"] = (row["full_text_weight"], row["semantic_weight"], row["rrf_k"], row["match_count"]) in front_keys
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump({
+            "timestamp": datetime.now().isoformat(),
+            "labels": os.path.basename(args.labels),
+            "source": args.source,
+            "metric": f"{args.metric}@match_count" if args.metric != "mrr" else "mrr",
+            "query_count": len(labels),
+            "combinations": len(rows),
+            "sweep_seconds": round(sweep_seconds, 3),
+            "pareto_front": front,
+            "results": rows,
+        }, f, indent=2)
+
+    print(f"Scored {len(rows)} combinations in {sweep_seconds:.2f}s")
+    print(f"\nPareto front ({args.metric} vs avg context tokens):")
+    print(f"  {'ft_w':>5} {'sem_w':>6} {'rrf_k':>6} {'count':>6} {args.metric:>8} {'tokens':>8}")
+    for r in front:
+        print(f"  {r['full_text_weight']:>5} {r['semantic_weight']:>6} {r['rrf_k']:>6} {r['match_count']:>6} "
+              f"{r['quality']:>8.3f} {r['avg_context_tokens']:>8.0f}")
+    print(f"\nReport saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
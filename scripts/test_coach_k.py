@@ -4,19 +4,28 @@ Comprehensive evaluation suite for Coach K v1 (fine-tuned Llama 3.3 70B LoRA on
 
 Runs 43 test prompts across 10 categories, plus 3 base-model comparisons.
 Logs all results to JSON and generates a markdown report.
+
+With --stream, responses are printed as they are generated and each result
+also records time-to-first-token and inter-token latency.
+
+Usage: python3 scripts/test_coach_k.py
+       python3 scripts/test_coach_k.py --stream
 """
 
+import argparse
 import json
 import os
 import time
 import datetime
-import requests
+
+from provider_client import NEBIUS_BASE_URL, post_json, provider_budget
+from streaming import print_token, stream_sse
 
 # ─── Config ──────────────────────────────────────────────────────────────────
 NEBIUS_API_KEY = os.environ.get("NEBIUS_API_KEY", "")
 FINETUNED_MODEL = "meta-llama/Llama-3.3-70B-Instruct-fast-LoRa:hyrox-coach-v1-drry"
 BASE_MODEL = "meta-llama/Llama-3.3-70B-Instruct"
-INFERENCE_URL = "https://api.tokenfactory.nebius.com/v1/chat/completions"
+INFERENCE_URL = NEBIUS_BASE_URL + "chat/completions"
 
 SYSTEM_PROMPT = (
     'You are Coach K, an elite Hyrox training coach powered by deep sports science knowledge. '
@@ -140,12 +149,12 @@ COMPARISON_TESTS = [
 ]
 
 
-def call_model(model, system_prompt, user_prompt, temperature=0.7, max_tokens=1024):
-    """Call Nebius inference API and return response + metadata."""
-    headers = {
-        "Authorization": f"Bearer {NEBIUS_API_KEY}",
-        "Content-Type": "application/json",
-    }
+def call_model(model, system_prompt, user_prompt, temperature=0.7, max_tokens=1024, stream=False, on_token=None):
+    """Call Nebius inference API and return response + metadata.
+
+    With stream=True the response is read as server-sent events (each text
+    delta goes to on_token) and the streaming latency metrics are added.
+    """
     payload = {
         "model": model,
         "messages": [
@@ -155,12 +164,33 @@ def call_model(model, system_prompt, user_prompt, temperature=0.7, max_tokens=10
         "temperature": temperature,
         "max_tokens": max_tokens,
     }
+    if stream:
+        payload["stream"] = True
+        payload["stream_options"] = {"include_usage": True}
 
-    start = time.time()
+    start = time.time()  # error path only; successful calls are timed from resp.sent_at
     try:
-        resp = requests.post(INFERENCE_URL, headers=headers, json=payload, timeout=120)
-        elapsed = time.time() - start
-        resp.raise_for_status()
+        if stream:
+            resp = post_json(INFERENCE_URL, payload, api_key=NEBIUS_API_KEY, timeout=120, stream=True,
+                             label=f"{model} request", budget=provider_budget("nebius"))
+            with resp:
+                streamed = stream_sse(resp, resp.sent_at, on_token)
+            usage = streamed["usage"]
+            elapsed = streamed["metrics"]["total_latency_seconds"]
+            return {
+                "success": True,
+                "content": streamed["content"],
+                "input_tokens": usage.get("prompt_tokens", 0),
+                "output_tokens": usage.get("completion_tokens", 0),
+                "total_tokens": usage.get("total_tokens", 0),
+                "latency_seconds": round(elapsed, 2),
+                "tokens_per_second": round(usage.get("completion_tokens", 0) / elapsed, 1) if elapsed > 0 else 0,
+                **streamed["metrics"],
+            }
+
+        resp = post_json(INFERENCE_URL, payload, api_key=NEBIUS_API_KEY, timeout=120, label=f"{model} request",
+                         budget=provider_budget("nebius"))
+        elapsed = time.time() - resp.sent_at
         data = resp.json()
 
         content = data["choices"][0]["message"]["content"]
@@ -188,8 +218,9 @@ def call_model(model, system_prompt, user_prompt, temperature=0.7, max_tokens=10
         }
 
 
-def run_tests():
-    """Run the full test suite."""
+def run_tests(stream=False):
+    """Run the full test suite (streaming each response to the terminal if stream=True)."""
+    on_token = print_token if stream else None
     results = {
         "metadata": {
             "model": FINETUNED_MODEL,
@@ -219,7 +250,9 @@ def run_tests():
         current += 1
         print(f"[{current}/{total_tests}] {test['category']} — {test['id']}: {test['prompt'][:60]}...")
 
-        result = call_model(FINETUNED_MODEL, SYSTEM_PROMPT, test["prompt"])
+        result = call_model(FINETUNED_MODEL, SYSTEM_PROMPT, test["prompt"], stream=stream, on_token=on_token)
+        if stream:
+            print()
 
         entry = {
             "test_id": test["id"],
@@ -232,10 +265,8 @@ def run_tests():
         results["finetuned_results"].append(entry)
 
         status = "OK" if result["success"] else "FAIL"
-        print(f"  {status} | {result['output_tokens']} tokens | {result['latency_seconds']}s | {result['tokens_per_second']} t/s")
-
-        # Brief pause to avoid rate limits
-        time.sleep(1)
+        print(f"  {status} | {result['output_tokens']} tokens | {result['latency_seconds']}s | {result['tokens_per_second']} t/s"
+              + (f" | TTFT {result['time_to_first_token_seconds']}s" if result.get("time_to_first_token_seconds") is not None else ""))
 
     # ─── Run comparison tests against BOTH models ────────────────────────
     print(f"\n{'='*70}")
@@ -247,14 +278,12 @@ def run_tests():
         print(f"[{current}/{total_tests}] Comparison — {test['id']}: {test['prompt'][:60]}...")
 
         # Fine-tuned
-        ft_result = call_model(FINETUNED_MODEL, SYSTEM_PROMPT, test["prompt"])
+        ft_result = call_model(FINETUNED_MODEL, SYSTEM_PROMPT, test["prompt"], stream=stream)
         print(f"  Fine-tuned: {ft_result['output_tokens']} tokens | {ft_result['latency_seconds']}s")
-        time.sleep(1)
 
         # Base model
-        base_result = call_model(BASE_MODEL, SYSTEM_PROMPT, test["prompt"])
+        base_result = call_model(BASE_MODEL, SYSTEM_PROMPT, test["prompt"], stream=stream)
         print(f"  Base model: {base_result['output_tokens']} tokens | {base_result['latency_seconds']}s")
-        time.sleep(1)
 
         results["comparison_results"].append({
             "test_id": test["id"],
@@ -282,6 +311,8 @@ def run_tests():
     total_output_tokens = sum(r["output_tokens"] for r in successful)
     total_input_tokens = sum(r["input_tokens"] for r in successful)
     total_latency = sum(r["latency_seconds"] for r in successful)
+    ttfts = [r["time_to_first_token_seconds"] for r in successful if r.get("time_to_first_token_seconds") is not None]
+    itls = [r["inter_token_latency_seconds"] for r in successful if r.get("inter_token_latency_seconds") is not None]
 
     results["summary"] = {
         "total_tests": len(ft_results),
@@ -292,6 +323,8 @@ def run_tests():
         "avg_output_tokens": total_output_tokens // len(successful) if successful else 0,
         "avg_latency_seconds": round(total_latency / len(successful), 2) if successful else 0,
         "avg_tokens_per_second": round(total_output_tokens / total_latency, 1) if total_latency > 0 else 0,
+        "avg_time_to_first_token_seconds": round(sum(ttfts) / len(ttfts), 3) if ttfts else None,
+        "avg_inter_token_latency_seconds": round(sum(itls) / len(itls), 4) if itls else None,
         "estimated_cost": round(
             (total_input_tokens / 1_000_000) * 0.13 + (total_output_tokens / 1_000_000) * 0.40, 4
         ),
@@ -307,6 +340,9 @@ def run_tests():
     print(f"Avg tokens/response: {results['summary']['avg_output_tokens']}")
     print(f"Avg latency: {results['summary']['avg_latency_seconds']}s")
     print(f"Avg speed: {results['summary']['avg_tokens_per_second']} t/s")
+    if ttfts:
+        print(f"Avg time to first token: {results['summary']['avg_time_to_first_token_seconds']}s")
+        print(f"Avg inter-token latency: {(results['summary']['avg_inter_token_latency_seconds'] or 0) * 1000:.1f}ms")
     print(f"Estimated cost: ${results['summary']['estimated_cost']}")
     print(f"Finished: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
 
@@ -339,6 +375,9 @@ def save_results(results):
     md_lines.append(f"| Avg tokens/response | {s['avg_output_tokens']} |")
     md_lines.append(f"| Avg latency | {s['avg_latency_seconds']}s |")
     md_lines.append(f"| Avg speed | {s['avg_tokens_per_second']} t/s |")
+    if s.get("avg_time_to_first_token_seconds") is not None:
+        md_lines.append(f"| Avg time to first token | {s['avg_time_to_first_token_seconds']}s |")
+        md_lines.append(f"| Avg inter-token latency | {(s['avg_inter_token_latency_seconds'] or 0) * 1000:.1f}ms |")
     md_lines.append(f"| Est. cost | ${s['estimated_cost']} |")
     md_lines.append("")
 
@@ -381,5 +420,9 @@ def save_results(results):
 
 
 if __name__ == "__main__":
-    results = run_tests()
+    parser = argparse.ArgumentParser(description="Coach K v1 evaluation suite")
+    parser.add_argument("--stream", action="store_true", help="Stream responses and record time-to-first-token / inter-token latency")
+    args = parser.parse_args()
+
+    results = run_tests(stream=args.stream)
     save_results(results)
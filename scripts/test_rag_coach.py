@@ -6,15 +6,25 @@ fine-tuned Llama 3.3 70B LoRA model on Nebius for a grounded coaching response.
 
 Usage: python3 scripts/test_rag_coach.py
        python3 scripts/test_rag_coach.py "your question for the coach"
+       python3 scripts/test_rag_coach.py --context-budget 0   # full top-5 chunks
+       python3 scripts/test_rag_coach.py --no-retrieval-cache
+       python3 scripts/test_rag_coach.py --response-cache   # reuse answers to near-identical questions
+       python3 scripts/test_rag_coach.py --stream           # print tokens as they arrive
 """
 
+import argparse
 import os
-import sys
 
 from dotenv import load_dotenv
-from openai import OpenAI
 from supabase import create_client
 
+from context_builder import DEFAULT_TOKEN_BUDGET, build_budgeted_context
+from embedding_cache import embed_texts
+import provider_client
+from response_cache import DEFAULT_THRESHOLD, ResponseCache, context_key
+from retrieval_cache import HYBRID_SEARCH_PARAMS, RetrievalCache, retrieval_params
+from streaming import print_token, stream_chat
+
 load_dotenv()
 
 SUPABASE_URL = os.getenv("SUPABASE_URL")
@@ -22,8 +32,9 @@ SUPABASE_KEY = os.getenv("SUPABASE_ANON_KEY")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 NEBIUS_API_KEY = os.getenv("NEBIUS_API_KEY")
 NEBIUS_MODEL = os.getenv("NEBIUS_MODEL", "meta-llama/Llama-3.3-70B-Instruct-fast-LoRa:hyrox-coach-v2-HafB")
-NEBIUS_BASE_URL = "https://api.tokenfactory.nebius.com/v1/"
 EMBEDDING_MODEL = "text-embedding-3-small"
+TEMPERATURE = 0.7
+MAX_TOKENS = 1024
 
 SYSTEM_PROMPT = """You are Coach K, an elite Hyrox performance coach. You provide direct, science-backed coaching with a motivating but no-nonsense style. You are specific with numbers, sets, reps, and pacing targets.
 
@@ -55,12 +66,9 @@ TEST_QUERIES = [
 
 
 def embed_query(openai_client, query):
-    """Embed a query string."""
-    response = openai_client.embeddings.create(
-        model=EMBEDDING_MODEL,
-        input=query,
-    )
-    return response.data[0].embedding
+    """Embed a query string (through the on-disk embedding cache)."""
+    embeddings, _ = embed_texts(openai_client, [query], model=EMBEDDING_MODEL)
+    return embeddings[0]
 
 
 def retrieve_chunks(supabase_client, query_text, embedding, count=5):
@@ -71,9 +79,7 @@ def retrieve_chunks(supabase_client, query_text, embedding, count=5):
             "query_text": query_text,
             "query_embedding": embedding,
             "match_count": count,
-            "full_text_weight": 1.0,
-            "semantic_weight": 1.0,
-            "rrf_k": 50,
+            **HYBRID_SEARCH_PARAMS,
         },
     ).execute()
     return result.data
@@ -105,61 +111,151 @@ def coach_response(nebius_client, system_prompt, user_query):
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_query},
         ],
-        temperature=0.7,
-        max_tokens=1024,
+        temperature=TEMPERATURE,
+        max_tokens=MAX_TOKENS,
     )
     return response.choices[0].message.content
 
 
-def run_test(openai_client, supabase_client, nebius_client, query):
-    """Run full RAG + LLM pipeline for a single query."""
+def coach_response_stream(nebius_client, system_prompt, user_query, on_token=print_token):
+    """Stream the coaching response token by token. Returns (response, latency metrics)."""
+    streamed = stream_chat(
+        nebius_client,
+        on_token,
+        model=NEBIUS_MODEL,
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_query},
+        ],
+        temperature=TEMPERATURE,
+        max_tokens=MAX_TOKENS,
+    )
+    return streamed["content"], streamed["metrics"]
+
+
+def run_test(openai_client, supabase_client, nebius_client, query, embedding=None, context_budget=DEFAULT_TOKEN_BUDGET,
+             chunks=None, retrieval_cache=None, response_cache=None, stream=False):
+    """Run full RAG + LLM pipeline for a single query.
+
+    chunks, when given, are cached retrieval results: embedding and search are skipped.
+    With a response_cache, a near-identical earlier question over the same
+    chunks is answered from the cache instead of the model. With stream=True
+    the response is printed as it is generated.
+    """
     print(f"\n{'='*70}")
     print(f"ATHLETE QUESTION: \"{query}\"")
     print(f"{'='*70}")
 
-    # Step 1: Embed query
-    print("\n[1] Embedding query...")
-    embedding = embed_query(openai_client, query)
-
-    # Step 2: Retrieve relevant chunks
-    print("[2] Retrieving relevant chunks...")
-    chunks = retrieve_chunks(supabase_client, query, embedding, count=5)
+    if chunks is not None:
+        print("\n[1] Retrieval cache hit — skipping embedding and search")
+    else:
+        # Step 1: Embed query
+        if embedding is None:
+            print("\n[1] Embedding query...")
+            embedding = embed_query(openai_client, query)
+        else:
+            print("\n[1] Query embedding ready (batched)")
+
+        # Step 2: Retrieve relevant chunks
+        print("[2] Retrieving relevant chunks...")
+        chunks = retrieve_chunks(supabase_client, query, embedding, count=5)
+        if retrieval_cache:
+            retrieval_cache.put(query, EMBEDDING_MODEL, retrieval_params(5), chunks)
     print(f"    Retrieved {len(chunks)} chunks:")
     for c in chunks:
         score = c.get("score", 0)
         print(f"      - {c['id']} ({score:.4f}) — {c.get('source_name', '?')}")
 
-    # Step 3: Build context
-    context = build_context(chunks)
+    # Step 3: Build context (token-budgeted unless context_budget is 0)
+    if context_budget:
+        context, stats = build_budgeted_context(chunks, query, context_budget)
+        print(f"    Context: {stats['tokens_used']} tokens ({stats['tokens_saved']} saved vs full top-5)")
+    else:
+        context = build_context(chunks)
     system = SYSTEM_PROMPT.format(context=context)
 
-    # Step 4: Get coaching response
-    print(f"[3] Sending to Coach K ({NEBIUS_MODEL.split(':')[-1]})...")
-    response = coach_response(nebius_client, system, query)
-
-    print(f"\n--- COACH K RESPONSE ---\n")
-    print(response)
+    # Step 4: Get coaching response (semantic cache first, when enabled)
+    hit = None
+    if response_cache:
+        if embedding is None:
+            embedding = embed_query(openai_client, query)
+        key = context_key(NEBIUS_MODEL, [c["id"] for c in chunks], system_prompt=SYSTEM_PROMPT,
+                          context_budget=context_budget, temperature=TEMPERATURE, max_tokens=MAX_TOKENS)
+        hit = response_cache.lookup(embedding, key)
+    if hit:
+        print(f"[3] Response cache hit (similarity {hit['similarity']:.3f} to \"{hit['query'][:60]}\")")
+        response = hit["response"]
+    else:
+        print(f"[3] Sending to Coach K ({NEBIUS_MODEL.split(':')[-1]})...")
+        if stream:
+            print(f"\n--- COACH K RESPONSE ---\n")
+            response, metrics = coach_response_stream(nebius_client, system, query)
+            print(f"\n\n[first token {metrics['time_to_first_token_seconds']}s | "
+                  f"inter-token {(metrics['inter_token_latency_seconds'] or 0) * 1000:.1f}ms | "
+                  f"total {metrics['total_latency_seconds']}s]")
+        else:
+            response = coach_response(nebius_client, system, query)
+        if response_cache and response:
+            response_cache.put(query, embedding, key, response)
+
+    if hit or not stream:
+        print(f"\n--- COACH K RESPONSE ---\n")
+        print(response)
     print(f"\n{'='*70}")
 
     return response
 
 
 def main():
+    parser = argparse.ArgumentParser(description="End-to-end RAG + Coach K test")
+    parser.add_argument("query", nargs="*", help="Custom question for the coach (default: built-in test queries)")
+    parser.add_argument("--context-budget", type=int, default=DEFAULT_TOKEN_BUDGET, help=f"Max estimated tokens of retrieved context, 0 = full top-5 chunks (default: {DEFAULT_TOKEN_BUDGET})")
+    parser.add_argument("--no-retrieval-cache", action="store_true", help="Always embed and search, ignoring cached retrieval results")
+    parser.add_argument("--response-cache", action="store_true", help="Answer near-identical questions over the same chunks from the semantic response cache")
+    parser.add_argument("--stream", action="store_true", help="Print the response as it is generated, with time-to-first-token")
+    parser.add_argument("--similarity-threshold", type=float, default=DEFAULT_THRESHOLD, help=f"Query similarity needed for a response cache hit (default: {DEFAULT_THRESHOLD})")
+    args = parser.parse_args()
+
     # Initialize clients
-    openai_client = OpenAI(api_key=OPENAI_API_KEY)
+    openai_client = provider_client.openai_client(OPENAI_API_KEY)
     supabase_client = create_client(SUPABASE_URL, SUPABASE_KEY)
-    nebius_client = OpenAI(api_key=NEBIUS_API_KEY, base_url=NEBIUS_BASE_URL)
+    nebius_client = provider_client.nebius_client(NEBIUS_API_KEY)
 
     # Use custom query or run test suite
-    if len(sys.argv) > 1:
-        queries = [" ".join(sys.argv[1:])]
+    if args.query:
+        queries = [" ".join(args.query)]
     else:
         queries = TEST_QUERIES
 
+    # Queries with cached retrieval results need neither an embedding nor a search
+    retrieval_cache = None if args.no_retrieval_cache else RetrievalCache()
+    response_cache = ResponseCache(threshold=args.similarity_threshold) if args.response_cache else None
+    cached = {}
+    if retrieval_cache:
+        for query in queries:
+            chunks = retrieval_cache.get(query, EMBEDDING_MODEL, retrieval_params(5))
+            if chunks is not None:
+                cached[query] = chunks
+
+    # Embed the remaining queries in one batched, cached call
+    to_embed = [q for q in queries if q not in cached]
+    embeddings, api_tokens = embed_texts(openai_client, to_embed, model=EMBEDDING_MODEL) if to_embed else ([], 0)
+    embeddings = dict(zip(to_embed, embeddings))
+    print(f"Embedded {len(to_embed)} queries ({api_tokens} API tokens, rest from cache), "
+          f"{len(cached)} served from the retrieval cache")
+
     for query in queries:
-        run_test(openai_client, supabase_client, nebius_client, query)
+        run_test(openai_client, supabase_client, nebius_client, query, embeddings.get(query), args.context_budget,
+                 chunks=cached.get(query), retrieval_cache=retrieval_cache, response_cache=response_cache,
+                 stream=args.stream)
 
     print(f"\nTested {len(queries)} queries end-to-end.")
+    if retrieval_cache:
+        print(f"Retrieval cache: {retrieval_cache.summary()}")
+        retrieval_cache.close()
+    if response_cache:
+        print(f"Response cache: {response_cache.summary()}")
+        response_cache.close()
 
 
 if __name__ == "__main__":
@@ -5,15 +5,20 @@ Runs semantic search and hybrid search for test queries.
 
 Usage: python3 scripts/test_rag_retrieval.py
        python3 scripts/test_rag_retrieval.py "your custom query"
+       python3 scripts/test_rag_retrieval.py --local   # in-process index, no Supabase
 """
 
+import argparse
 import os
-import sys
 
 from dotenv import load_dotenv
-from openai import OpenAI
 from supabase import create_client
 
+from embedding_cache import embed_texts
+from local_index import LocalIndex
+import provider_client
+from retrieval_cache import HYBRID_SEARCH_PARAMS
+
 load_dotenv()
 
 SUPABASE_URL = os.getenv("SUPABASE_URL")
@@ -32,12 +37,9 @@ TEST_QUERIES = [
 
 
 def embed_query(openai_client, query):
-    """Embed a query string."""
-    response = openai_client.embeddings.create(
-        model=EMBEDDING_MODEL,
-        input=query,
-    )
-    return response.data[0].embedding
+    """Embed a query string (through the on-disk embedding cache)."""
+    embeddings, _ = embed_texts(openai_client, [query], model=EMBEDDING_MODEL)
+    return embeddings[0]
 
 
 def semantic_search(supabase_client, embedding, threshold=0.70, count=5):
@@ -61,9 +63,7 @@ def hybrid_search(supabase_client, query_text, embedding, count=5):
             "query_text": query_text,
             "query_embedding": embedding,
             "match_count": count,
-            "full_text_weight": 1.0,
-            "semantic_weight": 1.0,
-            "rrf_k": 50,
+            **HYBRID_SEARCH_PARAMS,
         },
     ).execute()
     return result.data
@@ -88,38 +88,55 @@ def print_results(results, search_type, score_field):
         print()
 
 
-def run_test(openai_client, supabase_client, query):
-    """Run both search methods on a single query."""
+def run_test(openai_client, supabase_client, query, embedding=None, local_index=None):
+    """Run both search methods on a single query (against Supabase, or the local index if given)."""
     print(f"\n{'='*70}")
     print(f"QUERY: \"{query}\"")
     print(f"{'='*70}")
 
-    # Embed
-    embedding = embed_query(openai_client, query)
+    # Embed (skipped when main() already batch-embedded the query)
+    if embedding is None:
+        embedding = embed_query(openai_client, query)
 
     # Semantic search
     print(f"\n--- Semantic Search (cosine similarity, threshold=0.70) ---")
-    semantic_results = semantic_search(supabase_client, embedding)
+    if local_index is not None:
+        semantic_results = local_index.semantic_search(embedding)
+    else:
+        semantic_results = semantic_search(supabase_client, embedding)
     print_results(semantic_results, "semantic", "similarity")
 
     # Hybrid search
     print(f"--- Hybrid Search (RRF: semantic + full-text) ---")
-    hybrid_results = hybrid_search(supabase_client, query, embedding)
+    if local_index is not None:
+        hybrid_results = local_index.hybrid_search(query, embedding)
+    else:
+        hybrid_results = hybrid_search(supabase_client, query, embedding)
     print_results(hybrid_results, "hybrid", "score")
 
 
 def main():
-    openai_client = OpenAI(api_key=OPENAI_API_KEY)
-    supabase_client = create_client(SUPABASE_URL, SUPABASE_KEY)
+    parser = argparse.ArgumentParser(description="Test RAG retrieval")
+    parser.add_argument("query", nargs="*", help="Custom query (default: built-in test queries)")
+    parser.add_argument("--local", action="store_true", help="Search the in-process index over all_chunks.json instead of Supabase")
+    args = parser.parse_args()
+
+    openai_client = provider_client.openai_client(OPENAI_API_KEY)
+    supabase_client = None if args.local else create_client(SUPABASE_URL, SUPABASE_KEY)
+    local_index = LocalIndex.from_chunks_file(openai_client) if args.local else None
 
     # Use custom query if provided, otherwise run all test queries
-    if len(sys.argv) > 1:
-        queries = [" ".join(sys.argv[1:])]
+    if args.query:
+        queries = [" ".join(args.query)]
     else:
         queries = TEST_QUERIES
 
-    for query in queries:
-        run_test(openai_client, supabase_client, query)
+    # Embed every query in one batched, cached call
+    embeddings, api_tokens = embed_texts(openai_client, queries, model=EMBEDDING_MODEL)
+    print(f"Embedded {len(queries)} queries ({api_tokens} API tokens, rest from cache)")
+
+    for query, embedding in zip(queries, embeddings):
+        run_test(openai_client, supabase_client, query, embedding, local_index)
 
     print(f"\n{'='*70}")
     print(f"Tested {len(queries)} queries. Review results above for relevance.")
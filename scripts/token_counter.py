@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Shared token counting for chunk sizes, context budgets and cost estimates.
+
+Counts with a real tokenizer when one is available locally, and with the
+words × 1.3 heuristic chunk_research.py has always used otherwise:
+  - TOKENIZER_PATH (env) or .cache/tokenizer.json: a Hugging Face
+    tokenizer.json (Llama 3 ships one; cl100k ports exist in the same
+    format), loaded with the optional `tokenizers` package
+  - otherwise int(words × 1.3)
+
+Tokenizer counts are memoized in a bounded LRU keyed by sha256(text), so the
+cache never pins large texts in memory, and count_tokens_batch() encodes all
+cache misses in one encode_batch call. The heuristic is cheaper than hashing
+the text, so it is never cached.
+
+Usage:
+    from token_counter import count_tokens, count_tokens_batch
+    count_tokens("How should I pace the 1km runs?")
+    count_tokens_batch(paragraphs)
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+DEFAULT_TOKENIZER_PATH = os.path.join(os.path.dirname(__file__), "..", ".cache", "tokenizer.json")
+DEFAULT_CACHE_SIZE = 100_000
+HEURISTIC_TOKENS_PER_WORD = 1.3
+HEURISTIC_NAME = "words × 1.3 heuristic"
+
+
+def heuristic_tokens(text):
+    return int(len(text.split()) * HEURISTIC_TOKENS_PER_WORD)
+
+
+def load_tokenizer(path):
+    """Hugging Face tokenizer from a tokenizer.json, or None if the file or the package is missing."""
+    if not os.path.exists(path):
+        return None
+    try:
+        from tokenizers import Tokenizer
+    except ImportError:
+        print(f"  NOTE: {path} found but the `tokenizers` package is not installed — using the word heuristic")
+        return None
+    return Tokenizer.from_file(path)
+
+
+class TokenCounter:
+    """Token counts from a local tokenizer (LRU-cached by text hash) or the word heuristic. Thread-safe."""
+
+    def __init__(self, tokenizer_path=None, cache_size=DEFAULT_CACHE_SIZE):
+        path = tokenizer_path or os.getenv("TOKENIZER_PATH", DEFAULT_TOKENIZER_PATH)
+        self.tokenizer = load_tokenizer(path)
+        self.name = os.path.basename(os.path.abspath(path)) if self.tokenizer else HEURISTIC_NAME
+        self.cache_size = cache_size
+        self.hits = self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _lookup(self, key):
+        with self._lock:
+            count = self._cache.get(key)
+            if count is None:
+                self.misses += 1
+                return None
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return count
+
+    def _store(self, key, count):
+        with self._lock:
+            self._cache[key] = count
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def count(self, text):
+        if self.tokenizer is None:
+            return heuristic_tokens(text)
+        key = hashlib.sha256(text.encode("utf-8")).digest()
+        count = self._lookup(key)
+        if count is None:
+            count = len(self.tokenizer.encode(text, add_special_tokens=False).ids)
+            self._store(key, count)
+        return count
+
+    def count_batch(self, texts):
+        """Counts for many texts; every cache miss is encoded in a single batch."""
+        texts = list(texts)
+        if self.tokenizer is None:
+            return [heuristic_tokens(t) for t in texts]
+        keys = [hashlib.sha256(t.encode("utf-8")).digest() for t in texts]
+        counts = [self._lookup(k) for k in keys]
+        missing = [i for i, c in enumerate(counts) if c is None]
+        if missing:
+            encodings = self.tokenizer.encode_batch([texts[i] for i in missing], add_special_tokens=False)
+            for i, encoding in zip(missing, encodings):
+                counts[i] = len(encoding.ids)
+                self._store(keys[i], counts[i])
+        return counts
+
+
+_default_counter = None
+_default_lock = threading.Lock()
+
+
+def get_counter():
+    """Process-wide TokenCounter, created on first use."""
+    global _default_counter
+    with _default_lock:
+        if _default_counter is None:
+            _default_counter = TokenCounter()
+        return _default_counter
+
+
+def count_tokens(text):
+    return get_counter().count(text)
+
+
+def count_tokens_batch(texts):
+    return get_counter().count_batch(texts)
+
+
+def tokenizer_name():
+    return get_counter().name
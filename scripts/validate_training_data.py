@@ -4,18 +4,31 @@ Training Data Validator & Combiner
 ===================================
 Validates JSONL training files, combines them, and creates train/eval splits.
 
+Validation, stats and the combined output all come from one streaming pass
+over raw/. Each example's train/eval split comes from its content hash, and
+only examples not already in combined/ are appended (see jsonl_stream.py).
+
+--duplicates reports near-duplicate clusters (MinHash/LSH over user +
+assistant text, see near_duplicates.py) and eval examples with a
+near-duplicate in train; --dedupe keeps only the first example of each
+near-duplicate group in the stats and the --combine output.
+
 Usage:
     python scripts/validate_training_data.py                    # Validate all raw files
-    python scripts/validate_training_data.py --combine          # Validate + combine + split
+    python scripts/validate_training_data.py --combine          # Validate + combine + split (append new)
+    python scripts/validate_training_data.py --combine --full   # Rewrite combined/ from scratch
     python scripts/validate_training_data.py --stats            # Show detailed stats
+    python scripts/validate_training_data.py --duplicates       # Report near-duplicate clusters + eval leaks
+    python scripts/validate_training_data.py --combine --dedupe # Drop near-duplicates while combining
 """
 
-import json
-import os
-import random
 import argparse
 from pathlib import Path
-from collections import Counter
+from typing import Iterator
+
+from jsonl_stream import SplitWriter, example_hash, is_eval, iter_jsonl
+from near_duplicates import DEFAULT_THRESHOLD, NearDuplicateIndex, example_text
+from token_counter import count_tokens_batch, tokenizer_name
 
 RAW_DIR = Path("docs/training-data/raw")
 COMBINED_DIR = Path("docs/training-data/combined")
@@ -34,11 +47,6 @@ SYSTEM_PROMPT = (
 )
 
 
-def estimate_tokens(text: str) -> int:
-    """Estimate token count. 1 word ≈ 1.3 tokens."""
-    return int(len(text.split()) * 1.3)
-
-
 def validate_example(obj: dict, line_num: int, filename: str) -> list[str]:
     """Validate a single training example. Returns list of errors."""
     errors = []
@@ -90,82 +98,128 @@ def validate_example(obj: dict, line_num: int, filename: str) -> list[str]:
     return errors
 
 
-def validate_file(filepath: Path) -> tuple[list[dict], list[str]]:
-    """Validate a JSONL file. Returns (valid_examples, errors)."""
-    examples = []
-    errors = []
+def validate_file(filepath: Path, errors: list[str]) -> Iterator[tuple[int, dict]]:
+    """Stream (line number, example) for the valid examples of a JSONL file, appending problems to errors."""
     filename = filepath.name
 
-    with open(filepath) as f:
-        for i, line in enumerate(f, 1):
-            line = line.strip()
-            if not line:
-                continue
-
-            try:
-                obj = json.loads(line)
-            except json.JSONDecodeError as e:
-                errors.append(f"{filename}:{i}: invalid JSON — {e}")
-                continue
-
-            line_errors = validate_example(obj, i, filename)
-            if line_errors:
-                errors.extend(line_errors)
-            else:
-                examples.append(obj)
-
-    return examples, errors
-
-
-def compute_stats(examples: list[dict]) -> dict:
-    """Compute statistics about training examples."""
-    total_tokens = 0
-    assistant_lengths = []
-    turn_counts = []
-    has_system = 0
-    has_rag_context = 0
+    for i, obj, parse_error in iter_jsonl(filepath):
+        if parse_error:
+            errors.append(f"{filename}:{i}: invalid JSON — {parse_error}")
+            continue
 
-    for ex in examples:
+        line_errors = validate_example(obj, i, filename)
+        if line_errors:
+            errors.extend(line_errors)
+        else:
+            yield i, obj
+
+
+class DatasetStats:
+    """Running statistics about training examples, updated one example at a time."""
+
+    def __init__(self):
+        self.examples = 0
+        self.total_tokens = 0
+        self.has_system = 0
+        self.has_rag_context = 0
+        self.single_turn = 0
+        self.multi_turn = 0
+        self.assistant_responses = 0
+        self.assistant_words = 0
+        self.min_assistant_words = None
+        self.max_assistant_words = None
+
+    def add(self, ex: dict) -> None:
         msgs = ex["messages"]
-        example_tokens = sum(estimate_tokens(m["content"]) for m in msgs)
-        total_tokens += example_tokens
+        self.examples += 1
+        self.total_tokens += example_tokens(ex)
 
         turns = sum(1 for m in msgs if m["role"] in ("user", "assistant"))
-        turn_counts.append(turns)
+        if turns == 2:
+            self.single_turn += 1
+        elif turns > 2:
+            self.multi_turn += 1
 
         if any(m["role"] == "system" for m in msgs):
-            has_system += 1
+            self.has_system += 1
 
         # Check if system prompt contains RAG context
-        for m in msgs:
-            if m["role"] == "system" and "Relevant knowledge:" in m["content"]:
-                has_rag_context += 1
-                break
+        if any(m["role"] == "system" and "Relevant knowledge:" in m["content"] for m in msgs):
+            self.has_rag_context += 1
 
         for m in msgs:
             if m["role"] == "assistant":
-                assistant_lengths.append(len(m["content"].split()))
+                words = len(m["content"].split())
+                self.assistant_responses += 1
+                self.assistant_words += words
+                if self.min_assistant_words is None or words < self.min_assistant_words:
+                    self.min_assistant_words = words
+                if self.max_assistant_words is None or words > self.max_assistant_words:
+                    self.max_assistant_words = words
+
+    def summary(self) -> dict:
+        avg_assistant = self.assistant_words / self.assistant_responses if self.assistant_responses else 0
+        return {
+            "total_examples": self.examples,
+            "total_tokens": self.total_tokens,
+            "avg_tokens_per_example": self.total_tokens // self.examples if self.examples else 0,
+            "has_system_prompt": self.has_system,
+            "has_rag_context": self.has_rag_context,
+            "single_turn": self.single_turn,
+            "multi_turn": self.multi_turn,
+            "avg_assistant_words": int(avg_assistant),
+            "min_assistant_words": self.min_assistant_words or 0,
+            "max_assistant_words": self.max_assistant_words or 0,
+        }
+
+
+def compute_stats(examples) -> dict:
+    """Compute statistics about training examples (any iterable, consumed once)."""
+    stats = DatasetStats()
+    for ex in examples:
+        stats.add(ex)
+    return stats.summary()
+
 
-    avg_assistant = sum(assistant_lengths) / len(assistant_lengths) if assistant_lengths else 0
+def example_tokens(ex: dict) -> int:
+    """Token count of all message content (local tokenizer if present, else 1 word ≈ 1.3 tokens)."""
+    return sum(count_tokens_batch(m["content"] for m in ex["messages"]))
 
-    return {
-        "total_examples": len(examples),
-        "total_tokens": total_tokens,
-        "avg_tokens_per_example": total_tokens // len(examples) if examples else 0,
-        "has_system_prompt": has_system,
-        "has_rag_context": has_rag_context,
-        "single_turn": sum(1 for t in turn_counts if t == 2),
-        "multi_turn": sum(1 for t in turn_counts if t > 2),
-        "avg_assistant_words": int(avg_assistant),
-        "min_assistant_words": min(assistant_lengths) if assistant_lengths else 0,
-        "max_assistant_words": max(assistant_lengths) if assistant_lengths else 0,
-    }
+
+def print_duplicate_report(dup_index: NearDuplicateIndex, splits: dict, tokens: dict) -> None:
+    """Near-duplicate clusters, their redundant token cost, and eval examples that leak into train."""
+    clusters = dup_index.clusters()
+    redundant = [key for cluster in clusters for key in cluster[1:]]
+    redundant_tokens = sum(tokens[key] for key in redundant)
+
+    print(f"\n{'='*60}")
+    print(f"Near-duplicates (Jaccard ≥ {dup_index.threshold}):")
+    print(f"  {len(clusters)} clusters, {len(redundant)} redundant examples (~{redundant_tokens:,} tokens, "
+          f"${redundant_tokens * 2 / 1_000_000 * 10:.2f} over 2 epochs)")
+    for n, cluster in enumerate(clusters[:20], 1):
+        print(f"  Cluster {n} ({len(cluster)}): {', '.join(cluster)}")
+    if len(clusters) > 20:
+        print(f"  ... {len(clusters) - 20} more")
+
+    leaks = []
+    for cluster in clusters:
+        train_keys = [k for k in cluster if splits.get(k) == "train"]
+        if train_keys:
+            leaks.extend((k, train_keys[0]) for k in cluster if splits.get(k) == "eval")
+    print(f"\n  Eval examples with a near-duplicate in train: {len(leaks)}")
+    for eval_key, train_key in leaks[:20]:
+        print(f"    {eval_key} ≈ {train_key}")
 
 
 def main():
     parser = argparse.ArgumentParser(description="Validate and combine training data")
     parser.add_argument("--combine", action="store_true", help="Combine + split into train/eval")
     parser.add_argument("--stats", action="store_true", help="Show detailed stats")
+    parser.add_argument("--full", action="store_true", help="With --combine, rewrite combined/ instead of appending new examples")
+    parser.add_argument("--duplicates", action="store_true", help="Report near-duplicate clusters and eval examples duplicated in train")
+    parser.add_argument("--dedupe", action="store_true", help="Keep only the first of each near-duplicate group (stats and --combine)")
+    parser.add_argument("--dup-threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help=f"Estimated Jaccard similarity that counts as a near-duplicate (default: {DEFAULT_THRESHOLD})")
     args = parser.parse_args()
 
     # Find all JSONL files
@@ -174,22 +228,52 @@ def main():
         print(f"No JSONL files found in {RAW_DIR}")
         return
 
-    all_examples = []
     all_errors = []
     file_counts = {}
+    dataset = DatasetStats()
+    split_counts = {"train": 0, "eval": 0}
+    if args.combine:
+        COMBINED_DIR.mkdir(parents=True, exist_ok=True)
+    # Tag the index with this tool and its filter so switching to combine_training_data.py
+    # (or toggling --dedupe) rewrites combined/ instead of appending to another filter's output
+    source = f"validate --dedupe {args.dup_threshold}" if args.dedupe else "validate"
+    combined = SplitWriter(COMBINED_DIR, EVAL_RATIO, full=args.full, source=source) if args.combine else None
+    dup_index = NearDuplicateIndex(args.dup_threshold) if (args.duplicates or args.dedupe) else None
+    splits, tokens = {}, {}  # example key → split of kept examples / estimated tokens
+    dropped = []  # (key, near-duplicate of)
 
     print(f"Validating {len(raw_files)} training data files...\n")
 
+    # Single pass: validate, accumulate stats and (with --combine) stream valid examples to all.jsonl
     for filepath in raw_files:
-        examples, errors = validate_file(filepath)
-        all_examples.extend(examples)
+        errors = []
+        count = 0
+        for line_num, ex in validate_file(filepath, errors):
+            if dup_index is not None:
+                key = f"{filepath.name}:{line_num}"
+                sig = dup_index.signature(example_text(ex))
+                matches = dup_index.query(sig) if args.dedupe else []
+                dup_index.add(key, sig)
+                tokens[key] = example_tokens(ex)
+                if matches:
+                    dropped.append((key, matches[0][0]))
+                    continue
+                splits[key] = "eval" if is_eval(example_hash(ex), EVAL_RATIO) else "train"
+            count += 1
+            dataset.add(ex)
+            if combined:
+                split_counts[combined.add(ex)] += 1
         all_errors.extend(errors)
-        file_counts[filepath.name] = len(examples)
+        file_counts[filepath.name] = count
         status = "✓" if not errors else f"✗ ({len(errors)} errors)"
-        print(f"  {filepath.name}: {len(examples)} examples {status}")
+        print(f"  {filepath.name}: {count} examples {status}")
+    if combined:
+        combined.close()
 
+    stats = dataset.summary()
+    total_valid = stats["total_examples"]
     print(f"\n{'='*60}")
-    print(f"Total valid examples: {len(all_examples)}")
+    print(f"Total valid examples: {total_valid}")
     print(f"Total errors: {len(all_errors)}")
 
     if all_errors:
@@ -197,12 +281,21 @@ def main():
         for e in all_errors[:20]:
             print(f"  {e}")
 
-    if args.stats and all_examples:
-        stats = compute_stats(all_examples)
+    if dropped:
+        dropped_tokens = sum(tokens[key] for key, _ in dropped)
+        print(f"\nDropped {len(dropped)} near-duplicates (~{dropped_tokens:,} tokens, "
+              f"${dropped_tokens * 2 / 1_000_000 * 10:.2f} over 2 epochs):")
+        for key, original in dropped[:20]:
+            print(f"  {key} ≈ {original}")
+
+    if args.duplicates:
+        print_duplicate_report(dup_index, splits, tokens)
+
+    if args.stats and total_valid:
         print(f"\n{'='*60}")
         print(f"Dataset Statistics:")
         print(f"  Total examples: {stats['total_examples']}")
-        print(f"  Total tokens: {stats['total_tokens']:,}")
+        print(f"  Total tokens: {stats['total_tokens']:,} ({tokenizer_name()})")
         print(f"  Avg tokens/example: {stats['avg_tokens_per_example']}")
         print(f"  With system prompt: {stats['has_system_prompt']}")
         print(f"  With RAG context: {stats['has_rag_context']}")
@@ -214,48 +307,33 @@ def main():
         cost_2_epochs = stats["total_tokens"] * 2 / 1_000_000 * 10
         print(f"\n  Estimated fine-tuning cost (2 epochs): ${max(cost_2_epochs, 3.00):.2f}")
 
-    if args.combine and all_examples:
-        COMBINED_DIR.mkdir(parents=True, exist_ok=True)
-
-        # Shuffle
-        random.seed(42)
-        random.shuffle(all_examples)
-
-        # Split
-        eval_count = max(1, int(len(all_examples) * EVAL_RATIO))
-        eval_examples = all_examples[:eval_count]
-        train_examples = all_examples[eval_count:]
-
-        # Write
-        train_path = COMBINED_DIR / "train.jsonl"
-        eval_path = COMBINED_DIR / "eval.jsonl"
-
-        with open(train_path, "w") as f:
-            for ex in train_examples:
-                f.write(json.dumps(ex, ensure_ascii=False) + "\n")
+    if combined:
+        train_count, eval_count = split_counts["train"], split_counts["eval"]
+        action = "rewrote" if combined.full else "appended"
 
-        with open(eval_path, "w") as f:
-            for ex in eval_examples:
-                f.write(json.dumps(ex, ensure_ascii=False) + "\n")
+        totals = combined.totals
 
-        print(f"\nCombined output:")
-        print(f"  Train: {len(train_examples)} examples → {train_path}")
-        print(f"  Eval:  {len(eval_examples)} examples → {eval_path}")
+        print(f"\nSplit: {train_count} train / {eval_count} eval")
+        print(f"Combined output ({action} {combined.written['train']} train / {combined.written['eval']} eval):")
+        print(f"  Train: {totals['train']} examples in {combined.paths['train']}")
+        print(f"  Eval:  {totals['eval']} examples in {combined.paths['eval']}")
+        print(f"  All:   {totals['train'] + totals['eval']} examples in {combined.paths['all']}")
+        if combined.removed:
+            print(f"  WARNING: {combined.removed} combined examples are no longer valid or in raw/ — rerun with --full to drop them")
 
         # Write stats file
-        stats = compute_stats(all_examples)
         stats_path = Path("docs/training-data/stats.md")
         with open(stats_path, "w") as f:
             f.write("# Training Data Statistics\n\n")
             f.write(f"**Total examples**: {stats['total_examples']}\n")
-            f.write(f"**Train**: {len(train_examples)} | **Eval**: {len(eval_examples)}\n")
-            f.write(f"**Total tokens**: {stats['total_tokens']:,}\n")
+            f.write(f"**Train**: {train_count} | **Eval**: {eval_count}\n")
+            f.write(f"**Total tokens**: {stats['total_tokens']:,} ({tokenizer_name()})\n")
             f.write(f"**Avg tokens/example**: {stats['avg_tokens_per_example']}\n\n")
             f.write("## Per-File Breakdown\n\n")
             f.write("| File | Examples |\n|------|--------:|\n")
             for name, count in sorted(file_counts.items()):
                 f.write(f"| {name} | {count} |\n")
-            f.write(f"| **Total** | **{len(all_examples)}** |\n\n")
+            f.write(f"| **Total** | **{total_valid}** |\n\n")
             f.write("## Category Breakdown\n\n")
             f.write(f"- Single-turn: {stats['single_turn']}\n")
             f.write(f"- Multi-turn: {stats['multi_turn']}\n")